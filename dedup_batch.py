@@ -0,0 +1,331 @@
+import argparse
+import csv
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from dedup_engine import (
+    CONFIG, DIAGNOSTIC_SAMPLES_PER_CATEGORY, DUPLICATES_FILENAME, IN_FILE_DUPLICATES_FILENAME, MATCH_RULE_COLUMN, UNIQUES_FILENAME, CollectedWarnings,
+    Diagnostics, InFileDuplicates, ProcessingCancelled, _null_log, _prepare_fuzzy, _report, _warn, classify_records, create_unique_id, create_unique_ids,
+    load_crm_index, output_filename, read_new_records_file, resolve_compare_columns, write_output_file
+)
+
+
+# --- Screening many new records files against one CRM index ---
+# The CRM index is built (or loaded from the cache) once. The files are read and their IDs
+# computed by worker processes, several at a time, while the main process compares them in
+# the order given and writes each file's outputs to its own folder. With cumulative, the
+# contacts accepted from a file are added to the index, so they count as duplicates in the
+# files after it. A folder can also be watched: files appearing in it are screened as soon as
+# they have stopped growing.
+
+NEW_RECORDS_EXTENSIONS = ('.csv', '.xlsx', '.xls', '.parquet')
+BATCH_SUMMARY_FILENAME = "batch_summary.csv"
+SUMMARY_COLUMNS = ['File', 'Records', 'Unique', 'Duplicates', 'Possible duplicates', 'Repeated', 'Rejected rows', 'Output folder', 'Error']
+WATCH_INTERVAL_SECONDS = 5.0
+
+
+def list_new_records_files(paths):
+    # Files to screen, in order: folders are expanded to the new records files they contain (sorted by name)
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.lower().endswith(NEW_RECORDS_EXTENSIONS) and not name.startswith(('~$', '.')) and name != BATCH_SUMMARY_FILENAME
+            ))
+        else:
+            files.append(path)
+    unique_files = []
+    seen = set()
+    for filepath in files:
+        if os.path.abspath(filepath) not in seen:
+            seen.add(os.path.abspath(filepath))
+            unique_files.append(filepath)
+    return unique_files
+
+def _read_new_records_worker(filepath, config, keep_rows, excel_cache=None, keep_nameless=False):
+    # Runs in a worker process: returns (records, header, record_ids, warnings, log messages, error)
+    messages = []
+    warnings = CollectedWarnings(keep_rows)
+    records, header, error = read_new_records_file(filepath, config['NEW_RECORDS_NAME_COL'], config['NEW_RECORDS_FORENAME_COL'],
+                                                   config['NEW_RECORDS_CSV_DELIMITER'], messages.append, diagnostics=warnings, excel_cache=excel_cache,
+                                                   keep_nameless=keep_nameless)
+    record_ids = None
+    if not error and header:
+        name_key, forename_key, compare_error = resolve_compare_columns(header, config)
+        if not compare_error:
+            record_ids = create_unique_ids([r.get(name_key, "") for r in records], [r.get(forename_key, "") for r in records])
+    return records, header, record_ids, warnings.entries, messages, error
+
+class BatchScreener:
+    # Holds the CRM index between files. fuzzy is a FuzzyMatcher (its matches are reset for
+    # each file), keep_policy a parse_keep_policy value and rules MatchRules, as for
+    # run_deduplication. summary gets one dict per screened file (see SUMMARY_COLUMNS).
+    # Outputs are written in output_format (see OUTPUT_FORMATS); an ExcelParquetCache keeps
+    # Parquet copies of the Excel files screened.
+
+    def __init__(self, crm_filepath, output_dir, config=None, log=None, cache=None, jobs=1, fuzzy=None, keep_policy=None, rules=None,
+                 cumulative=False, max_warnings=DIAGNOSTIC_SAMPLES_PER_CATEGORY, write_rejected_rows=False, output_format='csv', excel_cache=None):
+        self.crm_filepath = crm_filepath
+        self.output_dir = output_dir
+        self.config = config or CONFIG
+        self.log = log or _null_log
+        self.cache = cache
+        self.jobs = jobs if jobs and jobs > 0 else (os.cpu_count() or 1)
+        self.fuzzy = fuzzy
+        self.keep_policy = keep_policy
+        self.rules = rules
+        self.cumulative = cumulative
+        self.max_warnings = max_warnings
+        self.write_rejected_rows = write_rejected_rows
+        self.output_format = output_format
+        self.excel_cache = excel_cache
+        self.index = None
+        self.summary = []
+        self._output_folders = set()
+
+    def load_index(self, progress=None):
+        # Returns an error message or None
+        crm_diagnostics = Diagnostics(self.log, self.max_warnings)
+        try:
+            self.index, error = load_crm_index(self.crm_filepath, self.config, self.log, self.cache, self.jobs, progress, crm_diagnostics, self.rules)
+        except ProcessingCancelled:
+            return "Processing cancelled."
+        if error:
+            return error
+        self.log(crm_diagnostics.summary())
+        self.fuzzy = _prepare_fuzzy(self.fuzzy, self.index, self.rules, self.log)
+        if self.fuzzy is not None and self.cumulative:
+            self.log("Note: Fuzzy matching only compares against the CRM file, not the contacts accepted from earlier files.\n")
+        return None
+
+    def process_files(self, filepaths, progress=None):
+        # Screens the files in order; a file that fails is recorded in the summary and skipped.
+        # Returns the summary rows of these files.
+        keep_rows = self.write_rejected_rows
+        results = []
+        total = len(filepaths)
+        if self.jobs == 1 or total == 1:
+            reads = (_read_new_records_worker(filepath, self.config, keep_rows, self.excel_cache, self.rules is not None) for filepath in filepaths)
+            for done, (filepath, read) in enumerate(zip(filepaths, reads)):
+                _report(progress, 'batch', done, total)
+                results.append(self._screen_file(filepath, read, progress))
+        else:
+            with ProcessPoolExecutor(max_workers=min(self.jobs, total)) as pool:
+                # A few files ahead of the one being compared, so finished reads don't pile up in memory
+                pending = deque()
+                next_file = 0
+                try:
+                    for done, filepath in enumerate(filepaths):
+                        while next_file < total and len(pending) < self.jobs + 1:
+                            pending.append(pool.submit(_read_new_records_worker, filepaths[next_file], self.config, keep_rows, self.excel_cache, self.rules is not None))
+                            next_file += 1
+                        _report(progress, 'batch', done, total)
+                        results.append(self._screen_file(filepath, pending.popleft().result(), progress))
+                except ProcessingCancelled:
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    raise
+        _report(progress, 'batch', total, total)
+        return results
+
+    def _output_folder(self, filepath):
+        name = os.path.splitext(os.path.basename(filepath))[0]
+        if name in self._output_folders: # e.g. list.csv and list.xlsx
+            name = os.path.basename(filepath).replace('.', '_')
+        self._output_folders.add(name)
+        return os.path.join(self.output_dir, name)
+
+    def _screen_file(self, filepath, read, progress):
+        records, header, record_ids, warnings, messages, error = read
+        filename = os.path.basename(filepath)
+        row = dict.fromkeys(SUMMARY_COLUMNS, '')
+        row['File'] = filename
+        self.log(f"\n=== {filename} ===\n")
+        self.log(''.join(messages))
+        folder = self._output_folder(filepath)
+        diagnostics = Diagnostics(self.log, self.max_warnings, os.path.join(folder, "rejected_rows.csv") if self.write_rejected_rows else None)
+        try:
+            if self.write_rejected_rows:
+                os.makedirs(folder, exist_ok=True)
+            for category, row_number, message, values in warnings:
+                _warn(self.log, diagnostics, category, row_number, message, values)
+            if not error and not header:
+                error = "Critical Error: No valid header could be determined from New Records file. Cannot compare or save."
+            if not error:
+                error = self._classify_and_save(records, header, record_ids, folder, progress, diagnostics, row)
+            row['Rejected rows'] = diagnostics.total()
+            self.log(diagnostics.summary())
+        finally:
+            diagnostics.close()
+        if error:
+            self.log(error + "\n")
+            row['Error'] = error.splitlines()[0]
+        self.summary.append(row)
+        return row
+
+    def _classify_and_save(self, records, header, record_ids, folder, progress, diagnostics, row):
+        in_file = InFileDuplicates(self.keep_policy) if self.keep_policy else None
+        if self.fuzzy is not None:
+            self.fuzzy.matches = []
+        uniques, duplicates, error = classify_records(records, header, self.index, self.config, self.log, record_ids, progress, diagnostics,
+                                                      self.fuzzy, in_file, self.rules)
+        if error:
+            return error
+
+        os.makedirs(folder, exist_ok=True)
+        outputs = [(uniques, header, UNIQUES_FILENAME),
+                   (duplicates, header + [MATCH_RULE_COLUMN] if self.rules is not None else header, DUPLICATES_FILENAME)]
+        if self.fuzzy is not None:
+            from dedup_fuzzy import FUZZY_MATCHES_FILENAME
+            outputs.append((*self.fuzzy.output_records(header), FUZZY_MATCHES_FILENAME))
+        if in_file is not None:
+            outputs.append((*in_file.output_records(header), IN_FILE_DUPLICATES_FILENAME))
+        for data, data_header, filename in outputs:
+            save_error = write_output_file(os.path.join(folder, output_filename(filename, self.output_format)), data, data_header)
+            if save_error:
+                return save_error
+        self.log(f"Unique: {len(uniques)}, duplicates: {len(duplicates)}. Saved to: {folder}\n")
+
+        if self.cumulative:
+            self._add_to_index(uniques, header)
+        row.update({
+            'Records': len(records),
+            'Unique': len(uniques),
+            'Duplicates': len(duplicates),
+            'Possible duplicates': len(self.fuzzy.matches) if self.fuzzy is not None else '',
+            'Repeated': in_file.removed_count() if in_file is not None else '',
+            'Output folder': folder,
+        })
+        return None
+
+    def _add_to_index(self, uniques, header):
+        # Accepted contacts become duplicates for the next files
+        name_key, forename_key, _ = resolve_compare_columns(header, self.config)
+        if self.rules is not None:
+            rule_columns, _ = self.rules.resolve_new_columns(header, name_key, forename_key)
+            for record in uniques:
+                self.index.update(self.rules.row_keys(record, rule_columns))
+        else:
+            self.index.update(create_unique_id(record.get(name_key, ""), record.get(forename_key, "")) for record in uniques)
+
+    def watch(self, folder, progress=None, interval=WATCH_INTERVAL_SECONDS, stop=None):
+        # Screens the files already in folder, then each new one once its size has stopped
+        # changing between two checks, until progress is cancelled, stop() returns True or Ctrl+C
+        seen = set()
+        sizes = {}
+        self.log(f"\nWatching {folder} for new records files (every {interval:g} s)...\n")
+        try:
+            while not (stop is not None and stop()):
+                ready = []
+                for filepath in list_new_records_files([folder]):
+                    if filepath in seen:
+                        continue
+                    try:
+                        size = os.path.getsize(filepath)
+                    except OSError:
+                        continue
+                    if sizes.get(filepath) == size:
+                        ready.append(filepath)
+                    sizes[filepath] = size
+                if ready:
+                    seen.update(ready)
+                    self.process_files(ready, progress)
+                    self.write_summary()
+                _report(progress, 'watch', len(seen), None)
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+
+    def write_summary(self):
+        # Writes BATCH_SUMMARY_FILENAME to output_dir; returns an error message or None
+        filepath = os.path.join(self.output_dir, BATCH_SUMMARY_FILENAME)
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            with open(filepath, mode='w', newline='', encoding='utf-8') as file:
+                writer = csv.DictWriter(file, fieldnames=SUMMARY_COLUMNS)
+                writer.writeheader()
+                writer.writerows(self.summary)
+            return None
+        except Exception as e:
+            return f"Error saving '{BATCH_SUMMARY_FILENAME}': {e}"
+
+    def summary_text(self):
+        lines = [f"{'File':<32} {'Records':>9} {'Unique':>9} {'Duplicates':>10}  Error\n"]
+        for row in self.summary:
+            lines.append(f"{row['File'][:32]:<32} {row['Records']!s:>9} {row['Unique']!s:>9} {row['Duplicates']!s:>10}  {row['Error']}\n")
+        totals = [sum(row[column] for row in self.summary if isinstance(row[column], int)) for column in ('Records', 'Unique', 'Duplicates')]
+        lines.append(f"{'Total (' + str(len(self.summary)) + ' files)':<32} {totals[0]:>9} {totals[1]:>9} {totals[2]:>10}\n")
+        return ''.join(lines)
+
+def main(argv=None):
+    from dedup_cache import CrmIndexCache, DEFAULT_CACHE_DIR
+    from dedup_cli import CONFIG_OPTIONS, parquet_options_error
+    from dedup_engine import OUTPUT_FORMATS, parse_keep_policy
+    from dedup_fuzzy import FuzzyMatcher, parse_fuzzy_threshold
+    from dedup_parquet import ExcelParquetCache
+    from dedup_rules import parse_match_rules
+
+    parser = argparse.ArgumentParser(description="Screen many new records files against one CRM export.")
+    parser.add_argument('crm_file', help="CRM export (CSV or Parquet)")
+    parser.add_argument('new_records', nargs='+', help="New records files (Excel, CSV or Parquet) and/or folders containing them")
+    parser.add_argument('-o', '--output-dir', default='.', help="Folder for the outputs: one subfolder per file, plus batch_summary.csv")
+    parser.add_argument('-q', '--quiet', action='store_true', help="Only print errors and the summary")
+    parser.add_argument('-j', '--jobs', type=int, default=0, help="Files read at the same time by worker processes (0 = one per CPU core, default)")
+    parser.add_argument('--cumulative', action='store_true', help="Contacts accepted from a file count as duplicates in the files after it")
+    parser.add_argument('--watch', action='store_true', help="Keep watching the (single) folder given and screen new files as they arrive; stop with Ctrl+C")
+    parser.add_argument('--watch-interval', type=float, default=WATCH_INTERVAL_SECONDS, help=f"Seconds between checks of the watched folder (default: {WATCH_INTERVAL_SECONDS:g})")
+    parser.add_argument('--rejected-rows', action='store_true', help="Write the rejected rows of each file to rejected_rows.csv in its folder")
+    parser.add_argument('--max-warnings', type=int, default=DIAGNOSTIC_SAMPLES_PER_CATEGORY, help=f"Warnings printed per kind of problem and file (default: {DIAGNOSTIC_SAMPLES_PER_CATEGORY})")
+    parser.add_argument('--no-cache', action='store_true', help="Always rebuild the CRM index instead of using the on-disk cache")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help=f"Folder of the CRM index cache (default: {DEFAULT_CACHE_DIR})")
+    parser.add_argument('--incremental', action='store_true', help="The CRM export only grows by appended rows: keep a checkpoint with the cached index and only read the rows added since (rebuilt when the file was otherwise changed)")
+    parser.add_argument('--output-format', choices=OUTPUT_FORMATS, default='csv', help="Format of the output files (default: csv; parquet needs pyarrow)")
+    parser.add_argument('--excel-cache', action='store_true', help="Keep a Parquet copy of each Excel file read in the cache folder, so later runs on the same file skip decoding it (needs pyarrow)")
+    for option, key, help_text in CONFIG_OPTIONS:
+        parser.add_argument(option, dest=key, default=CONFIG[key], help=f"{help_text} (default: '{CONFIG[key]}')")
+    args = parser.parse_args(argv)
+    config = {key: getattr(args, key) for _, key, _ in CONFIG_OPTIONS}
+    log = (lambda message: None) if args.quiet else sys.stderr.write
+
+    if args.watch and (len(args.new_records) != 1 or not os.path.isdir(args.new_records[0])):
+        parser.error("--watch needs exactly one folder")
+    if args.incremental and args.no_cache:
+        parser.error("--incremental keeps its checkpoint in the cache and can't be combined with --no-cache")
+    fuzzy_threshold, threshold_error = parse_fuzzy_threshold(config['FUZZY_THRESHOLD'])
+    keep_policy, policy_error = parse_keep_policy(config['IN_FILE_DUPLICATES_KEEP'])
+    rules, rules_error = parse_match_rules(config['MATCH_RULES'])
+    config_error = threshold_error or policy_error or rules_error or parquet_options_error([args.crm_file], args.output_format, args.excel_cache)
+    if config_error:
+        sys.stderr.write(config_error + "\n")
+        return 1
+
+    screener = BatchScreener(args.crm_file, args.output_dir, config, log, None if args.no_cache else CrmIndexCache(args.cache_dir, incremental=args.incremental), args.jobs,
+                             FuzzyMatcher(fuzzy_threshold) if fuzzy_threshold else None, keep_policy, rules, args.cumulative,
+                             args.max_warnings, args.rejected_rows, args.output_format, ExcelParquetCache(args.cache_dir) if args.excel_cache else None)
+    error = screener.load_index()
+    if error:
+        sys.stderr.write(error + "\n")
+        return 1
+    if args.watch:
+        screener.watch(args.new_records[0], interval=args.watch_interval)
+    else:
+        files = list_new_records_files(args.new_records)
+        if not files:
+            sys.stderr.write("Error: No new records files to screen.\n")
+            return 1
+        screener.process_files(files)
+
+    save_error = screener.write_summary()
+    if save_error:
+        sys.stderr.write(save_error + "\n")
+        return 1
+    sys.stdout.write(screener.summary_text())
+    return 1 if any(row['Error'] for row in screener.summary) else 0
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support() # Needed by the worker processes in frozen builds
+    sys.exit(main())
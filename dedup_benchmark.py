@@ -0,0 +1,256 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from dedup_datagen import DEFAULT_SEED, generate_dataset, parse_row_count
+from dedup_report import peak_rss_mb
+
+
+# --- Benchmarks of each processing stage ---
+# Every stage runs in a fresh process so its peak RSS is its own. Results can be saved as a
+# baseline and later runs compared against it:
+#     python dedup_benchmark.py --sizes 10k,100k --save-baseline benchmark_baseline.json
+#     python dedup_benchmark.py --sizes 10k,100k --baseline benchmark_baseline.json
+# The exit code is 1 when a stage got slower or bigger than the tolerance allows.
+# The 'import' stage times the cold start of the CLI and the GUI (importing them in a fresh
+# interpreter) against a fixed budget, and fails when one of them loads pandas or NumPy,
+# which should only be imported once an Excel file or a compact index is used.
+# The 'incremental' stage times reading rows appended to a CRM export indexed with
+# --incremental, the export having been indexed while its last row was half written, and
+# fails when the index then differs from a full rebuild.
+
+STAGES = ['import', 'normalize', 'crm_read', 'crm_index', 'incremental', 'new_csv', 'new_xlsx', 'compare', 'stream']
+IMPORT_BUDGETS = {'dedup_cli': 0.25, 'duplicate_eliminator': 0.35} # Seconds
+HEAVY_MODULES = ['pandas', 'numpy', 'openpyxl', 'xlrd']
+IMPORT_REPEATS = 3 # Best of, to leave out a cold disk cache
+DEFAULT_SIZES = '10k,100k,1m,10m'
+DEFAULT_TOLERANCE = 0.15 # Allowed drop in rows/s (and growth in peak RSS) before a regression is reported
+DEFAULT_WORK_DIR = os.path.join(tempfile.gettempdir(), "dedup_benchmark")
+
+
+def _run_stage(stage, paths):
+    # Runs in a child process: returns (seconds, rows processed, peak RSS in MB)
+    import dedup_engine as engine
+    config = dict(engine.CONFIG)
+    timed_rows = 0
+
+    if stage == 'normalize':
+        import csv
+        with open(paths['crm'], encoding='utf-8', newline='') as file:
+            raw_names = [value for row in csv.reader(file, delimiter=';') for value in row[:2]]
+        engine._normalize_text.cache_clear()
+        error = None
+        start = time.perf_counter()
+        for value in raw_names:
+            engine.normalize_name_part(value)
+        timed_rows = len(raw_names)
+    elif stage == 'crm_read':
+        start = time.perf_counter()
+        records, _, _, error = engine.read_crm_csv_file(paths['crm'], config['CRM_DELIMITER'], config['CRM_LAST_NAME_COL'], config['CRM_FIRST_NAME_COL'])
+        timed_rows = len(records or [])
+    elif stage == 'crm_index':
+        with open(paths['crm'], 'rb') as file:
+            timed_rows = sum(1 for _ in file) - 1
+        start = time.perf_counter()
+        index, error = engine.load_crm_index(paths['crm'], config, diagnostics=engine.Diagnostics())
+    elif stage == 'incremental':
+        import csv
+        import io
+        from dedup_cache import CrmIndexCache
+        delimiter = config['CRM_DELIMITER']
+        with open(paths['crm'], encoding='utf-8', newline='') as file:
+            reader = csv.reader(file, delimiter=delimiter)
+            header = next(reader)
+            columns = [header.index(config['CRM_LAST_NAME_COL']), header.index(config['CRM_FIRST_NAME_COL'])]
+            rows = [[row[i] for i in columns] for row in reader] # First name last, so a half written row keeps both columns
+        def csv_bytes(csv_rows):
+            text = io.StringIO()
+            csv.writer(text, delimiter=delimiter, lineterminator='\n').writerows(csv_rows)
+            return text.getvalue().encode('utf-8')
+        cut_row = next(i for i in range(len(rows) * 9 // 10, len(rows)) if len(rows[i][1]) >= 4 and rows[i][1].isascii() and rows[i][1].isalpha())
+        half_row = csv_bytes([rows[cut_row]])
+        first_part = csv_bytes([[header[i] for i in columns]] + rows[:cut_row]) + half_row[:-3] # As when the export is still being written
+        appended = half_row[-3:] + csv_bytes(rows[cut_row + 1:])
+        timed_rows = len(rows) - cut_row
+        def check_incremental(index, error):
+            # The index must be the one a full read of the file gives, whatever was cached before
+            if error:
+                raise RuntimeError(error)
+            expected, error = engine.build_crm_id_index(crm_path, delimiter, config['CRM_LAST_NAME_COL'], config['CRM_FIRST_NAME_COL'], diagnostics=engine.Diagnostics())
+            if error or index != expected:
+                raise RuntimeError(error or f"Incremental CRM index differs from a full rebuild ({len(index ^ expected)} IDs)")
+        with tempfile.TemporaryDirectory() as work_dir:
+            crm_path = os.path.join(work_dir, 'crm.csv')
+            cache = CrmIndexCache(os.path.join(work_dir, 'cache'), incremental=True)
+            with open(crm_path, 'wb') as file:
+                file.write(first_part)
+            check_incremental(*engine.load_crm_index(crm_path, config, cache=cache, diagnostics=engine.Diagnostics()))
+            with open(crm_path, 'ab') as file:
+                file.write(appended)
+            start = time.perf_counter()
+            index, error = engine.load_crm_index(crm_path, config, cache=cache, diagnostics=engine.Diagnostics())
+            elapsed = time.perf_counter() - start
+            check_incremental(index, error)
+        return elapsed, timed_rows, peak_rss_mb()
+    elif stage in ('new_csv', 'new_xlsx'):
+        start = time.perf_counter()
+        records, _, error = engine.read_new_records_file(paths[stage], config['NEW_RECORDS_NAME_COL'], config['NEW_RECORDS_FORENAME_COL'],
+                                                         config['NEW_RECORDS_CSV_DELIMITER'], diagnostics=engine.Diagnostics())
+        timed_rows = len(records or [])
+    elif stage == 'compare':
+        index, error = engine.load_crm_index(paths['crm'], config, diagnostics=engine.Diagnostics())
+        records, header, error = engine.read_new_records_file(paths['new_csv'], config['NEW_RECORDS_NAME_COL'], config['NEW_RECORDS_FORENAME_COL'],
+                                                              config['NEW_RECORDS_CSV_DELIMITER'], diagnostics=engine.Diagnostics())
+        engine._normalize_text.cache_clear()
+        start = time.perf_counter()
+        _, _, error = engine.classify_records(records, header, index, config, diagnostics=engine.Diagnostics())
+        timed_rows = len(records)
+    elif stage == 'stream':
+        with open(paths['new_csv'], 'rb') as file:
+            timed_rows = sum(1 for _ in file) - 1
+        with tempfile.TemporaryDirectory() as output_dir:
+            start = time.perf_counter()
+            _, _, _, error = engine.stream_deduplication(paths['crm'], paths['new_csv'], output_dir, config)
+            elapsed = time.perf_counter() - start
+        if error:
+            raise RuntimeError(error)
+        return elapsed, timed_rows, peak_rss_mb()
+    else:
+        raise ValueError(f"Unknown stage '{stage}'")
+
+    elapsed = time.perf_counter() - start
+    if error:
+        raise RuntimeError(error)
+    return elapsed, timed_rows, peak_rss_mb()
+
+def run_stage(stage, paths):
+    # Fresh interpreter per stage, so imports and memory don't leak from one stage to the next
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(_run_stage, (stage, paths))
+
+def measure_import(module):
+    # Returns (seconds to import module in a fresh interpreter, heavy modules it loaded)
+    code = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "seconds = time.perf_counter() - start\n"
+        f"print(json.dumps([seconds, [name for name in {HEAVY_MODULES!r} if name in sys.modules]]))\n"
+    )
+    best = None
+    for _ in range(IMPORT_REPEATS):
+        output = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout
+        seconds, heavy = json.loads(output)
+        best = seconds if best is None else min(best, seconds)
+    return best, heavy
+
+def compare_import(result, baseline):
+    # Returns (change description, regression?) for one import time. Only the budget and the heavy
+    # modules count: tens of milliseconds vary too much from run to run for the tolerance.
+    regression = result['seconds'] > result['budget'] or bool(result['heavy_modules'])
+    text = f"budget {result['budget']:.2f}s"
+    if result['heavy_modules']:
+        text += f", loads {', '.join(result['heavy_modules'])}"
+    if baseline and baseline.get('seconds'):
+        change = result['seconds'] / baseline['seconds'] - 1
+        text += f", {change:+.0%} time"
+    return text + (" REGRESSION" if regression else ""), regression
+
+def ensure_dataset(work_dir, rows, seed, stages):
+    # Generates (or reuses) the files of one size: CRM and new records both get `rows` rows
+    out_dir = os.path.join(work_dir, f"{rows}_rows_seed{seed}")
+    formats = ('csv', 'xlsx') if 'new_xlsx' in stages else ('csv',)
+    paths = {'crm': os.path.join(out_dir, 'crm.csv'), 'new_csv': os.path.join(out_dir, 'new.csv'), 'new_xlsx': os.path.join(out_dir, 'new.xlsx')}
+    missing = [name for name in ['crm', 'new_csv'] + (['new_xlsx'] if 'xlsx' in formats else []) if not os.path.exists(paths[name])]
+    if missing:
+        print(f"Generating {rows} rows in {out_dir}...", file=sys.stderr)
+        generate_dataset(out_dir, rows, rows, seed, formats=formats)
+    return paths
+
+def compare_to_baseline(result, baseline, tolerance):
+    # Returns (change description, regression?) for one result
+    if not baseline:
+        return '', False
+    speed_change = result['rows_per_sec'] / baseline['rows_per_sec'] - 1 if baseline.get('rows_per_sec') else 0.0
+    regression = speed_change < -tolerance
+    text = f"{speed_change:+.0%} speed"
+    if result.get('peak_rss_mb') and baseline.get('peak_rss_mb'):
+        rss_change = result['peak_rss_mb'] / baseline['peak_rss_mb'] - 1
+        regression = regression or rss_change > tolerance
+        text += f", {rss_change:+.0%} RSS"
+    return text + (" REGRESSION" if regression else ""), regression
+
+def format_rss(value):
+    return f"{value:,.0f} MB" if value is not None else "n/a"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark each deduplication stage on synthetic data.")
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help=f"Row counts to test (default: {DEFAULT_SIZES})")
+    parser.add_argument('--stages', default=','.join(STAGES), help=f"Stages to run (default: all of {', '.join(STAGES)})")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--work-dir', default=DEFAULT_WORK_DIR, help="Folder for the generated data (reused between runs)")
+    parser.add_argument('--baseline', help="Compare against this baseline JSON file")
+    parser.add_argument('--save-baseline', metavar='FILE', help="Save the results as a baseline JSON file")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help=f"Allowed relative slowdown or memory growth (default: {DEFAULT_TOLERANCE})")
+    args = parser.parse_args(argv)
+
+    sizes = [parse_row_count(size) for size in args.sizes.split(',')]
+    stages = [stage.strip() for stage in args.stages.split(',')]
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)}")
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            baseline = json.load(file)['results']
+
+    results = {}
+    regressions = 0
+    print(f"{'stage':<10} {'rows':>10} {'seconds':>9} {'rows/s':>12} {'peak RSS':>10}  vs baseline")
+    if 'import' in stages: # Doesn't depend on the data, so once for all sizes
+        for module, budget in IMPORT_BUDGETS.items():
+            seconds, heavy = measure_import(module)
+            key = f"import/{module}"
+            result = results[key] = {'seconds': round(seconds, 4), 'budget': budget, 'heavy_modules': heavy}
+            change, regression = compare_import(result, baseline.get(key))
+            regressions += regression
+            print(f"{'import':<10} {module:>10} {seconds:>9.3f} {'':>12} {'':>10}  {change}", flush=True)
+    data_stages = [stage for stage in stages if stage != 'import']
+    for rows in sizes if data_stages else []:
+        paths = ensure_dataset(args.work_dir, rows, args.seed, data_stages)
+        for stage in data_stages:
+            seconds, stage_rows, peak_rss = run_stage(stage, paths)
+            key = f"{stage}/{rows}"
+            result = results[key] = {
+                'seconds': round(seconds, 4),
+                'rows': stage_rows,
+                'rows_per_sec': round(stage_rows / seconds, 1) if seconds > 0 else 0.0,
+                'peak_rss_mb': round(peak_rss, 1) if peak_rss is not None else None,
+            }
+            change, regression = compare_to_baseline(result, baseline.get(key), args.tolerance)
+            regressions += regression
+            print(f"{stage:<10} {stage_rows:>10} {seconds:>9.3f} {result['rows_per_sec']:>12,.0f} {format_rss(peak_rss):>10}  {change}", flush=True)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as file:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.platform(),
+                'seed': args.seed,
+                'results': results,
+            }, file, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.save_baseline}")
+    if regressions:
+        print(f"{regressions} regression(s) beyond {args.tolerance:.0%}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+import tempfile
+
+
+# --- On-disk cache of CRM ID indexes ---
+
+CACHE_FORMAT_VERSION = 1
+CACHE_FILE_EXT = ".ids"
+CHECKPOINT_FILE_EXT = ".checkpoint"
+DEFAULT_CACHE_DIR = os.environ.get(
+    'DEDUP_CACHE_DIR',
+    os.path.join(os.path.expanduser("~"), ".cache", "crm_duplicate_eliminator")
+)
+DEFAULT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+HASH_BLOCK_SIZE = 1024 * 1024
+CHECKPOINT_BLOCK_SIZE = 64 * 1024 # Bytes before the checkpoint offset that must be unchanged
+
+
+def file_fingerprint(filepath, hash_content=False):
+    # Identifies a given version of a file. Size + mtime is enough for exports that are
+    # rewritten in place; the content hash also catches copies that keep the old mtime.
+    stat = os.stat(filepath)
+    fingerprint = {
+        'path': os.path.abspath(filepath),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+    }
+    if hash_content:
+        digest = hashlib.sha256()
+        with open(filepath, 'rb') as file:
+            for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b''):
+                digest.update(block)
+        fingerprint['sha256'] = digest.hexdigest()
+    return fingerprint
+
+def _hash_range(file, start, end):
+    file.seek(start)
+    digest = hashlib.sha256()
+    while start < end:
+        block = file.read(min(HASH_BLOCK_SIZE, end - start))
+        if not block:
+            break
+        digest.update(block)
+        start += len(block)
+    return digest.hexdigest()
+
+def make_checkpoint(filepath, data_start, offset, rows, hash_prefix=False):
+    # Where an index of an append-only CRM export stopped: offset is the end of the last
+    # complete row read (rows data rows after the header, which ends at data_start). The
+    # header and the block just before offset are hashed to recognise the same file later;
+    # with hash_prefix, everything before offset is, so edits in the middle are noticed too.
+    with open(filepath, 'rb') as file:
+        checkpoint = {
+            'version': CACHE_FORMAT_VERSION,
+            'data_start': data_start,
+            'offset': offset,
+            'rows': rows,
+            'header_sha256': _hash_range(file, 0, data_start),
+            'last_block_sha256': _hash_range(file, max(data_start, offset - CHECKPOINT_BLOCK_SIZE), offset),
+        }
+        if hash_prefix:
+            checkpoint['prefix_sha256'] = _hash_range(file, 0, offset)
+    return checkpoint
+
+def checkpoint_matches(filepath, checkpoint):
+    # True when the file still starts with what the checkpoint saw, i.e. it was only appended to
+    try:
+        with open(filepath, 'rb') as file:
+            if os.fstat(file.fileno()).st_size < checkpoint['offset']:
+                return False # Truncated or rewritten shorter
+            data_start, offset = checkpoint['data_start'], checkpoint['offset']
+            return (_hash_range(file, 0, data_start) == checkpoint['header_sha256']
+                    and _hash_range(file, max(data_start, offset - CHECKPOINT_BLOCK_SIZE), offset) == checkpoint['last_block_sha256']
+                    and ('prefix_sha256' not in checkpoint or _hash_range(file, 0, offset) == checkpoint['prefix_sha256']))
+    except (OSError, KeyError, TypeError):
+        return False
+
+class CrmIndexCache:
+    # Stores built CRM ID indexes as plain text files (one normalized ID per line, which
+    # is safe since normalized IDs never contain line breaks). Least recently used
+    # entries are evicted once the folder exceeds max_bytes.
+    # With incremental, an entry is kept per CRM file path (and settings) with a checkpoint
+    # next to it, so an export that was only appended to is not read again from the start
+    # (see load_crm_index).
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES, hash_content=False, incremental=False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hash_content = hash_content
+        self.incremental = incremental
+
+    def cache_key(self, filepath, delimiter, lastname_col, firstname_col, match_rules=None):
+        key_data = {
+            'version': CACHE_FORMAT_VERSION,
+            'file': file_fingerprint(filepath, self.hash_content),
+            'delimiter': delimiter,
+            'lastname_col': lastname_col,
+            'firstname_col': firstname_col,
+        }
+        if match_rules:
+            key_data['match_rules'] = match_rules # Only added when set, so name-only keys stay valid
+        return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def incremental_key(self, filepath, delimiter, lastname_col, firstname_col, match_rules=None):
+        # Same as cache_key but for the file's path only: its content is checked by the checkpoint
+        key_data = {
+            'version': CACHE_FORMAT_VERSION,
+            'incremental': os.path.abspath(filepath),
+            'delimiter': delimiter,
+            'lastname_col': lastname_col,
+            'firstname_col': firstname_col,
+            'match_rules': match_rules or '',
+        }
+        return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key + CACHE_FILE_EXT)
+
+    def _checkpoint_path(self, key):
+        return os.path.join(self.cache_dir, key + CHECKPOINT_FILE_EXT)
+
+    def load_checkpoint(self, key):
+        # Returns (set of IDs, checkpoint) saved with save(key, ids, checkpoint), or (None, None)
+        try:
+            with open(self._checkpoint_path(key), 'r', encoding='utf-8') as file:
+                checkpoint = json.load(file)
+        except (OSError, ValueError):
+            return None, None
+        unique_ids = self.load(key)
+        if unique_ids is None or len(unique_ids) != checkpoint.get('ids'): # Not the IDs it was saved with
+            return None, None
+        return unique_ids, checkpoint
+
+    def load(self, key):
+        # Returns the cached set of IDs, or None on a miss
+        path = self._entry_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                data = file.read()
+        except OSError:
+            return None
+        try:
+            os.utime(path) # Mark as recently used for eviction
+        except OSError:
+            pass
+        if not data:
+            return set()
+        return set(data.split('\n'))
+
+    def save(self, key, unique_ids, checkpoint=None):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._write(self._entry_path(key), '\n'.join(unique_ids))
+        if checkpoint is not None:
+            self._write(self._checkpoint_path(key), json.dumps(dict(checkpoint, ids=len(unique_ids)), sort_keys=True))
+        self.evict()
+
+    def _write(self, path, text):
+        # Write to a temporary file first so a concurrent reader never sees a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                file.write(text)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def evict(self):
+        # Removes the least recently used entries until the cache fits in max_bytes
+        try:
+            names = [n for n in os.listdir(self.cache_dir) if n.endswith(CACHE_FILE_EXT)]
+        except OSError:
+            return
+        entries = []
+        for name in names:
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+            try:
+                os.remove(path[:-len(CACHE_FILE_EXT)] + CHECKPOINT_FILE_EXT) # Useless without its IDs
+            except OSError:
+                pass
+
+    def clear(self):
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return
+        for name in names:
+            if name.endswith(CACHE_FILE_EXT) or name.endswith(CHECKPOINT_FILE_EXT):
+                os.remove(os.path.join(self.cache_dir, name))
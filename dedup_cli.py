@@ -0,0 +1,190 @@
+import argparse
+import multiprocessing
+import os
+import sys
+
+from dedup_cache import CrmIndexCache, DEFAULT_CACHE_DIR, DEFAULT_CACHE_MAX_BYTES
+from dedup_engine import (
+    CONFIG, DIAGNOSTIC_SAMPLES_PER_CATEGORY, OUTPUT_FORMATS, UNIQUES_FILENAME, DUPLICATES_FILENAME, IN_FILE_DUPLICATES_FILENAME, MATCH_RULE_COLUMN, Diagnostics,
+    InFileDuplicates, output_filename, parse_keep_policy, run_deduplication, stream_deduplication, write_output_file
+)
+from dedup_fuzzy import FUZZY_MATCHES_FILENAME, FuzzyMatcher, parse_fuzzy_threshold
+from dedup_report import RUN_REPORT_FILENAME, RunReport, run_profiled
+from dedup_rules import parse_match_rules
+
+
+# --- Command line entry point (no GUI needed) ---
+
+# (option, CONFIG key, help text)
+CONFIG_OPTIONS = [
+    ('--crm-delimiter', 'CRM_DELIMITER', "Delimiter of the CRM export"),
+    ('--crm-last-name-col', 'CRM_LAST_NAME_COL', "Last name column of the CRM export"),
+    ('--crm-first-name-col', 'CRM_FIRST_NAME_COL', "First name column of the CRM export"),
+    ('--new-records-name-col', 'NEW_RECORDS_NAME_COL', "Name column of the new records file"),
+    ('--new-records-forename-col', 'NEW_RECORDS_FORENAME_COL', "Forename column of the new records file"),
+    ('--new-records-csv-delimiter', 'NEW_RECORDS_CSV_DELIMITER', "Delimiter of the new records file (CSV only)"),
+    ('--match-rules', 'MATCH_RULES', "Match rules over any columns, e.g. \"email | name + text:Société=Company\"; empty = names only"),
+    ('--keep', 'IN_FILE_DUPLICATES_KEEP', "Copy kept when a contact is repeated in the new records file: first, last, most_filled or none"),
+    ('--fuzzy-threshold', 'FUZZY_THRESHOLD', "Also report near duplicates scoring at least this (0-1, e.g. 0.92); empty disables"),
+]
+
+def parquet_options_error(filepaths, output_format, excel_cache):
+    # Error message when Parquet is needed (input files, outputs or the Excel cache) but pyarrow is missing, else None
+    from dedup_parquet import is_parquet_file, pyarrow_error
+    if output_format == 'parquet' or excel_cache or any(is_parquet_file(filepath) for filepath in filepaths):
+        return pyarrow_error()
+    return None
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(
+        description="Separate new contacts from those already present in a CRM export."
+    )
+    parser.add_argument('crm_file', help="CRM export (CSV or Parquet)")
+    parser.add_argument('new_records_file', help="New records file (Excel, CSV or Parquet)")
+    parser.add_argument('-o', '--output-dir', default='.', help="Folder for the output files (default: current folder)")
+    parser.add_argument('--output-format', choices=OUTPUT_FORMATS, default='csv', help="Format of the output files (default: csv; parquet needs pyarrow)")
+    parser.add_argument('-q', '--quiet', action='store_true', help="Only print errors")
+    parser.add_argument('-j', '--jobs', type=int, default=1, help="Worker processes for large CSV files and multi-sheet Excel workbooks (0 = one per CPU core, default: 1)")
+    parser.add_argument('--stream', action='store_true', help="Classify and write each new record as it is read (memory grows only with the number of distinct contacts, not at all with --keep none; --keep must be first or none)")
+    parser.add_argument('--max-memory', type=int, metavar='MB', help="Out-of-core matching for CRM exports larger than memory: keep at most about this many MB of CRM keys in memory (same outputs as --stream)")
+    parser.add_argument('--spill-dir', help="Folder for the temporary files of --max-memory (default: the system temporary folder)")
+    parser.add_argument('--compact-index', metavar='BITS', help="Keep the CRM index as sorted 64- or 128-bit hashes (about 10x less memory; not cached, no fuzzy matching)")
+    parser.add_argument('--bloom-filter', action='store_true', help="With --compact-index, add a Bloom filter (about 1%% false positives) to reject most new contacts before the lookup")
+    parser.add_argument('--no-verify', action='store_true', help="With --compact-index, trust hash matches instead of checking them against the CRM file (skips a second read)")
+    parser.add_argument('--rejected-rows', metavar='FILE', help="Write every rejected input row to this CSV file")
+    parser.add_argument('--max-warnings', type=int, default=DIAGNOSTIC_SAMPLES_PER_CATEGORY, help=f"Warnings printed per kind of problem before they are only counted (default: {DIAGNOSTIC_SAMPLES_PER_CATEGORY})")
+    parser.add_argument('--no-cache', action='store_true', help="Always rebuild the CRM index instead of using the on-disk cache")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help=f"Folder of the CRM index cache (default: {DEFAULT_CACHE_DIR})")
+    parser.add_argument('--cache-max-mb', type=int, default=DEFAULT_CACHE_MAX_BYTES // (1024 * 1024), help="Size limit of the cache folder in MB")
+    parser.add_argument('--cache-hash-content', action='store_true', help="Also hash the CRM file content to detect changes (slower than size + modification time)")
+    parser.add_argument('--incremental', action='store_true', help="The CRM export only grows by appended rows: keep a checkpoint with the cached index and only read the rows added since (rebuilt when the file was otherwise changed)")
+    parser.add_argument('--excel-cache', action='store_true', help="Keep a Parquet copy of the Excel new records file in the cache folder, so later runs on the same file skip decoding it (needs pyarrow)")
+    parser.add_argument('--profile', metavar='FILE', help="Run under cProfile and write the stats to this file")
+    parser.add_argument('--trace-memory', action='store_true', help="Also record each stage's peak Python allocations with tracemalloc (slower)")
+    for option, key, help_text in CONFIG_OPTIONS:
+        parser.add_argument(option, dest=key, default=CONFIG[key], help=f"{help_text} (default: '{CONFIG[key]}')")
+    return parser
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    if args.profile:
+        return run_profiled(args.profile, _main, args)
+    return _main(args)
+
+def _main(args):
+    config = {key: getattr(args, key) for _, key, _ in CONFIG_OPTIONS}
+    log = (lambda message: None) if args.quiet else sys.stderr.write
+
+    if args.incremental and args.no_cache:
+        sys.stderr.write("Error: --incremental keeps its checkpoint in the cache and can't be combined with --no-cache.\n")
+        return 1
+    cache = None if args.no_cache else CrmIndexCache(args.cache_dir, args.cache_max_mb * 1024 * 1024, args.cache_hash_content, args.incremental)
+    parquet_error = parquet_options_error([args.crm_file, args.new_records_file], args.output_format, args.excel_cache)
+    if parquet_error:
+        sys.stderr.write(parquet_error + "\n")
+        return 1
+    excel_cache = None
+    if args.excel_cache:
+        from dedup_parquet import ExcelParquetCache
+        excel_cache = ExcelParquetCache(args.cache_dir, args.cache_max_mb * 1024 * 1024, args.cache_hash_content)
+
+    diagnostics = Diagnostics(log, args.max_warnings, args.rejected_rows)
+    fuzzy_threshold, threshold_error = parse_fuzzy_threshold(config['FUZZY_THRESHOLD'])
+    if threshold_error:
+        sys.stderr.write(threshold_error + "\n")
+        return 1
+    fuzzy = FuzzyMatcher(fuzzy_threshold) if fuzzy_threshold else None
+    keep_policy, policy_error = parse_keep_policy(config['IN_FILE_DUPLICATES_KEEP'])
+    if policy_error:
+        sys.stderr.write(policy_error + "\n")
+        return 1
+    in_file = InFileDuplicates(keep_policy) if keep_policy else None
+    rules, rules_error = parse_match_rules(config['MATCH_RULES'])
+    if rules_error:
+        sys.stderr.write(rules_error + "\n")
+        return 1
+    compact_index = None
+    if args.compact_index:
+        from dedup_hashindex import DEFAULT_BLOOM_BITS_PER_KEY, CompactIdIndex, parse_hash_bits # Loads NumPy
+        hash_bits, bits_error = parse_hash_bits(args.compact_index)
+        if bits_error:
+            sys.stderr.write(bits_error + "\n")
+            return 1
+        if args.stream or args.max_memory is not None:
+            sys.stderr.write("Error: --compact-index can't be combined with --stream or --max-memory.\n")
+            return 1
+        compact_index = CompactIdIndex(hash_bits, DEFAULT_BLOOM_BITS_PER_KEY if args.bloom_filter else 0, not args.no_verify)
+
+    run_report = RunReport(args.trace_memory)
+    run_report.info.update({
+        'crm_file': os.path.abspath(args.crm_file),
+        'new_records_file': os.path.abspath(args.new_records_file),
+        'mode': 'out_of_core' if args.max_memory is not None else 'stream' if args.stream else 'batch',
+        'jobs': args.jobs,
+        'compact_index': args.compact_index,
+        'output_format': args.output_format,
+        'config': config,
+    })
+
+    if args.max_memory is not None:
+        if fuzzy is not None:
+            sys.stderr.write("Error: Fuzzy matching needs the whole CRM index in memory; it can't be used with --max-memory.\n")
+            return 1
+        from dedup_outofcore import partitioned_deduplication
+        _, _, _, error = partitioned_deduplication(
+            args.crm_file, args.new_records_file, args.output_dir, config, log, diagnostics=diagnostics, in_file=in_file, rules=rules,
+            memory_mb=args.max_memory, work_dir=args.spill_dir, run_report=run_report, output_format=args.output_format, excel_cache=excel_cache
+        )
+        if error:
+            sys.stderr.write(error + "\n")
+            return 1
+        log(f"Saved output files to: {args.output_dir}\n")
+        return _write_run_report(run_report, args.output_dir, log)
+
+    if args.stream:
+        _, _, _, error = stream_deduplication(
+            args.crm_file, args.new_records_file, args.output_dir, config, log, cache, args.jobs, diagnostics=diagnostics, fuzzy=fuzzy, in_file=in_file, rules=rules,
+            run_report=run_report, output_format=args.output_format, excel_cache=excel_cache
+        )
+        if error:
+            sys.stderr.write(error + "\n")
+            return 1
+        log(f"Saved output files to: {args.output_dir}\n")
+        return _write_run_report(run_report, args.output_dir, log)
+
+    uniques, duplicates, header, error = run_deduplication(args.crm_file, args.new_records_file, config, log, cache, args.jobs, diagnostics=diagnostics, fuzzy=fuzzy, in_file=in_file, rules=rules,
+                                                           run_report=run_report, compact_index=compact_index, excel_cache=excel_cache)
+    if error:
+        sys.stderr.write(error + "\n")
+        return 1
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    run_report.start('save')
+    duplicates_header = header + [MATCH_RULE_COLUMN] if rules is not None else header
+    outputs = [(uniques, header, UNIQUES_FILENAME), (duplicates, duplicates_header, DUPLICATES_FILENAME)]
+    if fuzzy is not None:
+        outputs.append((*fuzzy.output_records(header), FUZZY_MATCHES_FILENAME))
+    if in_file is not None:
+        outputs.append((*in_file.output_records(header), IN_FILE_DUPLICATES_FILENAME))
+    for data, data_header, filename in outputs:
+        filepath = os.path.join(args.output_dir, output_filename(filename, args.output_format))
+        save_error = write_output_file(filepath, data, data_header)
+        if save_error:
+            sys.stderr.write(save_error + "\n")
+            return 1
+        log(f"Saved: {filepath}\n")
+    run_report.finish('save', rows_out=sum(len(data) for data, _, _ in outputs))
+    return _write_run_report(run_report, args.output_dir, log)
+
+def _write_run_report(run_report, output_dir, log):
+    filepath = os.path.join(output_dir, RUN_REPORT_FILENAME)
+    save_error = run_report.write(filepath)
+    if save_error:
+        sys.stderr.write(save_error + "\n")
+        return 1
+    log(f"\n{run_report.summary()}Run report saved to: {filepath}\n")
+    return 0
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support() # Needed by --jobs in frozen builds
+    sys.exit(main())
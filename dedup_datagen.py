@@ -0,0 +1,193 @@
+import argparse
+import csv
+import os
+import random
+
+
+# --- Synthetic contact data for benchmarks ---
+# Generates a CRM export and a new records file (CSV and multi-sheet XLSX) with realistic
+# French/European names: accents, compound and hyphenated names, particles, and noisy copies
+# of CRM contacts (case, accents, punctuation, spacing) that still normalize to the same ID.
+# The same seed always gives the same files.
+
+LAST_NAMES = [
+    'Martin', 'Bernard', 'Dubois', 'Thomas', 'Robert', 'Richard', 'Petit', 'Durand', 'Leroy', 'Moreau',
+    'Simon', 'Laurent', 'Lefèvre', 'Michel', 'Garcia', 'David', 'Bertrand', 'Roux', 'Vincent', 'Fournier',
+    'Morel', 'Girard', 'André', 'Lefebvre', 'Mercier', 'Dupont', 'Lambert', 'Bonnet', 'François', 'Martínez',
+    'Legrand', 'Garnier', 'Faure', 'Rousseau', 'Blanc', 'Guérin', 'Muller', 'Henry', 'Roussel', 'Nicolas',
+    'Perrin', 'Morin', 'Mathieu', 'Clément', 'Gauthier', 'Dumont', 'Lopez', 'Fontaine', 'Chevalier', 'Robin',
+    'Müller', 'Schmidt', 'Schröder', 'Weiß', 'Jørgensen', 'Kowalski', 'Nowak', 'Rossi', 'Bianchi', 'Ferreira',
+    'Gonçalves', 'Håkansson', 'Østergaard', 'Nuñez', 'Čapek', 'Dvořák', 'Peeters', 'Janssens', "O'Brien", 'Żuławski',
+]
+# Syllables of made-up surnames, so that large files don't reuse the same few thousand names
+SURNAME_SYLLABLES = [
+    'ber', 'nar', 'dou', 'lan', 'gué', 'mar', 'tin', 'ro', 'val', 'lié', 'mo', 'reau', 'fon', 'taine', 'lé',
+    'vêque', 'bel', 'ger', 'ard', 'vil', 'neu', 'cour', 'toi', 'sé', 'guin', 'bour', 'geois', 'pel', 'let', 'char',
+    'pen', 'tier', 'mé', 'jo', 'li', 'bo', 'nin', 'cha', 'teau', 'pré', 'vost', 'thi', 'baut', 'ma', 'ré',
+    'chal', 'bra', 'lu', 'cas', 'pi', 'cot', 'fau', 'vel', 'gna', 'çon', 'ï', 'rous', 'sel', 'hé', 'mann',
+]
+PARTICLES = ['de', 'du', 'de la', "d'", 'le', 'van', 'van der', 'von', 'da', 'di', 'dos']
+FIRST_NAMES = [
+    'Jean', 'Marie', 'Pierre', 'Michel', 'André', 'Philippe', 'Nathalie', 'Isabelle', 'Sylvie', 'Catherine',
+    'Françoise', 'Hélène', 'Chloé', 'Léa', 'Zoé', 'Agnès', 'Gaëlle', 'Noël', 'Anaïs', 'Jérôme',
+    'Stéphane', 'François', 'Frédéric', 'Sébastien', 'Céline', 'Aurélie', 'Émilie', 'Loïc', 'Benoît', 'Joël',
+    'Anne', 'Paul', 'Louis', 'Lucas', 'Hugo', 'Camille', 'Inès', 'Manon', 'Julien', 'Nicolas',
+    'Jürgen', 'Søren', 'Björn', 'José', 'María', 'João', 'Łukasz', 'Małgorzata', 'Giuseppe', 'Saoirse',
+]
+COMPOUND_FIRST_NAMES = ['Jean', 'Marie', 'Anne', 'Pierre', 'Louis', 'Paul']
+COMPANIES = ['Acme', 'Globex', 'Initech', 'Soylent', 'Umbrella', 'Hooli', 'Vandelay', 'Stark', 'Wayne', 'Tyrell']
+CITIES = ['Paris', 'Lyon', 'Marseille', 'Toulouse', 'Nantes', 'Lille', 'Bordeaux', 'Bruxelles', 'Genève', 'Berlin']
+
+CRM_HEADER = ['Nom', 'Prénom', 'Email', 'Société', 'Téléphone', 'Ville']
+NEW_RECORDS_HEADER = ['Nom', 'Prénom', 'Email', 'Entreprise', 'Téléphone', 'Ville', 'Source']
+XLSX_MAX_ROWS_PER_SHEET = 1048575 # Excel's limit, minus the header row
+
+DEFAULT_SEED = 42
+DEFAULT_DUPLICATE_RATE = 0.3 # Share of new records that are noisy copies of CRM contacts
+DEFAULT_REPEAT_RATE = 0.05 # Share of new records repeating an earlier new record
+DEFAULT_SHEETS = 3
+
+
+def _surname(rng):
+    if rng.random() < 0.1: # Common names: these collide between unrelated people, as in real files
+        return rng.choice(LAST_NAMES)
+    return ''.join(rng.choice(SURNAME_SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+
+def _last_name(rng):
+    roll = rng.random()
+    if roll < 0.08:
+        particle = rng.choice(PARTICLES)
+        name = _surname(rng)
+        return particle + name if particle.endswith("'") else f"{particle} {name}"
+    if roll < 0.15:
+        return f"{_surname(rng)}-{_surname(rng)}"
+    return _surname(rng)
+
+def _first_name(rng):
+    if rng.random() < 0.12:
+        return f"{rng.choice(COMPOUND_FIRST_NAMES)}-{rng.choice(FIRST_NAMES)}"
+    return rng.choice(FIRST_NAMES)
+
+def _strip_accents(text):
+    import unicodedata
+    return ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+
+def add_noise(rng, value):
+    # A variant that normalizes to the same ID: case, accents, spacing and punctuation changes
+    roll = rng.random()
+    if roll < 0.25:
+        value = value.upper()
+    elif roll < 0.4:
+        value = value.lower()
+    if rng.random() < 0.3:
+        value = _strip_accents(value)
+    if rng.random() < 0.2:
+        value = value.replace('-', ' - ')
+    if rng.random() < 0.15:
+        value = f"  {value} "
+    if rng.random() < 0.1:
+        value += rng.choice(['.', ',', '!', '*'])
+    return value
+
+def _contact(rng, index):
+    last_name, first_name = _last_name(rng), _first_name(rng)
+    email_user = _strip_accents(f"{first_name}.{last_name}").lower().replace(' ', '').replace("'", '')
+    return [
+        last_name,
+        first_name,
+        f"{email_user}{index}@{rng.choice(COMPANIES).lower()}.example",
+        rng.choice(COMPANIES),
+        f"+33 {rng.randint(1, 9)} {rng.randint(0, 99):02d} {rng.randint(0, 99):02d} {rng.randint(0, 99):02d} {rng.randint(0, 99):02d}",
+        rng.choice(CITIES),
+    ]
+
+def generate_crm_rows(rows, seed=DEFAULT_SEED):
+    rng = random.Random(seed)
+    for index in range(rows):
+        yield _contact(rng, index)
+
+def generate_new_records_rows(rows, crm_rows, seed=DEFAULT_SEED, duplicate_rate=DEFAULT_DUPLICATE_RATE, repeat_rate=DEFAULT_REPEAT_RATE):
+    # crm_rows: number of CRM rows generated with the same seed (copies are taken from them)
+    rng = random.Random(seed + 1)
+    crm_rng = random.Random(seed)
+    crm_sample = [_contact(crm_rng, index) for index in range(min(crm_rows, 100000))]
+    recent = []
+    for index in range(rows):
+        roll = rng.random()
+        if roll < duplicate_rate and crm_sample:
+            contact = list(rng.choice(crm_sample))
+            contact[0], contact[1] = add_noise(rng, contact[0]), add_noise(rng, contact[1])
+        elif roll < duplicate_rate + repeat_rate and recent:
+            contact = list(rng.choice(recent))
+        else:
+            contact = _contact(rng, crm_rows + index)
+        if len(recent) < 1000:
+            recent.append(contact)
+        else:
+            recent[rng.randrange(len(recent))] = contact
+        yield contact + [f"salon-{rng.randint(2019, 2025)}"]
+
+def write_csv(filepath, header, rows, delimiter):
+    with open(filepath, mode='w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file, delimiter=delimiter)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+def write_xlsx(filepath, header, rows, sheets=DEFAULT_SHEETS, total_rows=None):
+    # Spreads the rows over several sheets (each with the header), as supplier files often do
+    import openpyxl
+    workbook = openpyxl.Workbook(write_only=True)
+    per_sheet = max(1, -(-total_rows // sheets)) if total_rows else XLSX_MAX_ROWS_PER_SHEET
+    per_sheet = min(per_sheet, XLSX_MAX_ROWS_PER_SHEET)
+    worksheet = None
+    in_sheet = per_sheet
+    for row in rows:
+        if in_sheet >= per_sheet:
+            worksheet = workbook.create_sheet(f"Contacts {len(workbook.worksheets) + 1}")
+            worksheet.append(header)
+            in_sheet = 0
+        worksheet.append(row)
+        in_sheet += 1
+    if worksheet is None:
+        workbook.create_sheet("Contacts 1").append(header)
+    workbook.save(filepath)
+
+def generate_dataset(out_dir, crm_rows, new_rows, seed=DEFAULT_SEED, duplicate_rate=DEFAULT_DUPLICATE_RATE,
+                     repeat_rate=DEFAULT_REPEAT_RATE, sheets=DEFAULT_SHEETS, formats=('csv', 'xlsx')):
+    # Writes crm.csv, new.csv and/or new.xlsx to out_dir; returns {name: path}
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {'crm': os.path.join(out_dir, 'crm.csv')}
+    write_csv(paths['crm'], CRM_HEADER, generate_crm_rows(crm_rows, seed), ';')
+    if 'csv' in formats:
+        paths['new_csv'] = os.path.join(out_dir, 'new.csv')
+        write_csv(paths['new_csv'], NEW_RECORDS_HEADER, generate_new_records_rows(new_rows, crm_rows, seed, duplicate_rate, repeat_rate), ',')
+    if 'xlsx' in formats:
+        paths['new_xlsx'] = os.path.join(out_dir, 'new.xlsx')
+        write_xlsx(paths['new_xlsx'], NEW_RECORDS_HEADER, generate_new_records_rows(new_rows, crm_rows, seed, duplicate_rate, repeat_rate), sheets, new_rows)
+    return paths
+
+def parse_row_count(value):
+    # "10k", "1m", "2500" -> int
+    value = value.strip().lower()
+    multiplier = {'k': 1000, 'm': 1000000}.get(value[-1:], 1)
+    return int(float(value[:-1] if multiplier > 1 else value) * multiplier)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic CRM and new records files for benchmarks.")
+    parser.add_argument('out_dir', help="Folder for crm.csv, new.csv and new.xlsx")
+    parser.add_argument('--crm-rows', type=parse_row_count, default=100000, help="Rows of the CRM export (e.g. 100k, 1m)")
+    parser.add_argument('--new-rows', type=parse_row_count, default=100000, help="Rows of the new records file")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--duplicate-rate', type=float, default=DEFAULT_DUPLICATE_RATE, help="Share of new records already in the CRM")
+    parser.add_argument('--repeat-rate', type=float, default=DEFAULT_REPEAT_RATE, help="Share of new records repeated within the file")
+    parser.add_argument('--sheets', type=int, default=DEFAULT_SHEETS, help="Sheets of the XLSX file")
+    parser.add_argument('--formats', default='csv,xlsx', help="New records formats to write (csv, xlsx)")
+    args = parser.parse_args(argv)
+    paths = generate_dataset(args.out_dir, args.crm_rows, args.new_rows, args.seed, args.duplicate_rate,
+                             args.repeat_rate, args.sheets, tuple(f.strip() for f in args.formats.split(',')))
+    for path in paths.values():
+        print(path)
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
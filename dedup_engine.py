@@ -0,0 +1,1366 @@
+import codecs
+import csv
+import functools
+import itertools
+import os
+import re
+import sys
+import threading
+from unidecode import unidecode
+
+from dedup_excel import iter_dataframe_sheets, open_excel_sheets
+from dedup_parquet import PARQUET_EXT, PYARROW_MISSING, is_parquet_file, iter_parquet_rows, parquet_row_count, read_parquet_header
+
+
+# --- Configuration Variables ---
+CONFIG = {
+    'CRM_DELIMITER': ';',
+    'CRM_LAST_NAME_COL': 'Nom',
+    'CRM_FIRST_NAME_COL': 'Prénom',
+    'NEW_RECORDS_NAME_COL': 'Nom',
+    'NEW_RECORDS_FORENAME_COL': 'Prénom',
+    'NEW_RECORDS_CSV_DELIMITER': ',',
+    'IN_FILE_DUPLICATES_KEEP': 'first', # Which copy of a contact repeated in the new records file is kept: first, last, most_filled or none
+    'MATCH_RULES': '', # e.g. "email | name + text:Société=Company"; empty = match on the name columns only (see dedup_rules)
+    'FUZZY_THRESHOLD': '' # Jaro-Winkler score (0-1) for possible duplicates; empty = exact matching only
+}
+
+UNIQUES_FILENAME = "contacts_to_import.csv"
+DUPLICATES_FILENAME = "duplicates_to_review.csv"
+IN_FILE_DUPLICATES_FILENAME = "in_file_duplicates_to_review.csv"
+MATCH_RULE_COLUMN = 'Matched rule' # Added to duplicates when match rules are used
+OUTPUT_FORMATS = ('csv', 'parquet') # The output file names above are those of the CSV format
+
+
+PROGRESS_EVERY_ROWS = 5000 # How often long loops report progress and check for cancellation
+
+
+def _null_log(message):
+    pass
+
+class ProcessingCancelled(BaseException):
+    # Raised inside the engine when a run is cancelled. Derives from BaseException so the
+    # readers' generic "except Exception" error reporting lets it through.
+    pass
+
+class RunProgress:
+    # Carries progress reports out of a run and a cancellation flag into it.
+    # callback(stage, done, total, rows) is called from the thread doing the work; done/total
+    # are bytes for the file reading stages and rows for the comparison (total may be None).
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def report(self, stage, done, total=None, rows=None):
+        if self.cancelled.is_set():
+            raise ProcessingCancelled()
+        if self.callback:
+            self.callback(stage, done, total, rows)
+
+def _report(progress, stage, done, total=None, rows=None):
+    if progress is not None:
+        progress.report(stage, done, total, rows)
+
+def _stage_start(run_report, stage):
+    if run_report is not None:
+        run_report.start(stage)
+
+def _stage_finish(run_report, stage, rows_in=None, rows_out=None, **details):
+    # Records a finished stage in a RunReport (see dedup_report)
+    if run_report is not None:
+        run_report.finish(stage, rows_in, rows_out, **details)
+
+# --- Diagnostics ---
+
+DIAGNOSTIC_SAMPLES_PER_CATEGORY = 5 # Warnings shown per category before they are only counted
+
+WARNING_CATEGORIES = {
+    'crm_bad_columns': "CRM rows with an incorrect number of columns",
+    'crm_empty_name': "CRM rows with an empty/invalid name after normalization",
+    'crm_no_keys': "CRM rows without any value usable by the match rules",
+    'new_bad_columns': "New records rows with an incorrect number of columns",
+    'new_empty_name': "New records rows with empty name/forename fields",
+    'new_empty_id': "New records with an empty ID after normalization",
+}
+
+class Diagnostics:
+    # Aggregates row warnings: counts per category, the first max_samples messages of each
+    # category are logged as they happen, and every rejected row can be written to a side
+    # CSV (category, row number, then the row's values).
+
+    def __init__(self, log=None, max_samples=DIAGNOSTIC_SAMPLES_PER_CATEGORY, rejected_rows_path=None):
+        self.log = log or _null_log
+        self.max_samples = max_samples
+        self.counts = {}
+        self.samples = {}
+        self.rejected_rows_path = rejected_rows_path
+        self._rejected_file = None
+        self._rejected_writer = None
+
+    def add(self, category, row_number, message, row=None):
+        count = self.counts.get(category, 0) + 1
+        self.counts[category] = count
+        if count <= self.max_samples:
+            self.samples.setdefault(category, []).append(message)
+            self.log(message)
+        elif count == self.max_samples + 1:
+            self.log(f"    (further warnings of this kind are counted, not shown: {WARNING_CATEGORIES.get(category, category)})\n")
+        if self.rejected_rows_path:
+            if self._rejected_writer is None:
+                self._rejected_file = open(self.rejected_rows_path, mode='w', newline='', encoding='utf-8')
+                self._rejected_writer = csv.writer(self._rejected_file)
+                self._rejected_writer.writerow(['category', 'row', 'values'])
+            self._rejected_writer.writerow([category, row_number] + [str(v) for v in (row or [])])
+
+    def total(self):
+        return sum(self.counts.values())
+
+    def summary(self):
+        if not self.counts:
+            return "No rows were rejected.\n"
+        lines = [f"Rejected rows: {self.total()}\n"]
+        for category, count in self.counts.items():
+            lines.append(f"  {WARNING_CATEGORIES.get(category, category)}: {count}\n")
+        if self.rejected_rows_path:
+            lines.append(f"  Full list written to: {self.rejected_rows_path}\n")
+        return ''.join(lines)
+
+    def close(self):
+        if self._rejected_file is not None:
+            self._rejected_file.close()
+            self._rejected_file = self._rejected_writer = None
+
+class CollectedWarnings:
+    # Stand-in for Diagnostics in worker processes: keeps the warnings so the parent can replay them
+    def __init__(self, keep_rows=False):
+        self.entries = []
+        self.keep_rows = keep_rows
+
+    def add(self, category, row_number, message, row=None):
+        self.entries.append((category, row_number, message, row if self.keep_rows else None))
+
+def _warn(log, diagnostics, category, row_number, message, row=None):
+    # Row warnings go to diagnostics when there is one, otherwise straight to the log
+    if diagnostics is None:
+        log(message)
+    else:
+        diagnostics.add(category, row_number, message, row)
+
+
+# --- Core Logic ---
+
+NORMALIZE_CACHE_SIZE = 1 << 18 # Distinct raw name values remembered by the normalization memo
+
+# Precompiled patterns of normalize_name_part
+_NON_NAME_CHARS_RE = re.compile(r'[^a-z0-9\s-]')
+_HYPHEN_SPACES_RE = re.compile(r'\s*-\s*')
+_SPACES_RE = re.compile(r'\s+')
+
+@functools.lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def _normalize_text(s):
+    # Memoized core of normalize_name_part: CRM columns repeat the same names a lot
+    s = s.strip()
+    if not s:
+        return ""
+
+    # Transliterate ("René" -> "Rene", "Müller" -> "Muller")
+    s = unidecode(s)
+
+    # Convert to lowercase for consistent comparison
+    s = s.lower()
+
+    # Remove all periods, commas, apostrophes, etc
+    s = _NON_NAME_CHARS_RE.sub('', s)
+
+    # 4. Normalize minus uses ("Smith - Jones" -> "smith-jones")
+    s = _HYPHEN_SPACES_RE.sub('-', s)
+
+    # 5. Normalize spaces
+    s = _SPACES_RE.sub(' ', s)
+
+    return s.strip() # Final strip
+
+def _is_na(value):
+    # pd.isna for one value. pandas (and NumPy) are only imported for Excel files, so when they
+    # aren't loaded yet no value can be one of their missing markers.
+    if value is None:
+        return True
+    if isinstance(value, float):
+        return value != value # NaN, including numpy.float64
+    pd = sys.modules.get('pandas')
+    return pd is not None and pd.api.types.is_scalar(value) and bool(pd.isna(value))
+
+def normalize_name_part(name_part):
+    # Normalize a name to allow robust comparison
+    if isinstance(name_part, str): # Fast path for the usual case (a str is never NA)
+        return _normalize_text(name_part)
+    if _is_na(name_part):
+        return ""
+    return _normalize_text(str(name_part))
+
+def normalize_names(values):
+    # Batch version of normalize_name_part for a whole column: returns a list in the same
+    # order, normalizing each distinct value only once
+    pd = sys.modules.get('pandas') # A Series can only exist once pandas is loaded
+    if pd is not None and isinstance(values, pd.Series):
+        import numpy as np
+        codes, distinct_values = pd.factorize(values) # NA values get code -1
+        normalized = np.array([normalize_name_part(v) for v in distinct_values] + [""], dtype=object)
+        return normalized[codes].tolist()
+    memo = {}
+    result = []
+    for value in values:
+        try:
+            normalized = memo[value]
+        except KeyError:
+            normalized = memo[value] = normalize_name_part(value)
+        except TypeError: # Unhashable value
+            normalized = normalize_name_part(value)
+        result.append(normalized)
+    return result
+
+def normalize_cache_info():
+    # Hit/miss statistics of the normalization memo
+    return _normalize_text.cache_info()
+
+def create_unique_id(last_name, first_name):
+    # Creates a standardized unique ID from name and forename
+    ln_normalized = normalize_name_part(last_name)
+    fn_normalized = normalize_name_part(first_name)
+
+    if ln_normalized and fn_normalized:
+        return f"{ln_normalized} {fn_normalized}"
+    elif ln_normalized: # Only last name is valid/present
+        return ln_normalized
+    elif fn_normalized: # Only first name is valid/present
+        return fn_normalized
+    else:
+        return ""
+
+def create_unique_ids(last_names, first_names):
+    # Batch version of create_unique_id for whole columns (lists or pandas Series)
+    ln_normalized = normalize_names(last_names)
+    fn_normalized = normalize_names(first_names)
+    return [f"{ln} {fn}" if ln and fn else ln or fn for ln, fn in zip(ln_normalized, fn_normalized)]
+
+def read_crm_csv_file(filepath, delimiter, expected_lastname_col, expected_firstname_col, log=None):
+    log = log or _null_log
+    records = []
+    unique_ids = set() # Allows to separate entries
+    header = []
+    log(f"Attempting to read CRM file: {os.path.basename(filepath)}\n")
+    log(f"  Using delimiter: '{delimiter}'\n")
+    log(f"  Using Last Name column: '{expected_lastname_col}'\n")
+    log(f"  Using First Name column: '{expected_firstname_col}'\n")
+
+    try:
+        with open(filepath, mode='r', encoding='utf-8-sig') as file:
+            reader = csv.reader(file, delimiter=delimiter)
+            header = next(reader, None)
+            if not header:
+                return None, None, None, f"Error: CRM file '{os.path.basename(filepath)}' is empty or has no header."
+
+            normalized_header = [h.strip() for h in header]
+            try:
+                lastname_col_idx = normalized_header.index(expected_lastname_col)
+                firstname_col_idx = normalized_header.index(expected_firstname_col)
+            except ValueError:
+                err_msg = (f"Error: Required columns ('{expected_lastname_col}', '{expected_firstname_col}') not found in CRM file '{os.path.basename(filepath)}'.\n"
+                           f"Found headers: {', '.join(header)}")
+                return None, None, None, err_msg
+
+            for i, row in enumerate(reader):
+                if len(row) != len(header):
+                    log(f"Warning: Row {i+2} in CRM file has incorrect columns ({len(row)} vs {len(header)} expected). Skipping.\n")
+                    continue
+                try:
+                    record_dict = dict(zip(header, row))
+                    last_name = row[lastname_col_idx]
+                    first_name = row[firstname_col_idx]
+
+                    unique_id = create_unique_id(last_name, first_name)
+                    if unique_id: # Only add if a valid ID could be generated
+                        records.append(record_dict)
+                        unique_ids.add(unique_id)
+                    else:
+                        log(f"Warning: Row {i+2} in CRM file has empty/invalid name/forename after normalization. Skipping.\n")
+
+                except Exception as e:
+                    log(f"Warning: Error processing row {i+2} in CRM file: {e}. Skipping.\n")
+
+        log(f"Successfully processed {len(records)} records from CRM file ({len(unique_ids)} unique IDs generated).\n")
+        return records, unique_ids, header, None
+    except FileNotFoundError:
+        return None, None, None, f"Error: CRM File not found at '{filepath}'."
+    except Exception as e:
+        return None, None, None, f"An unexpected error occurred while reading CRM file: {e}"
+
+class NewRecordsError(Exception):
+    # Problem with the new records file as a whole; the message is shown to the user as is
+    pass
+
+def iter_new_records(filepath, expected_name_col, expected_forename_col, csv_delimiter, log=None, progress=None, diagnostics=None, excel_cache=None, keep_nameless=False):
+    # Generator: yields the output header first, then each usable record as a list of values
+    # in header order (rows of Excel sheets with other columns are mapped by column name).
+    # keep_nameless keeps rows with empty name fields, for match rules on other columns.
+    # With an ExcelParquetCache (dedup_parquet), Excel files are read from their Parquet copy
+    # when there is one, and copied while they are read otherwise.
+    # Raises NewRecordsError when the file can't be used.
+    log = log or _null_log
+    final_header = None
+    filename = os.path.basename(filepath)
+    file_ext = os.path.splitext(filename)[1].lower()
+
+    log(f"Attempting to read New Records file: {filename}\n")
+    log(f"  Using Name column: '{expected_name_col}'\n")
+    log(f"  Using Forename column: '{expected_forename_col}'\n")
+
+    if file_ext in ['.xlsx', '.xls']:
+        sheets = excel_cache.open_sheets(filepath) if excel_cache is not None else None
+        if sheets is not None:
+            log("  Reading the Parquet copy of the Excel file (will process all sheets)...\n")
+        else:
+            log("  Reading as Excel file (will process all sheets)...\n")
+            try:
+                sheets = open_excel_sheets(filepath) # Streams one sheet, one row at a time
+            except Exception as e_streaming_read:
+                log(f"  Streaming Excel read failed: {e_streaming_read}. Falling back to pandas.\n")
+                import pandas as pd # Slow to import, so only when it's needed
+                try:
+                    excel_data = pd.read_excel(filepath, sheet_name=None, engine=None, dtype=str) # Read all as string at firts
+                except Exception as e_pandas_read:
+                    log(f"Pandas read_excel (all sheets) failed: {e_pandas_read}.\n")
+                    engine_to_try = 'openpyxl' if file_ext == '.xlsx' else 'xlrd' if file_ext == '.xls' else None
+                    if engine_to_try:
+                        try:
+                            log(f"  Retrying with engine: {engine_to_try}...\n")
+                            excel_data = pd.read_excel(filepath, sheet_name=None, engine=engine_to_try, dtype=str)
+                        except Exception as e_engine_retry:
+                            raise NewRecordsError(f"Error reading Excel '{filename}' with {engine_to_try}: {e_engine_retry}.")
+                    else:
+                        raise NewRecordsError(f"Error reading Excel file '{filename}': {e_pandas_read}.")
+
+                if not excel_data:
+                    raise NewRecordsError(f"Error: Excel file '{filename}' is empty or no sheets could be read.")
+                sheets = iter_dataframe_sheets(excel_data)
+            if excel_cache is not None:
+                sheets = excel_cache.recording_sheets(filepath, sheets, log)
+
+        rows_done = 0
+        sheet_count = 0
+        for sheet_name, sheet_header, sheet_rows in sheets:
+            sheet_count += 1
+            name_forename_idx, first_row = open_sheet_records(sheet_name, sheet_header, sheet_rows, expected_name_col, expected_forename_col, log)
+            if name_forename_idx is None:
+                continue
+
+            if final_header is None: # Use header from the first sheet that has the required columns
+                final_header = [str(h) for h in sheet_header]
+                log(f"    Using header from sheet '{sheet_name}' for output: {', '.join(final_header)}\n")
+                yield final_header
+
+            # Sheets with other columns are mapped onto the output header by column name
+            column_map = _header_column_map(sheet_header, final_header)
+            for row_values in iter_sheet_records(sheet_name, itertools.chain([first_row], sheet_rows), *name_forename_idx, log, diagnostics, keep_nameless):
+                rows_done += 1
+                if rows_done % PROGRESS_EVERY_ROWS == 0:
+                    _report(progress, 'new_records', rows_done, None, rows_done)
+                yield row_values if column_map is None else [row_values[idx] if idx is not None else '' for idx in column_map]
+
+        if not sheet_count:
+            raise NewRecordsError(f"Error: Excel file '{filename}' is empty or no sheets could be read.")
+        if final_header is None:
+            raise NewRecordsError(f"Error: No sheet in '{filename}' contained the required columns ('{expected_name_col}', '{expected_forename_col}').")
+
+    elif file_ext == '.csv':
+        log(f"  Reading as CSV file with delimiter '{csv_delimiter}'...\n")
+        with open(filepath, mode='r', encoding='utf-8-sig') as file:
+            reader = csv.reader(file, delimiter=csv_delimiter)
+            header_csv_original = next(reader, None)
+            if not header_csv_original:
+                raise NewRecordsError(f"Error: New Records CSV file '{filename}' is empty or has no header.")
+
+            final_header = [str(h) for h in header_csv_original]
+            name_col_idx, forename_col_idx, case_insensitive = resolve_csv_name_columns(final_header, expected_name_col, expected_forename_col)
+            if name_col_idx == -1 or forename_col_idx == -1:
+                raise NewRecordsError(f"Error: Required columns not found in New Records CSV '{filename}'.\n"
+                                      f"Expected: '{expected_name_col}', '{expected_forename_col}'. Found: {', '.join(final_header)}")
+            if case_insensitive:
+                log(f"    Note: Used case-insensitive matching for Name/Forename columns in '{filename}'.\n")
+            yield final_header
+
+            rows_done = 0
+            file_size = os.fstat(file.fileno()).st_size
+            for row_list in iter_new_records_csv_rows(reader, final_header, name_col_idx, forename_col_idx, log, diagnostics=diagnostics, keep_nameless=keep_nameless):
+                rows_done += 1
+                if rows_done % PROGRESS_EVERY_ROWS == 0:
+                    _report(progress, 'new_records', file.buffer.tell(), file_size, rows_done)
+                yield row_list
+    elif file_ext == PARQUET_EXT:
+        log("  Reading as Parquet file...\n")
+        try:
+            final_header = read_parquet_header(filepath)
+            total_rows = parquet_row_count(filepath)
+        except ImportError:
+            raise NewRecordsError(PYARROW_MISSING)
+        name_col_idx, forename_col_idx, case_insensitive = resolve_csv_name_columns(final_header, expected_name_col, expected_forename_col)
+        if name_col_idx == -1 or forename_col_idx == -1:
+            raise NewRecordsError(f"Error: Required columns not found in New Records Parquet file '{filename}'.\n"
+                                  f"Expected: '{expected_name_col}', '{expected_forename_col}'. Found: {', '.join(final_header)}")
+        if case_insensitive:
+            log(f"    Note: Used case-insensitive matching for Name/Forename columns in '{filename}'.\n")
+        yield final_header
+
+        rows_done = 0
+        for i, row_list in enumerate(iter_parquet_rows(filepath), 1):
+            if not (keep_nameless or row_list[name_col_idx].strip() or row_list[forename_col_idx].strip()):
+                _warn(log, diagnostics, 'new_empty_name', i, f"    Warning: Row {i} in Parquet file has empty name/forename fields. Skipping.\n", row_list)
+                continue
+            rows_done += 1
+            if rows_done % PROGRESS_EVERY_ROWS == 0:
+                _report(progress, 'new_records', i, total_rows, rows_done)
+            yield row_list
+    else:
+        raise NewRecordsError(f"Error: Unsupported file type for New Records: '{file_ext}'.")
+
+def open_sheet_records(sheet_name, sheet_header, sheet_rows, expected_name_col, expected_forename_col, log):
+    # Checks one Excel sheet before its rows are read. Returns ((name_idx, forename_idx), first row),
+    # or (None, None) when the sheet is skipped (empty, or without the name columns).
+    log(f"  Processing sheet: '{sheet_name}'...\n")
+    first_row = next(sheet_rows, None) if sheet_header is not None else None
+    if first_row is None:
+        log(f"    Sheet '{sheet_name}' is empty. Skipping.\n")
+        return None, None
+
+    current_sheet_header_orig = sheet_header
+    current_sheet_header_norm = [str(h).strip() for h in current_sheet_header_orig]
+
+    actual_sheet_name_col = expected_name_col
+    actual_sheet_forename_col = expected_forename_col
+
+    if expected_name_col not in current_sheet_header_norm or expected_forename_col not in current_sheet_header_norm:
+        norm_expected_name = expected_name_col.lower()
+        norm_expected_forename = expected_forename_col.lower()
+        found_name = False
+        found_forename = False
+
+        temp_actual_name_col = None
+        temp_actual_forename_col = None
+
+        for idx, h_norm in enumerate(current_sheet_header_norm):
+            if not found_name and h_norm.lower() == norm_expected_name:
+                temp_actual_name_col = current_sheet_header_orig[idx]
+                found_name = True
+            if not found_forename and h_norm.lower() == norm_expected_forename:
+                temp_actual_forename_col = current_sheet_header_orig[idx]
+                found_forename = True
+            if found_name and found_forename:
+                break
+
+        if found_name and found_forename:
+            actual_sheet_name_col = temp_actual_name_col
+            actual_sheet_forename_col = temp_actual_forename_col
+            log(f"    Note: Found '{expected_name_col}' (as '{actual_sheet_name_col}') and '{expected_forename_col}' (as '{actual_sheet_forename_col}') case-insensitively in sheet '{sheet_name}'.\n")
+        else:
+            log(f"    Warning: Sheet '{sheet_name}' missing required columns. Skipping.\n")
+            log(f"    Expected: '{expected_name_col}', '{expected_forename_col}'. Found: {', '.join(current_sheet_header_orig)}\n")
+            return None, None
+
+    # Only the two name columns are looked at before a row is kept
+    return (current_sheet_header_orig.index(actual_sheet_name_col), current_sheet_header_orig.index(actual_sheet_forename_col)), first_row
+
+def iter_sheet_records(sheet_name, rows, name_idx, forename_idx, log=None, diagnostics=None, keep_nameless=False):
+    # Yields the rows of one Excel sheet that have a name or forename, in the sheet's own column order
+    log = log or _null_log
+    for i, row_values in enumerate(rows):
+        # Check for empty name/forename before creating ID (create_unique_id handles internal emptiness)
+        if not (keep_nameless or row_values[name_idx].strip() or row_values[forename_idx].strip()):
+            _warn(log, diagnostics, 'new_empty_name', i+2, f"    Warning: Row {i+2} in sheet '{sheet_name}' has empty name/forename fields. Skipping.\n", row_values)
+            continue
+        yield row_values
+
+def _header_column_map(sheet_header, final_header):
+    # Index in sheet_header of each final_header column (None if absent), or None when they are the same
+    sheet_header = [str(h) for h in sheet_header]
+    if sheet_header == final_header:
+        return None
+    positions = {h: idx for idx, h in enumerate(sheet_header)} # Last one wins, as in a dict
+    return [positions.get(h) for h in final_header]
+
+def _log_records_read(log, filename, record_count):
+    if record_count:
+        log(f"  Successfully processed {record_count} records from New Records file '{filename}'.\n")
+    else:
+        log(f"  Processed file '{filename}', found header but no valid data rows.\n")
+
+def read_new_records_file(filepath, expected_name_col, expected_forename_col, csv_delimiter, log=None, progress=None, diagnostics=None, excel_cache=None, keep_nameless=False):
+    # Reads every usable record as a dict. Returns (records, header, error)
+    log = log or _null_log
+    filename = os.path.basename(filepath)
+    try:
+        rows = iter_new_records(filepath, expected_name_col, expected_forename_col, csv_delimiter, log, progress, diagnostics, excel_cache, keep_nameless)
+        final_header = next(rows)
+        all_records = [dict(zip(final_header, row)) for row in rows]
+    except NewRecordsError as e:
+        return None, None, str(e)
+    except FileNotFoundError:
+        return None, None, f"Error: New Records file not found at '{filepath}'."
+    except Exception as e:
+        return None, None, f"An unexpected error occurred while reading New Records file '{filename}': {e}"
+
+    _log_records_read(log, filename, len(all_records))
+    return all_records, final_header, None
+
+def resolve_csv_name_columns(header, expected_name_col, expected_forename_col):
+    # Returns (name_idx, forename_idx, case_insensitive) for a new records CSV header, -1 when not found
+    normalized_csv_header = [h.strip() for h in header]
+
+    name_col_idx, forename_col_idx = -1, -1
+    try: # Exact match first
+        name_col_idx = normalized_csv_header.index(expected_name_col)
+        forename_col_idx = normalized_csv_header.index(expected_forename_col)
+        return name_col_idx, forename_col_idx, False
+    except ValueError: # Case-insensitive fallback
+        norm_expected_name = expected_name_col.lower()
+        norm_expected_forename = expected_forename_col.lower()
+        for idx, h_norm in enumerate(normalized_csv_header):
+            if name_col_idx == -1 and h_norm.lower() == norm_expected_name:
+                name_col_idx = idx
+            if forename_col_idx == -1 and h_norm.lower() == norm_expected_forename:
+                forename_col_idx = idx
+            if name_col_idx != -1 and forename_col_idx != -1:
+                return name_col_idx, forename_col_idx, True
+        return name_col_idx, forename_col_idx, False
+
+def iter_new_records_csv_rows(reader, final_header, name_col_idx, forename_col_idx, log=None, first_row_number=2, diagnostics=None, keep_nameless=False):
+    # Yields each usable new records CSV row (list of values in header order)
+    log = log or _null_log
+    for i, row_list in enumerate(reader, first_row_number):
+        if len(row_list) != len(final_header):
+            _warn(log, diagnostics, 'new_bad_columns', i, f"    Warning: Row {i} in CSV has incorrect columns ({len(row_list)} vs {len(final_header)} expected). Skipping.\n", row_list)
+            continue
+        name = row_list[name_col_idx]
+        forename = row_list[forename_col_idx]
+        if not (keep_nameless or str(name).strip() or str(forename).strip()):
+            _warn(log, diagnostics, 'new_empty_name', i, f"    Warning: Row {i} in CSV has empty name/forename fields. Skipping.\n", row_list)
+            continue
+        yield row_list
+
+def iter_crm_ids(reader, header_length, lastname_col_idx, firstname_col_idx, log=None, first_row_number=2, diagnostics=None):
+    # Yields the unique ID of each valid CRM row, only looking at the two name columns
+    log = log or _null_log
+    for i, row in enumerate(reader, first_row_number):
+        if len(row) != header_length:
+            _warn(log, diagnostics, 'crm_bad_columns', i, f"Warning: Row {i} in CRM file has incorrect columns ({len(row)} vs {header_length} expected). Skipping.\n", row)
+            continue
+        unique_id = create_unique_id(row[lastname_col_idx], row[firstname_col_idx])
+        if unique_id:
+            yield unique_id
+        else:
+            _warn(log, diagnostics, 'crm_empty_name', i, f"Warning: Row {i} in CRM file has empty/invalid name/forename after normalization. Skipping.\n", row)
+
+def iter_crm_rule_keys(reader, header_length, rules, rule_columns, log=None, first_row_number=2, diagnostics=None):
+    # Yields the match rule keys of each valid CRM row (see MatchRules.row_keys)
+    log = log or _null_log
+    for i, row in enumerate(reader, first_row_number):
+        if len(row) != header_length:
+            _warn(log, diagnostics, 'crm_bad_columns', i, f"Warning: Row {i} in CRM file has incorrect columns ({len(row)} vs {header_length} expected). Skipping.\n", row)
+            continue
+        keys = rules.row_keys(row, rule_columns)
+        if keys:
+            yield keys
+        else:
+            _warn(log, diagnostics, 'crm_no_keys', i, f"Warning: Row {i} in CRM file has no value usable by the match rules. Skipping.\n", row)
+
+def build_crm_id_index(filepath, delimiter, expected_lastname_col, expected_firstname_col, log=None, index=None, progress=None, diagnostics=None, rules=None):
+    # Streaming, key-only variant of read_crm_csv_file: no row dicts are kept, so memory
+    # depends on the number of unique IDs rather than on the size of the CRM export.
+    # Returns (index, error); index is a set unless another structure with add() is given.
+    # With MatchRules, the index holds the keys of every rule, built in the same single pass.
+    log = log or _null_log
+    index = set() if index is None else index
+    if is_parquet_file(filepath):
+        return _build_parquet_crm_id_index(filepath, expected_lastname_col, expected_firstname_col, log, index, progress, diagnostics, rules)
+    filename = os.path.basename(filepath)
+    log(f"Attempting to read CRM file: {filename}\n")
+    log(f"  Using delimiter: '{delimiter}'\n")
+    log(f"  Using Last Name column: '{expected_lastname_col}'\n")
+    log(f"  Using First Name column: '{expected_firstname_col}'\n")
+
+    try:
+        with open(filepath, mode='r', encoding='utf-8-sig', newline='') as file:
+            reader = csv.reader(file, delimiter=delimiter)
+            header = next(reader, None)
+            if not header:
+                return None, f"Error: CRM file '{filename}' is empty or has no header."
+
+            valid_rows = 0
+            add_id = index.add
+            file_size = os.fstat(file.fileno()).st_size
+            if rules is not None:
+                log(f"  Using match rules: {rules.spec()}\n")
+                rule_columns, rules_error = rules.resolve_crm_columns(header, expected_lastname_col, expected_firstname_col)
+                if rules_error:
+                    return None, rules_error
+                for keys in iter_crm_rule_keys(reader, len(header), rules, rule_columns, log, diagnostics=diagnostics):
+                    for key in keys:
+                        add_id(key)
+                    valid_rows += 1
+                    if valid_rows % PROGRESS_EVERY_ROWS == 0:
+                        _report(progress, 'crm', file.buffer.tell(), file_size, valid_rows)
+            else:
+                normalized_header = [h.strip() for h in header]
+                try:
+                    lastname_col_idx = normalized_header.index(expected_lastname_col)
+                    firstname_col_idx = normalized_header.index(expected_firstname_col)
+                except ValueError:
+                    err_msg = (f"Error: Required columns ('{expected_lastname_col}', '{expected_firstname_col}') not found in CRM file '{filename}'.\n"
+                               f"Found headers: {', '.join(header)}")
+                    return None, err_msg
+                for unique_id in iter_crm_ids(reader, len(header), lastname_col_idx, firstname_col_idx, log, diagnostics=diagnostics):
+                    add_id(unique_id)
+                    valid_rows += 1
+                    if valid_rows % PROGRESS_EVERY_ROWS == 0:
+                        _report(progress, 'crm', file.buffer.tell(), file_size, valid_rows)
+            _report(progress, 'crm', file_size, file_size, valid_rows)
+
+        log(f"Successfully processed {valid_rows} records from CRM file ({len(index)} unique IDs generated).\n")
+        return index, None
+    except FileNotFoundError:
+        return None, f"Error: CRM File not found at '{filepath}'."
+    except Exception as e:
+        return None, f"An unexpected error occurred while reading CRM file: {e}"
+
+def _build_parquet_crm_id_index(filepath, expected_lastname_col, expected_firstname_col, log, index, progress, diagnostics, rules):
+    # build_crm_id_index for a Parquet export: only the name (or match rule) columns are read
+    filename = os.path.basename(filepath)
+    log(f"Attempting to read CRM file: {filename}\n")
+    log(f"  Using Last Name column: '{expected_lastname_col}'\n")
+    log(f"  Using First Name column: '{expected_firstname_col}'\n")
+
+    try:
+        header = read_parquet_header(filepath)
+        total_rows = parquet_row_count(filepath)
+        valid_rows = 0
+        add_id = index.add
+        if rules is not None:
+            log(f"  Using match rules: {rules.spec()}\n")
+            rule_columns, rules_error = rules.resolve_crm_columns(header, expected_lastname_col, expected_firstname_col)
+            if rules_error:
+                return None, rules_error
+            used = sorted({idx for terms in rule_columns for _, indexes in terms for idx in indexes})
+            positions = {idx: position for position, idx in enumerate(used)} # Rule columns in the rows read
+            rule_columns = [[(kind, [positions[idx] for idx in indexes]) for kind, indexes in terms] for terms in rule_columns]
+            log(f"  Reading {len(used)} of {len(header)} columns as Parquet\n")
+            rows = iter_parquet_rows(filepath, [header[idx] for idx in used])
+            for keys in iter_crm_rule_keys(rows, len(used), rules, rule_columns, log, diagnostics=diagnostics):
+                for key in keys:
+                    add_id(key)
+                valid_rows += 1
+                if valid_rows % PROGRESS_EVERY_ROWS == 0:
+                    _report(progress, 'crm', valid_rows, total_rows, valid_rows)
+        else:
+            normalized_header = [h.strip() for h in header]
+            try:
+                lastname_col_idx = normalized_header.index(expected_lastname_col)
+                firstname_col_idx = normalized_header.index(expected_firstname_col)
+            except ValueError:
+                err_msg = (f"Error: Required columns ('{expected_lastname_col}', '{expected_firstname_col}') not found in CRM file '{filename}'.\n"
+                           f"Found headers: {', '.join(header)}")
+                return None, err_msg
+            log(f"  Reading 2 of {len(header)} columns as Parquet\n")
+            rows = iter_parquet_rows(filepath, [header[lastname_col_idx], header[firstname_col_idx]])
+            for unique_id in iter_crm_ids(rows, 2, 0, 1, log, diagnostics=diagnostics):
+                add_id(unique_id)
+                valid_rows += 1
+                if valid_rows % PROGRESS_EVERY_ROWS == 0:
+                    _report(progress, 'crm', valid_rows, total_rows, valid_rows)
+        _report(progress, 'crm', total_rows, total_rows, valid_rows)
+    except ImportError:
+        return None, PYARROW_MISSING
+    except FileNotFoundError:
+        return None, f"Error: CRM File not found at '{filepath}'."
+    except Exception as e:
+        return None, f"An unexpected error occurred while reading CRM file: {e}"
+
+    log(f"Successfully processed {valid_rows} records from CRM file ({len(index)} unique IDs generated).\n")
+    return index, None
+
+class _LineReader:
+    # Lines of a file opened in binary mode, decoded for csv.reader, keeping track of the byte
+    # offset reached (csv.reader reads exactly the lines of each row, never further)
+    def __init__(self, file):
+        self.file = file
+        self.position = file.tell()
+        self.complete = True # Whether the last line read ended with a line break
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.file.readline()
+        if not line:
+            raise StopIteration
+        self.position += len(line)
+        self.complete = line.endswith(b'\n')
+        return line.decode('utf-8')
+
+def extend_crm_id_index(filepath, delimiter, expected_lastname_col, expected_firstname_col, index, checkpoint=None, log=None, progress=None, diagnostics=None, rules=None):
+    # build_crm_id_index for append-only exports: adds the rows after a checkpoint (see
+    # dedup_cache.make_checkpoint), or all rows without one, to index. Returns (index, resume,
+    # pending_ids, error) where resume = (data_start, offset, rows) is where the next run can
+    # start: after the last row ending with a line break. The IDs of an unfinished last line
+    # (an export still being written) are in pending_ids instead of index: they count for this
+    # run but must not be saved, since the line is read again, completed, next time.
+    log = log or _null_log
+    filename = os.path.basename(filepath)
+    try:
+        with open(filepath, mode='rb') as file:
+            if file.read(len(codecs.BOM_UTF8)) != codecs.BOM_UTF8:
+                file.seek(0)
+            header_lines = _LineReader(file) # The header can span lines (quoted line breaks)
+            header = next(csv.reader(header_lines, delimiter=delimiter), None)
+            if not header:
+                return None, None, None, f"Error: CRM file '{filename}' is empty or has no header."
+            data_start = header_lines.position
+            offset, rows = (checkpoint['offset'], checkpoint['rows']) if checkpoint is not None else (data_start, 0)
+            file_size = os.fstat(file.fileno()).st_size
+            if checkpoint is None:
+                log(f"Attempting to read CRM file: {filename}\n")
+                log(f"  Using delimiter: '{delimiter}'\n")
+                log(f"  Using Last Name column: '{expected_lastname_col}'\n")
+                log(f"  Using First Name column: '{expected_firstname_col}'\n")
+            else:
+                log(f"Reading CRM file '{filename}' from row {rows + 2} ({file_size - offset} bytes appended)\n")
+
+            file.seek(offset)
+            lines = _LineReader(file)
+            resume = [offset, rows]
+            def counted_rows():
+                for row in csv.reader(lines, delimiter=delimiter):
+                    if lines.complete:
+                        resume[0] = lines.position
+                        resume[1] += 1
+                    yield row
+
+            valid_rows = 0
+            pending_ids = set()
+            if rules is not None:
+                rule_columns, rules_error = rules.resolve_crm_columns(header, expected_lastname_col, expected_firstname_col)
+                if rules_error:
+                    return None, None, None, rules_error
+                for keys in iter_crm_rule_keys(counted_rows(), len(header), rules, rule_columns, log, rows + 2, diagnostics):
+                    add_id = index.add if lines.complete else pending_ids.add
+                    for key in keys:
+                        add_id(key)
+                    valid_rows += 1
+                    if valid_rows % PROGRESS_EVERY_ROWS == 0:
+                        _report(progress, 'crm', lines.position, file_size, valid_rows)
+            else:
+                normalized_header = [h.strip() for h in header]
+                try:
+                    lastname_col_idx = normalized_header.index(expected_lastname_col)
+                    firstname_col_idx = normalized_header.index(expected_firstname_col)
+                except ValueError:
+                    err_msg = (f"Error: Required columns ('{expected_lastname_col}', '{expected_firstname_col}') not found in CRM file '{filename}'.\n"
+                               f"Found headers: {', '.join(header)}")
+                    return None, None, None, err_msg
+                for unique_id in iter_crm_ids(counted_rows(), len(header), lastname_col_idx, firstname_col_idx, log, rows + 2, diagnostics):
+                    if lines.complete:
+                        index.add(unique_id)
+                    else:
+                        pending_ids.add(unique_id)
+                    valid_rows += 1
+                    if valid_rows % PROGRESS_EVERY_ROWS == 0:
+                        _report(progress, 'crm', lines.position, file_size, valid_rows)
+            _report(progress, 'crm', file_size, file_size, valid_rows)
+
+        log(f"Successfully processed {valid_rows} records from CRM file ({len(index) + len(pending_ids - index)} unique IDs in total).\n")
+        return index, (data_start, resume[0], resume[1]), pending_ids, None
+    except FileNotFoundError:
+        return None, None, None, f"Error: CRM File not found at '{filepath}'."
+    except Exception as e:
+        return None, None, None, f"An unexpected error occurred while reading CRM file: {e}"
+
+def load_crm_index(crm_filepath, config=None, log=None, cache=None, jobs=1, progress=None, diagnostics=None, rules=None, run_report=None, compact_index=None):
+    # Reads the CRM export and returns the set of its unique IDs (or match rule keys with MatchRules).
+    # With a CrmIndexCache, an index built from the same file and settings is reused; with an
+    # incremental one, an index of an earlier version of an append-only file is extended.
+    # jobs != 1 reads large exports with several processes (0 = one per CPU core).
+    # With an empty CompactIdIndex (dedup_hashindex), the keys are hashed into it instead.
+    config = config or CONFIG
+    log = log or _null_log
+    log(f"Processing CRM file: {os.path.basename(crm_filepath)}...\n")
+    delimiter, lastname_col, firstname_col = config['CRM_DELIMITER'], config['CRM_LAST_NAME_COL'], config['CRM_FIRST_NAME_COL']
+    if compact_index is not None:
+        if run_report is not None:
+            run_report.info['crm_index_cache'] = 'off'
+        return _load_compact_crm_index(crm_filepath, delimiter, lastname_col, firstname_col, log, jobs, progress, diagnostics, rules, compact_index)
+    if cache is not None and cache.incremental and is_parquet_file(crm_filepath):
+        log("  Note: Incremental mode only applies to CSV exports; the CRM index is cached as usual.\n")
+    elif cache is not None and cache.incremental:
+        return _load_incremental_crm_index(crm_filepath, delimiter, lastname_col, firstname_col, log, jobs, progress, diagnostics, rules, cache, run_report)
+
+    cache_key = None
+    if cache is not None:
+        try:
+            cache_key = cache.cache_key(crm_filepath, delimiter, lastname_col, firstname_col, rules.spec() if rules is not None else None)
+            crm_unique_ids = cache.load(cache_key)
+        except OSError:
+            crm_unique_ids = None # Missing file etc.: let the normal read report it
+        if crm_unique_ids is not None:
+            log(f"Loaded CRM index from cache ({len(crm_unique_ids)} unique IDs).\n")
+            if run_report is not None:
+                run_report.info['crm_index_cache'] = 'hit'
+            return crm_unique_ids, None
+    if run_report is not None:
+        run_report.info['crm_index_cache'] = 'miss' if cache is not None else 'off'
+
+    if jobs == 1 or rules is not None or is_parquet_file(crm_filepath):
+        if jobs != 1:
+            log("  Note: Match rules read the CRM file in a single process.\n" if rules is not None else "  Note: Parquet files are read in a single process.\n")
+        crm_unique_ids, crm_error = build_crm_id_index(crm_filepath, delimiter, lastname_col, firstname_col, log, progress=progress, diagnostics=diagnostics, rules=rules)
+    else:
+        from dedup_parallel import build_crm_id_index_parallel
+        crm_unique_ids, crm_error = build_crm_id_index_parallel(crm_filepath, delimiter, lastname_col, firstname_col, log, jobs, progress, diagnostics)
+    if crm_error:
+        return None, crm_error
+    if crm_unique_ids is None:
+        return None, "Critical error reading CRM file (crm_unique_ids is None)."
+    log(f"Found {len(crm_unique_ids)} unique IDs in CRM file.\n" if crm_unique_ids else "Warning: CRM file yielded no unique IDs to compare against.\n")
+
+    if cache_key is not None:
+        try:
+            cache.save(cache_key, crm_unique_ids)
+        except OSError as e:
+            log(f"Warning: Could not write CRM index cache: {e}\n")
+    return crm_unique_ids, None
+
+def _load_incremental_crm_index(crm_filepath, delimiter, lastname_col, firstname_col, log, jobs, progress, diagnostics, rules, cache, run_report):
+    from dedup_cache import checkpoint_matches, make_checkpoint
+    key = cache.incremental_key(crm_filepath, delimiter, lastname_col, firstname_col, rules.spec() if rules is not None else None)
+    crm_unique_ids, checkpoint = cache.load_checkpoint(key)
+    cache_state = 'miss'
+    if checkpoint is not None and not checkpoint_matches(crm_filepath, checkpoint):
+        log("  The CRM file was changed before the last checkpoint, not only appended to: rebuilding the index.\n")
+        crm_unique_ids, checkpoint, cache_state = None, None, 'rebuild'
+    elif checkpoint is not None:
+        log(f"Loaded CRM index from cache ({len(crm_unique_ids)} unique IDs from {checkpoint['rows']} rows).\n")
+        cache_state = 'append'
+    if checkpoint is not None and os.path.getsize(crm_filepath) == checkpoint['offset']:
+        if run_report is not None:
+            run_report.info['crm_index_cache'] = 'hit' # Nothing appended since
+        return crm_unique_ids, None
+    if jobs != 1:
+        log("  Note: Incremental mode reads the CRM file in a single process.\n")
+
+    crm_unique_ids, resume, pending_ids, crm_error = extend_crm_id_index(crm_filepath, delimiter, lastname_col, firstname_col, crm_unique_ids if crm_unique_ids is not None else set(),
+                                                            checkpoint, log, progress, diagnostics, rules)
+    if crm_error:
+        return None, crm_error
+    try:
+        cache.save(key, crm_unique_ids, make_checkpoint(crm_filepath, *resume, cache.hash_content))
+    except OSError as e:
+        log(f"Warning: Could not write CRM index cache: {e}\n")
+    crm_unique_ids.update(pending_ids) # Only after saving: the unfinished last line is read again next run
+    if run_report is not None:
+        run_report.info['crm_index_cache'] = cache_state
+    log(f"Found {len(crm_unique_ids)} unique IDs in CRM file.\n" if crm_unique_ids else "Warning: CRM file yielded no unique IDs to compare against.\n")
+    return crm_unique_ids, None
+
+def _is_compact_index(index):
+    # dedup_hashindex (and NumPy with it) is only loaded by callers that build a compact index
+    hashindex = sys.modules.get('dedup_hashindex')
+    return hashindex is not None and isinstance(index, hashindex.CompactIdIndex)
+
+def _load_compact_crm_index(crm_filepath, delimiter, lastname_col, firstname_col, log, jobs, progress, diagnostics, rules, compact_index):
+    if jobs != 1:
+        log("  Note: The compact index is built in a single process.\n")
+    log(f"  Using a compact index of {compact_index.bits}-bit hashes{' with a Bloom filter' if compact_index.bloom_bits_per_key else ''} (not cached).\n")
+    _, crm_error = build_crm_id_index(crm_filepath, delimiter, lastname_col, firstname_col, log, index=compact_index, progress=progress, diagnostics=diagnostics, rules=rules)
+    if crm_error:
+        return None, crm_error
+    compact_index.finalize()
+    log(f"Found {len(compact_index)} unique hashed IDs in CRM file ({compact_index.nbytes() / (1024 * 1024):.1f} MB).\n")
+
+    def verify(candidates):
+        # Reads the CRM file again, keeping only the keys that matched a hash
+        log(f"Verifying {len(candidates)} hash matches against the CRM file...\n")
+        from dedup_hashindex import KeyCollector
+        collector = KeyCollector(candidates)
+        _, verify_error = build_crm_id_index(crm_filepath, delimiter, lastname_col, firstname_col, _null_log, index=collector, rules=rules)
+        if verify_error: # Keep the hash matches rather than failing the run
+            log(f"Warning: Could not verify the hash matches ({verify_error}); hash collisions were not checked.\n")
+            return candidates
+        if len(collector.found) < len(candidates):
+            log(f"  {len(candidates) - len(collector.found)} hash collision(s) rejected.\n")
+        return collector.found
+
+    if compact_index.verify:
+        compact_index.verifier = verify
+    return compact_index, None
+
+def resolve_compare_columns(new_records_header, config=None):
+    # Returns the (name, forename) record keys used for comparison, or an error message
+    config = config or CONFIG
+    current_new_records_name = config['NEW_RECORDS_NAME_COL']
+    current_new_records_forename = config['NEW_RECORDS_FORENAME_COL']
+
+    normalized_global_header_map = {str(h).strip().lower(): str(h) for h in new_records_header}
+    actual_name_col_in_header = normalized_global_header_map.get(current_new_records_name.lower())
+    actual_forename_col_in_header = normalized_global_header_map.get(current_new_records_forename.lower())
+
+    if not actual_name_col_in_header or not actual_forename_col_in_header:
+        err_msg = (f"Critical Error: Configured Name/Forename columns ('{current_new_records_name}', '{current_new_records_forename}') not found in determined New Records header after normalization. Cannot compare.\n"
+                   f"Determined header: {', '.join(new_records_header)}\n"
+                   f"Normalized map: {normalized_global_header_map}")
+        return None, None, err_msg
+    return actual_name_col_in_header, actual_forename_col_in_header, None
+
+# --- Duplicates inside the new records file ---
+
+KEEP_POLICIES = ('first', 'last', 'most_filled', 'none') # 'none' keeps every copy
+IN_FILE_OUTPUT_COLUMNS = ['Duplicate group', 'Kept']
+
+def parse_keep_policy(value):
+    # CONFIG value -> (policy or None when disabled, error message)
+    policy = str(value or '').strip().lower() or 'none'
+    if policy not in KEEP_POLICIES:
+        return None, f"Error: In-file duplicates policy must be one of {', '.join(KEEP_POLICIES)} (got '{value}')."
+    return (None if policy == 'none' else policy), None
+
+def _filled_fields(record_dict):
+    return sum(1 for v in record_dict.values() if str(v).strip())
+
+class InFileDuplicates:
+    # Collapses records sharing an ID into one, chosen by the keep policy. groups holds
+    # (group number, [records]) for every ID seen more than once, in order of first appearance.
+
+    def __init__(self, keep='first'):
+        self.keep = keep
+        self.groups = []
+
+    def collapse(self, records, record_ids):
+        # Returns the positions of the records kept, one copy per ID
+        positions = {}
+        for idx, current_id in enumerate(record_ids):
+            if current_id: # Records without a name (kept for match rules) are never grouped
+                positions.setdefault(current_id, []).append(idx)
+        dropped = set()
+        groups = []
+        for group_positions in positions.values():
+            if len(group_positions) < 2:
+                continue
+            if self.keep == 'last':
+                kept = group_positions[-1]
+            elif self.keep == 'most_filled': # Ties go to the first copy
+                kept = max(group_positions, key=lambda i: (_filled_fields(records[i]), -i))
+            else:
+                kept = group_positions[0]
+            dropped.update(i for i in group_positions if i != kept)
+            groups.append((len(groups) + 1, [(records[i], i == kept) for i in group_positions]))
+        self.groups = groups
+        return {idx for idx in range(len(records)) if idx not in dropped}
+
+    def removed_count(self):
+        return sum(len(members) - 1 for _, members in self.groups)
+
+    def output_records(self, header):
+        # (records, header) listing every member of each group, the kept copy marked 'yes'
+        out_header = [str(h) for h in header] + IN_FILE_OUTPUT_COLUMNS
+        records = [
+            dict(record, **{'Duplicate group': group_number, 'Kept': 'yes' if kept else 'no'})
+            for group_number, members in self.groups
+            for record, kept in members
+        ]
+        return records, out_header
+
+def classify_records(new_records_list, new_records_header, crm_unique_ids, config=None, log=None, record_ids=None, progress=None, diagnostics=None, fuzzy=None, in_file=None, rules=None):
+    # Splits the new records into uniques and duplicates against the CRM IDs.
+    # record_ids can carry IDs already computed for new_records_list (e.g. by worker processes).
+    # With a built FuzzyMatcher, records without an exact match but with a close one are
+    # kept in fuzzy.matches instead of uniques.
+    # With an InFileDuplicates, a contact repeated in the file keeps a single copy, collapsed
+    # before the fuzzy check so that copies of a near match are grouped too.
+    # With MatchRules, crm_unique_ids holds rule keys and each duplicate gets the rule that matched it.
+    # A CompactIdIndex is looked up once for all records, then only the keys it matched are used.
+    log = log or _null_log
+    uniques = []
+    duplicates = []
+
+    log("\nComparing records...\n")
+
+    actual_name_col_in_header, actual_forename_col_in_header, err_msg = resolve_compare_columns(new_records_header, config)
+    if err_msg:
+        return None, None, err_msg
+    if rules is not None:
+        rule_columns, err_msg = rules.resolve_new_columns(new_records_header, actual_name_col_in_header, actual_forename_col_in_header)
+        if err_msg:
+            return None, None, err_msg
+        rules.reset_counts()
+
+    if record_ids is None:
+        record_ids = create_unique_ids(
+            [record_dict.get(actual_name_col_in_header, "") for record_dict in new_records_list],
+            [record_dict.get(actual_forename_col_in_header, "") for record_dict in new_records_list]
+        )
+    if _is_compact_index(crm_unique_ids):
+        if rules is not None:
+            crm_unique_ids = crm_unique_ids.matching_keys(key for record_dict in new_records_list for key in rules.row_keys(record_dict, rule_columns))
+        else:
+            crm_unique_ids = crm_unique_ids.matching_keys(current_id for current_id in record_ids if current_id)
+
+    total_records = len(new_records_list)
+    matches = [] # Matched rule (True without rules) of each record, None when it isn't in the CRM
+    left_out = set() # Skipped records and the copies collapsed by in_file
+    for idx, (record_dict, current_id) in enumerate(zip(new_records_list, record_ids)):
+        if not current_id and (rules is None or not rules.row_keys(record_dict, rule_columns)): # Rules on other columns can still apply
+            name_val = record_dict.get(actual_name_col_in_header, "")
+            forename_val = record_dict.get(actual_forename_col_in_header, "")
+            _warn(log, diagnostics, 'new_empty_id', idx+2,
+                  f"Warning: Skipping record (row {idx+2} approx, ID empty after normalization): { {actual_name_col_in_header: name_val, actual_forename_col_in_header: forename_val} }\n",
+                  list(record_dict.values()))
+            matches.append(None)
+            left_out.add(idx)
+        elif rules is not None:
+            matches.append(rules.match(record_dict, rule_columns, crm_unique_ids) if crm_unique_ids is not None else None)
+        else:
+            matches.append(True if crm_unique_ids is not None and current_id in crm_unique_ids else None)
+
+    if in_file is not None:
+        candidates = [idx for idx, matched in enumerate(matches) if matched is None and idx not in left_out]
+        kept = in_file.collapse([new_records_list[idx] for idx in candidates], [record_ids[idx] for idx in candidates])
+        left_out.update(idx for position, idx in enumerate(candidates) if position not in kept)
+
+    for idx, (record_dict, current_id, matched) in enumerate(zip(new_records_list, record_ids, matches)):
+        if idx % PROGRESS_EVERY_ROWS == 0:
+            _report(progress, 'compare', idx, total_records, idx)
+        if idx in left_out:
+            continue
+        if matched is not None:
+            duplicates.append(record_dict if rules is None else dict(record_dict, **{MATCH_RULE_COLUMN: matched}))
+        elif fuzzy is None or not current_id or not fuzzy.check(record_dict, current_id):
+            uniques.append(record_dict)
+
+    _report(progress, 'compare', total_records, total_records, total_records)
+    return uniques, duplicates, None
+
+def _prepare_fuzzy(fuzzy, crm_unique_ids, rules, log, run_report=None):
+    # Builds the fuzzy matching index; returns the matcher, or None when it can't be used
+    if fuzzy is None:
+        return None
+    if _is_compact_index(crm_unique_ids):
+        log("Note: Fuzzy matching needs the CRM IDs themselves, which the compact index doesn't keep; skipped.\n")
+        return None
+    crm_name_ids = crm_unique_ids if rules is None else rules.name_ids(crm_unique_ids)
+    if crm_name_ids is None:
+        log("Note: Fuzzy matching needs a match rule made of 'name' alone; skipped.\n")
+        return None
+    log(f"Building fuzzy matching index (threshold {fuzzy.threshold})...\n")
+    _stage_start(run_report, 'fuzzy_index')
+    fuzzy.build(crm_name_ids)
+    _stage_finish(run_report, 'fuzzy_index', len(crm_name_ids), len(fuzzy.blocks), skipped_blocks=fuzzy.skipped_blocks)
+    if fuzzy.skipped_blocks:
+        log(f"Warning: {fuzzy.skipped_blocks} fuzzy matching blocks are too large even after splitting; near duplicates only found through them are not reported.\n")
+    return fuzzy
+
+def _rejected_new_rows(diagnostics):
+    # New records rows dropped while reading (counted by Diagnostics)
+    counts = getattr(diagnostics, 'counts', {})
+    return counts.get('new_bad_columns', 0) + counts.get('new_empty_name', 0)
+
+def _record_run_info(run_report, diagnostics, normalize_cache_before):
+    # Run-level facts for the RunReport: rejected rows and the name normalization memo hit rate
+    if run_report is None:
+        return
+    cache_after = normalize_cache_info()
+    hits = cache_after.hits - normalize_cache_before.hits
+    misses = cache_after.misses - normalize_cache_before.misses
+    run_report.info['normalize_cache'] = {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / (hits + misses), 4) if hits + misses else None,
+    }
+    run_report.info['rejected_rows'] = dict(getattr(diagnostics, 'counts', {}))
+
+def run_deduplication(crm_filepath, new_records_filepath, config=None, log=None, cache=None, jobs=1, progress=None, diagnostics=None, fuzzy=None, in_file=None, rules=None, run_report=None,
+                      compact_index=None, excel_cache=None):
+    # Full pipeline: CRM index, new records, comparison. Returns (uniques, duplicates, header, error).
+    # A RunProgress receives progress reports and can cancel the run from another thread.
+    # Row warnings are aggregated by a Diagnostics (a default one logging a few samples is used if none is given).
+    # A FuzzyMatcher enables near-duplicate matching; its matches attribute receives the possible duplicates.
+    # An InFileDuplicates collapses contacts repeated in the new records file; its groups attribute lists them.
+    # MatchRules (dedup_rules) replace the name comparison; duplicates then carry MATCH_RULE_COLUMN.
+    # A RunReport (dedup_report) receives the time, row counts and memory of each stage.
+    # An empty CompactIdIndex (dedup_hashindex) holds the CRM keys as hashes instead of a set.
+    # An ExcelParquetCache (dedup_parquet) keeps Parquet copies of Excel new records files.
+    log = log or _null_log
+    diagnostics = diagnostics or Diagnostics(log)
+    try:
+        return _run_deduplication(crm_filepath, new_records_filepath, config, log, cache, jobs, progress, diagnostics, fuzzy, in_file, rules, run_report, compact_index, excel_cache)
+    except ProcessingCancelled:
+        return None, None, None, "Processing cancelled."
+    finally:
+        diagnostics.close()
+
+def _run_deduplication(crm_filepath, new_records_filepath, config, log, cache, jobs, progress, diagnostics, fuzzy, in_file, rules, run_report, compact_index, excel_cache):
+    config = config or CONFIG
+
+    if not crm_filepath or not new_records_filepath:
+        return None, None, None, "Error: Both CRM export file and New Records file must be selected."
+    normalize_cache_before = normalize_cache_info()
+
+    # --- Read CRM File ---
+    _stage_start(run_report, 'crm_index')
+    crm_unique_ids, crm_error = load_crm_index(crm_filepath, config, log, cache, jobs, progress, diagnostics, rules, run_report, compact_index)
+    if crm_error:
+        return None, None, None, crm_error
+    _stage_finish(run_report, 'crm_index', rows_out=len(crm_unique_ids))
+
+    # --- Read New Records File ---
+    _stage_start(run_report, 'new_records')
+    log(f"\nProcessing New Records file: {os.path.basename(new_records_filepath)}...\n")
+    record_ids = None
+    if jobs == 1:
+        new_records_list, header_from_new_file, new_records_error = read_new_records_file(
+            new_records_filepath, config['NEW_RECORDS_NAME_COL'], config['NEW_RECORDS_FORENAME_COL'], config['NEW_RECORDS_CSV_DELIMITER'], log, progress, diagnostics, excel_cache,
+            rules is not None
+        )
+    else:
+        from dedup_parallel import read_new_records_parallel
+        new_records_list, header_from_new_file, record_ids, new_records_error = read_new_records_parallel(
+            new_records_filepath, config, log, jobs, progress, diagnostics, excel_cache, rules is not None
+        )
+    if new_records_error:
+        return None, None, None, new_records_error
+
+    if not header_from_new_file:
+        return None, None, None, "Critical Error: No valid header could be determined from New Records file. Cannot compare or save."
+    _stage_finish(run_report, 'new_records', len(new_records_list) + _rejected_new_rows(diagnostics), len(new_records_list))
+
+    log(f"Using header for New Records: {', '.join(map(str, header_from_new_file))}\n")
+
+    if not new_records_list: # Check if list is empty after successful header read
+        log("Warning: New Records file has a valid header but contains no data rows to process.\n")
+    else:
+        log(f"Total records to process from New Records file: {len(new_records_list)}\n")
+
+    # --- Comparison Logic ---
+    fuzzy = _prepare_fuzzy(fuzzy, crm_unique_ids, rules, log, run_report)
+    _stage_start(run_report, 'compare')
+    uniques, duplicates, compare_error = classify_records(new_records_list, header_from_new_file, crm_unique_ids, config, log, record_ids, progress, diagnostics, fuzzy, in_file, rules)
+    if compare_error:
+        return None, None, None, compare_error
+    _stage_finish(run_report, 'compare', len(new_records_list), len(uniques) + len(duplicates),
+                  uniques=len(uniques), duplicates=len(duplicates), possible_duplicates=len(fuzzy.matches) if fuzzy is not None else None)
+    _record_run_info(run_report, diagnostics, normalize_cache_before)
+
+    log("\n--- Processing Complete ---\n")
+    log(f"Unique new contacts to import: {len(uniques)}\n")
+    log(f"Duplicate contacts found (for review): {len(duplicates)}\n")
+    if rules is not None:
+        for label, count in rules.counts.items():
+            log(f"  Matched by rule '{label}': {count}\n")
+    if fuzzy is not None:
+        log(f"Possible duplicates (fuzzy matches, for review): {len(fuzzy.matches)}\n")
+    if in_file is not None:
+        log(f"Repeated contacts in the new records file: {len(in_file.groups)} (keeping {in_file.keep}, {in_file.removed_count()} extra copies left out)\n")
+    log(diagnostics.summary())
+    return uniques, duplicates, header_from_new_file, None
+
+def stream_deduplication(crm_filepath, new_records_filepath, output_dir, config=None, log=None, cache=None, jobs=1, progress=None, diagnostics=None, fuzzy=None, in_file=None, rules=None, run_report=None,
+                         output_format='csv', excel_cache=None):
+    # Single-pass variant of run_deduplication: each new record is classified as it is read and
+    # written straight to the output files in output_dir, so the records are never all held in
+    # memory (in_file still keeps one ID per distinct contact). Returns (unique count, duplicate
+    # count, header, error).
+    # Differences: jobs only applies to the CRM file, in_file must keep 'first' and only the
+    # copies left out are listed, and the fuzzy matches are written instead of kept in fuzzy.matches.
+    # The output files are written in output_format (one of OUTPUT_FORMATS).
+    log = log or _null_log
+    diagnostics = diagnostics or Diagnostics(log)
+    try:
+        return _stream_deduplication(crm_filepath, new_records_filepath, output_dir, config, log, cache, jobs, progress, diagnostics, fuzzy, in_file, rules, run_report,
+                                     output_format, excel_cache)
+    except ProcessingCancelled:
+        return None, None, None, "Processing cancelled."
+    finally:
+        diagnostics.close()
+
+def _stream_deduplication(crm_filepath, new_records_filepath, output_dir, config, log, cache, jobs, progress, diagnostics, fuzzy, in_file, rules, run_report, output_format, excel_cache):
+    config = config or CONFIG
+
+    if not crm_filepath or not new_records_filepath:
+        return None, None, None, "Error: Both CRM export file and New Records file must be selected."
+    if in_file is not None and in_file.keep != 'first':
+        return None, None, None, f"Error: Streaming mode can only keep the first copy of repeated contacts (got '{in_file.keep}')."
+
+    normalize_cache_before = normalize_cache_info()
+
+    # --- Read CRM File ---
+    _stage_start(run_report, 'crm_index')
+    crm_unique_ids, crm_error = load_crm_index(crm_filepath, config, log, cache, jobs, progress, diagnostics, rules, run_report)
+    if crm_error:
+        return None, None, None, crm_error
+    _stage_finish(run_report, 'crm_index', rows_out=len(crm_unique_ids))
+    fuzzy = _prepare_fuzzy(fuzzy, crm_unique_ids, rules, log, run_report)
+
+    # --- Read, compare and write the New Records in one pass ---
+    new_records_filename = os.path.basename(new_records_filepath)
+    log(f"\nProcessing New Records file: {new_records_filename}...\n")
+    outputs = {}
+    _stage_start(run_report, 'stream')
+    try:
+        rows = iter_new_records(new_records_filepath, config['NEW_RECORDS_NAME_COL'], config['NEW_RECORDS_FORENAME_COL'], config['NEW_RECORDS_CSV_DELIMITER'], log, progress, diagnostics,
+                                excel_cache, rules is not None)
+        header = next(rows)
+        log(f"Using header for New Records: {', '.join(header)}\n")
+        name_key, forename_key, compare_error = resolve_compare_columns(header, config)
+        if compare_error:
+            return None, None, None, compare_error
+        positions = {h: idx for idx, h in enumerate(header)} # Last one wins, as in the record dicts
+        name_idx, forename_idx = positions[name_key], positions[forename_key]
+        if rules is not None:
+            rule_columns, rules_error = rules.resolve_new_columns(header, name_key, forename_key, by_name=False)
+            if rules_error:
+                return None, None, None, rules_error
+            rules.reset_counts()
+
+        os.makedirs(output_dir, exist_ok=True)
+        output_headers = {
+            UNIQUES_FILENAME: header,
+            DUPLICATES_FILENAME: header + [MATCH_RULE_COLUMN] if rules is not None else header,
+        }
+        if fuzzy is not None:
+            from dedup_fuzzy import FUZZY_MATCHES_FILENAME, FUZZY_OUTPUT_COLUMNS
+            output_headers[FUZZY_MATCHES_FILENAME] = header + FUZZY_OUTPUT_COLUMNS
+        if in_file is not None:
+            output_headers[IN_FILE_DUPLICATES_FILENAME] = header + IN_FILE_OUTPUT_COLUMNS
+        for filename, output_header in output_headers.items():
+            # Written under a temporary name so an interrupted run leaves no partial output
+            outputs[filename] = open_output_writer(os.path.join(output_dir, output_filename(filename, output_format) + '.part'), output_header, output_format)
+        write_unique = outputs[UNIQUES_FILENAME][1].writerow
+        write_duplicate = outputs[DUPLICATES_FILENAME][1].writerow
+
+        counts = {'records': 0, 'uniques': 0, 'duplicates': 0, 'possible': 0, 'repeated': 0, 'groups': 0}
+        seen_ids = {} # ID -> duplicate group number (0 until repeated), for in_file
+        for row in rows:
+            counts['records'] += 1
+            current_id = create_unique_id(row[name_idx], row[forename_idx])
+            if not current_id and (rules is None or not rules.row_keys(row, rule_columns)): # Rules on other columns can still apply
+                _warn(log, diagnostics, 'new_empty_id', counts['records']+1,
+                      f"Warning: Skipping record (row {counts['records']+1} approx, ID empty after normalization): { {name_key: row[name_idx], forename_key: row[forename_idx]} }\n",
+                      row)
+                continue
+
+            if rules is not None:
+                matched_rule = rules.match(row, rule_columns, crm_unique_ids)
+                if matched_rule is not None:
+                    write_duplicate(row + [matched_rule])
+                    counts['duplicates'] += 1
+                    continue
+            elif current_id in crm_unique_ids:
+                write_duplicate(row)
+                counts['duplicates'] += 1
+                continue
+
+            if in_file is not None and current_id: # Before fuzzy, so near matches are grouped too; nameless contacts never are
+                group_number = seen_ids.get(current_id)
+                if group_number is None:
+                    seen_ids[current_id] = 0
+                else:
+                    if not group_number:
+                        counts['groups'] += 1
+                        group_number = seen_ids[current_id] = counts['groups']
+                    outputs[IN_FILE_DUPLICATES_FILENAME][1].writerow(row + [group_number, 'no'])
+                    counts['repeated'] += 1
+                    continue
+            if fuzzy is not None and current_id:
+                match = fuzzy.best_match(current_id)
+                if match is not None:
+                    outputs[FUZZY_MATCHES_FILENAME][1].writerow(row + fuzzy.match_values(*match))
+                    counts['possible'] += 1
+                    continue
+            write_unique(row)
+            counts['uniques'] += 1
+
+        for filename, (file, _) in list(outputs.items()):
+            file.close()
+            os.replace(file.name, os.path.join(output_dir, output_filename(filename, output_format)))
+            del outputs[filename]
+    except NewRecordsError as e:
+        return None, None, None, str(e)
+    except FileNotFoundError:
+        return None, None, None, f"Error: New Records file not found at '{new_records_filepath}'."
+    except ImportError:
+        return None, None, None, PYARROW_MISSING
+    except Exception as e:
+        return None, None, None, f"An unexpected error occurred while processing New Records file '{new_records_filename}': {e}"
+    finally:
+        for file, _ in outputs.values(): # Only left on failure or cancellation
+            file.close()
+            os.remove(file.name)
+
+    _stage_finish(run_report, 'stream', counts['records'] + _rejected_new_rows(diagnostics),
+                  counts['uniques'] + counts['duplicates'] + counts['possible'] + counts['repeated'],
+                  uniques=counts['uniques'], duplicates=counts['duplicates'], possible_duplicates=counts['possible'] if fuzzy is not None else None)
+    _record_run_info(run_report, diagnostics, normalize_cache_before)
+    _log_records_read(log, new_records_filename, counts['records'])
+    log("\n--- Processing Complete ---\n")
+    log(f"Unique new contacts to import: {counts['uniques']}\n")
+    log(f"Duplicate contacts found (for review): {counts['duplicates']}\n")
+    if rules is not None:
+        for label, count in rules.counts.items():
+            log(f"  Matched by rule '{label}': {count}\n")
+    if fuzzy is not None:
+        log(f"Possible duplicates (fuzzy matches, for review): {counts['possible']}\n")
+    if in_file is not None:
+        log(f"Repeated contacts in the new records file: {counts['groups']} (keeping first, {counts['repeated']} extra copies left out)\n")
+    log(diagnostics.summary())
+    return counts['uniques'], counts['duplicates'], header, None
+
+def _output_value(value):
+    if isinstance(value, str):
+        return value
+    return "" if _is_na(value) else str(value)
+
+def output_filename(filename, output_format='csv'):
+    # Name of an output file (e.g. UNIQUES_FILENAME) in one of OUTPUT_FORMATS
+    return os.path.splitext(filename)[0] + '.' + output_format
+
+def open_output_writer(filepath, header_row, output_format='csv'):
+    # Opens an output file written one row at a time and writes its header. Returns (file, writer):
+    # writer.writerow() takes a list in header order, file.close() completes the file.
+    if output_format == 'parquet':
+        from dedup_parquet import ParquetRowWriter
+        writer = ParquetRowWriter(filepath, header_row)
+        return writer, writer
+    file = open(filepath, mode='w', newline='', encoding='utf-8')
+    writer = csv.writer(file)
+    writer.writerow(header_row)
+    return file, writer
+
+def write_output_file(filepath, data_to_save, header_row):
+    # Writes records to a CSV (Parquet for a .parquet filepath) restricted to header_row. Returns an error message or None
+    try:
+        # Ensure all header elements are strings
+        str_header_row = [str(h) for h in header_row]
+        # One list per row in header order; keys missing from a record are written empty
+        rows = ([_output_value(row_dict.get(h_key, "")) for h_key in str_header_row] for row_dict in data_to_save)
+        if is_parquet_file(filepath):
+            from dedup_parquet import write_parquet_rows
+            write_parquet_rows(filepath, str_header_row, rows)
+            return None
+        with open(filepath, mode='w', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file, delimiter=',')
+            writer.writerow(str_header_row)
+            writer.writerows(rows)
+        return None
+    except ImportError:
+        return PYARROW_MISSING
+    except Exception as e:
+        return f"Error saving '{os.path.basename(filepath)}': {e}"
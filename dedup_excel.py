@@ -0,0 +1,180 @@
+import datetime
+import math
+import os
+import zipfile
+from xml.etree import ElementTree
+
+
+# --- Streaming Excel reading ---
+# Sheets are read one row at a time (openpyxl read-only mode for .xlsx, xlrd on demand for
+# .xls) instead of loading every sheet into a DataFrame. Values are converted the way
+# pd.read_excel(dtype=str) + fillna('') does, so both paths give the same records for
+# normal sheets. Difference: values in columns that have no header cell are dropped here,
+# where pandas adds "Unnamed: N" columns for them.
+
+# Strings pandas reads as missing values (and which then become '' after fillna)
+EXCEL_NA_VALUES = frozenset([
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+])
+
+
+def excel_value_to_str(value):
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        return '' if value in EXCEL_NA_VALUES else value
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, float):
+        if not math.isfinite(value):
+            return '' if math.isnan(value) else str(value)
+        if value == int(value): # Excel numbers are floats: 2.0 -> '2'
+            return str(int(value))
+    return str(value)
+
+def make_sheet_header(cells):
+    # Column names as pandas builds them: "Unnamed: i" for empty cells, ".1", ".2"... for repeats
+    names = [
+        f"Unnamed: {i}" if c is None or c == '' else c if isinstance(c, str) else excel_value_to_str(c)
+        for i, c in enumerate(cells)
+    ]
+    counts = {}
+    for i, name in enumerate(names):
+        count = counts.get(name, 0)
+        while count > 0:
+            counts[name] = count + 1
+            name = f"{name}.{count}"
+            count = counts.get(name, 0)
+        names[i] = name
+        counts[name] = count + 1
+    return names
+
+def _trim_row(values):
+    values = list(values)
+    while values and (values[-1] is None or values[-1] == ''):
+        values.pop()
+    return values
+
+def _sheet_rows(raw_rows, width):
+    # Converts raw cell values to padded string rows, dropping trailing empty rows
+    pending_empty_rows = 0
+    for values in raw_rows:
+        values = _trim_row(values)
+        if not values:
+            pending_empty_rows += 1
+            continue
+        for _ in range(pending_empty_rows):
+            yield [''] * width
+        pending_empty_rows = 0
+        row = [excel_value_to_str(v) for v in values[:width]]
+        if len(row) < width:
+            row.extend([''] * (width - len(row)))
+        yield row
+
+def _split_header(raw_rows):
+    # Returns (header, data rows) or (None, None) for an empty sheet
+    raw_rows = iter(raw_rows)
+    for values in raw_rows:
+        header_cells = _trim_row(values)
+        if not header_cells:
+            return None, None # No usable header (pandas would name every column "Unnamed: N")
+        header = make_sheet_header(header_cells)
+        return header, _sheet_rows(raw_rows, len(header))
+    return None, None
+
+def _iter_xlsx_sheets(workbook, sheet_index=None, close=True):
+    try:
+        for worksheet in workbook.worksheets if sheet_index is None else workbook.worksheets[sheet_index:sheet_index + 1]:
+            worksheet.reset_dimensions() # Stored dimensions can be wrong; read what is there
+            header, rows = _split_header(worksheet.iter_rows(values_only=True))
+            yield worksheet.title, header, rows
+    finally:
+        if close:
+            workbook.close()
+
+def _xls_cell_value(cell, datemode):
+    import xlrd
+    if cell.ctype == xlrd.XL_CELL_DATE:
+        try:
+            value = xlrd.xldate.xldate_as_datetime(cell.value, datemode)
+        except OverflowError:
+            return cell.value
+        if value.timetuple()[0:3] in ((1899, 12, 31), (1904, 1, 1)): # Dates on the epoch are times
+            return datetime.time(value.hour, value.minute, value.second, value.microsecond)
+        return value
+    if cell.ctype == xlrd.XL_CELL_ERROR:
+        return None
+    if cell.ctype == xlrd.XL_CELL_BOOLEAN:
+        return bool(cell.value)
+    return cell.value
+
+def _iter_xls_sheets(workbook, sheet_index=None, close=True):
+    try:
+        sheet_names = workbook.sheet_names()
+        for sheet_name in sheet_names if sheet_index is None else sheet_names[sheet_index:sheet_index + 1]:
+            sheet = workbook.sheet_by_name(sheet_name)
+            raw_rows = ([_xls_cell_value(c, workbook.datemode) for c in sheet.row(r)] for r in range(sheet.nrows))
+            header, rows = _split_header(raw_rows)
+            try:
+                yield sheet_name, header, rows
+            finally:
+                workbook.unload_sheet(sheet_name) # Only one sheet in memory at a time
+    finally:
+        if close:
+            workbook.release_resources()
+
+def open_excel_workbook(filepath):
+    # Opens a workbook for excel_workbook_sheets, raising if it can't be read
+    if os.path.splitext(filepath)[1].lower() == '.xls':
+        import xlrd
+        return xlrd.open_workbook(filepath, on_demand=True)
+    import openpyxl
+    return openpyxl.load_workbook(filepath, read_only=True, data_only=True)
+
+def excel_workbook_sheets(workbook, sheet_index=None, close=True):
+    # Iterator of (sheet_name, header, rows) per sheet of an open workbook; rows is an iterator
+    # of lists of strings and header is None for an empty sheet. Each sheet must be consumed
+    # before the next. With sheet_index, only that sheet (counted from 0) is read; with
+    # close=False the workbook stays open to read other sheets later.
+    if hasattr(workbook, 'release_resources'): # xlrd
+        return _iter_xls_sheets(workbook, sheet_index, close)
+    return _iter_xlsx_sheets(workbook, sheet_index, close)
+
+def open_excel_sheets(filepath, sheet_index=None):
+    # Opens the workbook (raising if it can't be read) and returns excel_workbook_sheets for it
+    return excel_workbook_sheets(open_excel_workbook(filepath), sheet_index)
+
+_MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_RELATIONSHIP_ID = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id'
+
+def count_excel_sheets(filepath):
+    # Number of sheets open_excel_sheets would go through. For .xlsx the workbook's sheet list is
+    # read directly: opening it with openpyxl would first load all of its strings.
+    if os.path.splitext(filepath)[1].lower() != '.xls':
+        try:
+            with zipfile.ZipFile(filepath) as archive:
+                sheets = ElementTree.fromstring(archive.read('xl/workbook.xml')).iter(f'{_MAIN_NS}sheet')
+                relationships = ElementTree.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+            targets = {rel.get('Id'): rel.get('Type', '') for rel in relationships}
+            return sum(1 for sheet in sheets if targets.get(sheet.get(_RELATIONSHIP_ID), '').endswith('/worksheet')) # Not chart sheets
+        except (KeyError, zipfile.BadZipFile, ElementTree.ParseError):
+            pass # Unusual layout: let the reader find the sheets
+    workbook = open_excel_workbook(filepath)
+    try:
+        return workbook.nsheets if hasattr(workbook, 'release_resources') else len(workbook.worksheets)
+    finally:
+        if hasattr(workbook, 'release_resources'):
+            workbook.release_resources()
+        else:
+            workbook.close()
+
+def iter_dataframe_sheets(excel_data):
+    # Same interface as open_excel_sheets for sheets already loaded by pd.read_excel(sheet_name=None, dtype=str)
+    for sheet_name, df in excel_data.items():
+        if df.empty:
+            yield sheet_name, None, None
+            continue
+        df = df.fillna('') # Deals with annoying NaNs (--> empty strings)
+        rows = ([str(v) for v in values] for values in df.itertuples(index=False, name=None))
+        yield sheet_name, [str(h) for h in df.columns], rows
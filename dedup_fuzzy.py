@@ -0,0 +1,206 @@
+import re
+
+
+# --- Fuzzy near-duplicate matching ---
+# Records without an exact match are compared with CRM IDs that share a blocking key:
+#   - the sorted phonetic (Soundex) codes of the ID's words ("jon smith" ~ "john smith")
+#   - the sorted 3-letter prefixes of the ID's words ("smiht john" ~ "smith john")
+# Both keys are insensitive to word order, so swapped last/first names land in the same
+# block. Only candidates of a block are scored (Jaro-Winkler), never all CRM IDs.
+# A block with more than MAX_CANDIDATES_PER_KEY IDs (common surnames in a large CRM) is split
+# with a more specific key: the first letters of each word are added to the phonetic key, and
+# the prefixes get longer. Blocks still too large after MAX_BLOCK_LEVEL splits are skipped
+# and counted in skipped_blocks.
+
+FUZZY_MATCHES_FILENAME = "possible_duplicates_to_review.csv"
+FUZZY_OUTPUT_COLUMNS = ['Matched CRM ID', 'Match score', 'Match type']
+
+DEFAULT_FUZZY_THRESHOLD = 0.92
+MAX_CANDIDATES_PER_KEY = 1000 # Blocks larger than this are split (see block_key)
+MAX_BLOCK_LEVEL = 2
+
+_WORD_SPLIT_RE = re.compile(r'[\s-]+')
+_SOUNDEX_CODES = {}
+for _letters, _code in (('bfpv', '1'), ('cgjkqsxz', '2'), ('dt', '3'), ('l', '4'), ('mn', '5'), ('r', '6')):
+    for _letter in _letters:
+        _SOUNDEX_CODES[_letter] = _code
+
+
+def id_words(unique_id):
+    return [w for w in _WORD_SPLIT_RE.split(unique_id) if w]
+
+def soundex(word):
+    # American Soundex of a normalized (lowercase ASCII) word; '' if it has no letters
+    letters = [c for c in word if 'a' <= c <= 'z']
+    if not letters:
+        return ''
+    code = letters[0].upper()
+    previous = _SOUNDEX_CODES.get(letters[0], '')
+    for letter in letters[1:]:
+        digit = _SOUNDEX_CODES.get(letter, '')
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        if letter not in 'hw': # h and w don't separate equal codes
+            previous = digit
+    return code.ljust(4, '0')
+
+def block_key(words, kind, level=0):
+    # Blocking key of the given kind ('p' phonetic, 'x' prefix); each level is more specific:
+    #   p: Soundex codes, then + 2-letter prefixes, then + 3-letter prefixes
+    #   x: 3-letter prefixes, then 5, then 7
+    if kind == 'p':
+        key = ' '.join(sorted(soundex(w) for w in words))
+        if level:
+            key += ' / ' + ' '.join(sorted(w[:level + 1] for w in words))
+    else:
+        key = ' '.join(sorted(w[:3 + 2 * level] for w in words))
+    return f"{kind}{level}:{key}"
+
+def blocking_keys(unique_id, level=0):
+    words = id_words(unique_id)
+    if not words:
+        return []
+    return [block_key(words, 'p', level), block_key(words, 'x', level)]
+
+def jaro_winkler(a, b, prefix_scale=0.1):
+    if a == b:
+        return 1.0
+    len_a, len_b = len(a), len(b)
+    if not len_a or not len_b:
+        return 0.0
+    window = max(max(len_a, len_b) // 2 - 1, 0)
+    matched_a = [False] * len_a
+    matched_b = [False] * len_b
+    matches = 0
+    for i, char in enumerate(a):
+        for j in range(max(0, i - window), min(len_b, i + window + 1)):
+            if not matched_b[j] and b[j] == char:
+                matched_a[i] = matched_b[j] = True
+                matches += 1
+                break
+    if not matches:
+        return 0.0
+    transpositions = 0
+    j = 0
+    for i in range(len_a):
+        if matched_a[i]:
+            while not matched_b[j]:
+                j += 1
+            if a[i] != b[j]:
+                transpositions += 1
+            j += 1
+    jaro = (matches / len_a + matches / len_b + (matches - transpositions / 2) / matches) / 3
+    prefix = 0
+    for char_a, char_b in zip(a[:4], b[:4]):
+        if char_a != char_b:
+            break
+        prefix += 1
+    return jaro + prefix * prefix_scale * (1 - jaro)
+
+def parse_fuzzy_threshold(value):
+    # CONFIG value -> (threshold or None when disabled, error message)
+    value = str(value or '').strip()
+    if not value:
+        return None, None
+    try:
+        threshold = float(value)
+    except ValueError:
+        return None, f"Error: Fuzzy match threshold must be a number between 0 and 1 (got '{value}')."
+    if not 0 < threshold <= 1:
+        return None, f"Error: Fuzzy match threshold must be a number between 0 and 1 (got '{value}')."
+    return threshold, None
+
+class FuzzyMatcher:
+    # Blocking index over the CRM IDs plus the matches found during classification:
+    # matches holds (record, matched CRM ID, score, match type) tuples. split_keys are the
+    # blocks that were split into more specific ones, skipped_blocks the number of blocks
+    # that stayed too large to be searched.
+
+    def __init__(self, threshold=DEFAULT_FUZZY_THRESHOLD):
+        self.threshold = threshold
+        self.blocks = {}
+        self.split_keys = set()
+        self.skipped_blocks = 0
+        self.matches = []
+
+    def build(self, crm_unique_ids):
+        blocks, split_keys, skipped_blocks = {}, set(), 0
+        pending = {}
+        for crm_id in crm_unique_ids:
+            for key in blocking_keys(crm_id):
+                pending.setdefault(key, []).append(crm_id)
+        level = 0
+        while pending:
+            oversize = {}
+            for key, block in pending.items():
+                if len(block) <= MAX_CANDIDATES_PER_KEY:
+                    blocks[key] = block
+                elif level < MAX_BLOCK_LEVEL:
+                    split_keys.add(key)
+                    kind = key[0]
+                    for crm_id in block:
+                        oversize.setdefault(block_key(id_words(crm_id), kind, level + 1), []).append(crm_id)
+                else:
+                    skipped_blocks += 1
+            pending = oversize
+            level += 1
+        self.blocks = blocks
+        self.split_keys = split_keys
+        self.skipped_blocks = skipped_blocks
+        self.matches = []
+
+    def candidates(self, words):
+        # CRM IDs sharing a block with these words, taking the most specific block of each kind
+        candidates = set()
+        if not words:
+            return candidates
+        for kind in 'px':
+            level = 0
+            key = block_key(words, kind)
+            while key in self.split_keys:
+                level += 1
+                key = block_key(words, kind, level)
+            candidates.update(self.blocks.get(key, ()))
+        return candidates
+
+    def best_match(self, unique_id):
+        # Returns (crm_id, score, match_type) for the best candidate above the threshold, or None
+        words = id_words(unique_id)
+        sorted_id = ' '.join(sorted(words))
+        phonetic = sorted(soundex(w) for w in words)
+        best = None
+        for crm_id in self.candidates(words):
+            crm_words = id_words(crm_id)
+            crm_sorted_id = ' '.join(sorted(crm_words))
+            if crm_sorted_id == sorted_id:
+                score, match_type = 1.0, 'transposed'
+            else:
+                score = max(jaro_winkler(unique_id, crm_id), jaro_winkler(sorted_id, crm_sorted_id))
+                match_type = 'phonetic' if sorted(soundex(w) for w in crm_words) == phonetic else 'similar'
+            if score >= self.threshold and (best is None or score > best[1] or (score == best[1] and crm_id < best[0])):
+                best = (crm_id, score, match_type)
+        return best
+
+    def check(self, record_dict, unique_id):
+        # Records the record as a possible duplicate if it has a fuzzy match; returns whether it had one
+        match = self.best_match(unique_id)
+        if match is None:
+            return False
+        self.matches.append((record_dict, *match))
+        return True
+
+    @staticmethod
+    def match_values(crm_id, score, match_type):
+        # Values of FUZZY_OUTPUT_COLUMNS for a match
+        return [crm_id, f"{score:.3f}", match_type]
+
+    def output_records(self, header):
+        # (records, header) for writing the possible duplicates with their match details
+        out_header = [str(h) for h in header] + FUZZY_OUTPUT_COLUMNS
+        records = [
+            dict(record, **dict(zip(FUZZY_OUTPUT_COLUMNS, self.match_values(crm_id, score, match_type))))
+            for record, crm_id, score, match_type in self.matches
+        ]
+        return records, out_header
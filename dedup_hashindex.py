@@ -0,0 +1,142 @@
+import hashlib
+import sys
+
+import numpy as np
+
+
+# --- Compact CRM index of fixed-width hashes ---
+# Instead of a set of ID strings (about 100 bytes per ID plus the string), the CRM keys are
+# kept as a sorted NumPy array of 64-bit (8 bytes per ID) or 128-bit (16 bytes) hashes, and
+# the keys of all new records are looked up in one vectorised call. A hash match is only a
+# candidate: with a verifier (set up by load_crm_index), the candidates are checked against
+# the real CRM keys by reading the CRM file again, keeping only the candidates in memory, so
+# a hash collision can never turn a new contact into a duplicate. An optional Bloom filter
+# rejects most keys that are not in the CRM before the binary search.
+# 64-bit hashes are Python's own str hash, so an index is only valid in the process that built it.
+
+HASH_BITS = (64, 128)
+DEFAULT_BLOOM_BITS_PER_KEY = 10 # About 1% false positives
+BLOOM_HASHES = 7
+
+
+def parse_hash_bits(value):
+    # CLI value -> (bits, error message)
+    try:
+        bits = int(value)
+    except (TypeError, ValueError):
+        bits = None
+    if bits not in HASH_BITS:
+        return None, f"Error: Compact index hashes must be 64 or 128 bits (got '{value}')."
+    return bits, None
+
+def _hash_key(key, bits):
+    # Fixed-width hash of a key, as bytes
+    if bits == 64:
+        return (hash(key) & 0xFFFFFFFFFFFFFFFF).to_bytes(8, sys.byteorder) # Same layout as hash_keys
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+
+def hash_keys(keys, bits=64):
+    # Array of the hashes of keys: uint64, or 16-byte strings for 128 bits
+    if bits == 64:
+        return np.fromiter((hash(key) for key in keys), dtype=np.int64).view(np.uint64)
+    return np.frombuffer(b''.join(_hash_key(key, bits) for key in keys), dtype='S16')
+
+def _low_64(hashes):
+    # 64 bits of each hash, used to place it in the Bloom filter
+    if hashes.dtype == np.uint64:
+        return hashes
+    return np.frombuffer(hashes.tobytes(), dtype=np.uint64)[::2]
+
+class BloomFilter:
+    # Bit array with BLOOM_HASHES positions per key, derived from its hash by double hashing
+
+    def __init__(self, hashes, bits_per_key=DEFAULT_BLOOM_BITS_PER_KEY):
+        self.size = max(64, len(hashes) * bits_per_key)
+        self.bits = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+        for positions in self._positions(hashes):
+            np.bitwise_or.at(self.bits, positions >> 3, (1 << (positions & 7)).astype(np.uint8))
+
+    def _positions(self, hashes):
+        values = _low_64(hashes)
+        h1 = values & np.uint64(0xFFFFFFFF)
+        h2 = (values >> np.uint64(32)) | np.uint64(1)
+        size = np.uint64(self.size)
+        for i in range(BLOOM_HASHES):
+            yield (h1 + np.uint64(i) * h2) % size
+
+    def might_contain(self, hashes):
+        # Boolean array: False means the hash is certainly not in the filter
+        result = np.ones(len(hashes), dtype=bool)
+        for positions in self._positions(hashes):
+            result &= (self.bits[positions >> 3] >> (positions & 7)).astype(bool)
+        return result
+
+class CompactIdIndex:
+    # Built like a set through add() (e.g. by build_crm_id_index), then finalize()d. For
+    # classify_records, matching_keys() replaces the per-record `in` tests; `in` still works
+    # for single keys. Iterating the keys is not possible, so fuzzy matching can't use it.
+
+    def __init__(self, bits=64, bloom_bits_per_key=0, verify=True):
+        self.bits = bits
+        self.bloom_bits_per_key = bloom_bits_per_key
+        self.verify = verify
+        self.hashes = None
+        self.bloom = None
+        self.verifier = None # Callable(candidate keys) -> the candidates really in the CRM file
+        self.collisions = 0 # Candidates rejected by the verifier in the last matching_keys()
+        self._pending = bytearray()
+
+    def add(self, key):
+        self._pending += _hash_key(key, self.bits)
+
+    def finalize(self):
+        dtype = np.uint64 if self.bits == 64 else 'S16'
+        self.hashes = np.unique(np.frombuffer(bytes(self._pending), dtype=dtype)) # Sorted, without repeats
+        self._pending = bytearray()
+        if self.bloom_bits_per_key:
+            self.bloom = BloomFilter(self.hashes, self.bloom_bits_per_key)
+        return self
+
+    def __len__(self):
+        return len(self.hashes) if self.hashes is not None else len(self._pending) // (self.bits // 8)
+
+    def nbytes(self):
+        return self.hashes.nbytes + (self.bloom.bits.nbytes if self.bloom is not None else 0)
+
+    def contains_hashes(self, hashes):
+        # Vectorised membership of hashes: boolean array
+        found = np.zeros(len(hashes), dtype=bool)
+        if not len(self.hashes) or not len(hashes):
+            return found
+        candidates = np.flatnonzero(self.bloom.might_contain(hashes)) if self.bloom is not None else np.arange(len(hashes))
+        wanted = hashes[candidates]
+        positions = np.minimum(np.searchsorted(self.hashes, wanted), len(self.hashes) - 1)
+        found[candidates] = self.hashes[positions] == wanted
+        return found
+
+    def __contains__(self, key):
+        return bool(self.contains_hashes(hash_keys([key], self.bits))[0])
+
+    def matching_keys(self, keys):
+        # Set of the keys found in the index, checked by the verifier when there is one
+        keys = list(keys)
+        candidates = {key for key, found in zip(keys, self.contains_hashes(hash_keys(keys, self.bits))) if found}
+        self.collisions = 0
+        if self.verifier is not None and candidates:
+            confirmed = self.verifier(candidates)
+            self.collisions = len(candidates) - len(confirmed)
+            return confirmed
+        return candidates
+
+class KeyCollector:
+    # Index stand-in for build_crm_id_index that keeps only the wanted keys it is given
+    def __init__(self, wanted):
+        self.wanted = wanted
+        self.found = set()
+
+    def __len__(self):
+        return len(self.found)
+
+    def add(self, key):
+        if key in self.wanted:
+            self.found.add(key)
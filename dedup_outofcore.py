@@ -0,0 +1,291 @@
+import csv
+import math
+import os
+import shutil
+import tempfile
+from array import array
+
+from dedup_engine import (
+    CONFIG, DUPLICATES_FILENAME, IN_FILE_DUPLICATES_FILENAME, IN_FILE_OUTPUT_COLUMNS, MATCH_RULE_COLUMN, PROGRESS_EVERY_ROWS, UNIQUES_FILENAME,
+    Diagnostics, NewRecordsError, ProcessingCancelled, _log_records_read, _null_log, _record_run_info, _rejected_new_rows, _report, _stage_finish,
+    _stage_start, _warn, build_crm_id_index, create_unique_id, iter_new_records, normalize_cache_info, open_output_writer, output_filename, resolve_compare_columns
+)
+from dedup_parquet import is_parquet_file, parquet_row_count
+
+
+# --- Out-of-core matching for CRM exports larger than memory ---
+# The CRM keys and the keys of the new records are hash-partitioned into bucket files, then
+# joined one partition at a time: only one partition of CRM keys is ever held in a set, so the
+# number of partitions follows from the memory budget. The new records are spilled to a CSV
+# file as they are read and written to the outputs in file order at the end, so the outputs
+# are the same as those of stream_deduplication. Per new record, only one status byte is kept
+# in memory.
+
+DEFAULT_MEMORY_MB = 1024
+MAX_PARTITIONS = 256 # Bucket files open at once (C runtimes limit open files, 512 on Windows)
+SET_BYTES_PER_KEY = 160 # Memory of a normalized key in a Python set: str object plus hash table slots
+SAMPLE_BYTES = 1024 * 1024 # Read to estimate the number of rows of the CRM file
+
+# Status byte of each new record: the number of the first matching rule (0 without rules) or:
+NO_MATCH = 255
+EMPTY_ID = 254
+REPEATED = 253
+MAX_RULES = REPEATED
+
+
+def estimate_partitions(crm_filepath, memory_mb, keys_per_row=1):
+    # Partitions needed so that one partition of CRM keys fits in memory_mb
+    if is_parquet_file(crm_filepath):
+        estimated_rows = parquet_row_count(crm_filepath) # Stored in the file's footer
+    else:
+        file_size = os.path.getsize(crm_filepath)
+        with open(crm_filepath, 'rb') as file:
+            sample = file.read(SAMPLE_BYTES)
+        lines = max(sample.count(b'\n'), 1)
+        estimated_rows = file_size * lines / max(len(sample), 1)
+    needed_bytes = estimated_rows * keys_per_row * SET_BYTES_PER_KEY
+    return max(1, math.ceil(needed_bytes / (memory_mb * 1024 * 1024)))
+
+class PartitionWriter:
+    # Appends lines to one bucket file per partition, chosen by the hash of the key. It also
+    # serves as the index given to build_crm_id_index, which only calls add().
+
+    def __init__(self, directory, prefix, partitions):
+        self.partitions = partitions
+        self.paths = [os.path.join(directory, f"{prefix}_{p:03d}.txt") for p in range(partitions)]
+        self.files = [open(path, 'w', encoding='utf-8', newline='\n') for path in self.paths]
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, key, line=None):
+        # Normalized keys never contain line breaks (see CrmIndexCache)
+        self.files[hash(key) % self.partitions].write((key if line is None else line) + '\n')
+        self.count += 1
+
+    def close(self):
+        for file in self.files:
+            file.close()
+
+def _read_lines(path):
+    with open(path, encoding='utf-8', newline='\n') as file:
+        for line in file:
+            yield line[:-1]
+
+def partitioned_deduplication(crm_filepath, new_records_filepath, output_dir, config=None, log=None, progress=None, diagnostics=None, in_file=None, rules=None,
+                              memory_mb=DEFAULT_MEMORY_MB, work_dir=None, run_report=None, output_format='csv', excel_cache=None):
+    # Out-of-core variant of stream_deduplication, with the same outputs and return value
+    # (unique count, duplicate count, header, error). The bucket and spill files go to a
+    # temporary folder inside work_dir (default: the system temporary folder), which needs
+    # about the size of both input files. Fuzzy matching and the CRM index cache need the
+    # whole index in memory and are not available here. output_format and excel_cache are as
+    # for stream_deduplication.
+    log = log or _null_log
+    diagnostics = diagnostics or Diagnostics(log)
+    try:
+        temp_dir = tempfile.mkdtemp(prefix="dedup_partitions_", dir=work_dir)
+    except OSError as e:
+        diagnostics.close()
+        return None, None, None, f"Error: Could not create a work folder for out-of-core matching: {e}"
+    try:
+        return _partitioned_deduplication(crm_filepath, new_records_filepath, output_dir, config or CONFIG, log, progress, diagnostics, in_file, rules,
+                                          memory_mb, temp_dir, run_report, output_format, excel_cache)
+    except ProcessingCancelled:
+        return None, None, None, "Processing cancelled."
+    finally:
+        diagnostics.close()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def _partitioned_deduplication(crm_filepath, new_records_filepath, output_dir, config, log, progress, diagnostics, in_file, rules, memory_mb, temp_dir, run_report,
+                               output_format, excel_cache):
+    if not crm_filepath or not new_records_filepath:
+        return None, None, None, "Error: Both CRM export file and New Records file must be selected."
+    if in_file is not None and in_file.keep != 'first':
+        return None, None, None, f"Error: Out-of-core mode can only keep the first copy of repeated contacts (got '{in_file.keep}')."
+    if rules is not None and len(rules.labels) > MAX_RULES:
+        return None, None, None, f"Error: Out-of-core mode supports at most {MAX_RULES} match rules."
+    if memory_mb <= 0:
+        return None, None, None, f"Error: The memory budget must be a positive number of MB (got {memory_mb})."
+    normalize_cache_before = normalize_cache_info()
+
+    # --- Partition the CRM keys ---
+    log(f"Processing CRM file: {os.path.basename(crm_filepath)}...\n")
+    try:
+        estimated = estimate_partitions(crm_filepath, memory_mb, len(rules.labels) if rules is not None else 1)
+    except FileNotFoundError:
+        return None, None, None, f"Error: CRM File not found at '{crm_filepath}'."
+    partitions = min(estimated, MAX_PARTITIONS)
+    log(f"  Out-of-core matching: {partitions} partition(s) for a memory budget of {memory_mb} MB.\n")
+    if estimated > MAX_PARTITIONS:
+        log(f"  Warning: The budget would need {estimated} partitions; using {MAX_PARTITIONS}, so partitions may exceed it.\n")
+
+    _stage_start(run_report, 'crm_partition')
+    crm_buckets = PartitionWriter(temp_dir, 'crm', partitions)
+    try:
+        _, crm_error = build_crm_id_index(crm_filepath, config['CRM_DELIMITER'], config['CRM_LAST_NAME_COL'], config['CRM_FIRST_NAME_COL'], log,
+                                          index=crm_buckets, progress=progress, diagnostics=diagnostics, rules=rules)
+    finally:
+        crm_buckets.close()
+    if crm_error:
+        return None, None, None, crm_error
+    _stage_finish(run_report, 'crm_partition', rows_out=len(crm_buckets), partitions=partitions)
+
+    # --- Partition the keys of the New Records and spill the records ---
+    new_records_filename = os.path.basename(new_records_filepath)
+    log(f"\nProcessing New Records file: {new_records_filename}...\n")
+    _stage_start(run_report, 'new_partition')
+    new_buckets = PartitionWriter(temp_dir, 'new', partitions)
+    # Names of the unmatched records, grouped afterwards to find repeated contacts
+    id_buckets = PartitionWriter(temp_dir, 'ids', partitions) if in_file is not None else None
+    spill_path = os.path.join(temp_dir, 'records.csv')
+    status = bytearray()
+    try:
+        with open(spill_path, 'w', encoding='utf-8', newline='') as spill_file:
+            spill = csv.writer(spill_file)
+            rows = iter_new_records(new_records_filepath, config['NEW_RECORDS_NAME_COL'], config['NEW_RECORDS_FORENAME_COL'], config['NEW_RECORDS_CSV_DELIMITER'],
+                                    log, progress, diagnostics, excel_cache, rules is not None)
+            header = next(rows)
+            log(f"Using header for New Records: {', '.join(header)}\n")
+            name_key, forename_key, compare_error = resolve_compare_columns(header, config)
+            if compare_error:
+                return None, None, None, compare_error
+            positions = {h: idx for idx, h in enumerate(header)} # Last one wins, as in the record dicts
+            name_idx, forename_idx = positions[name_key], positions[forename_key]
+            if rules is not None:
+                rule_columns, rules_error = rules.resolve_new_columns(header, name_key, forename_key, by_name=False)
+                if rules_error:
+                    return None, None, None, rules_error
+                rules.reset_counts()
+
+            for row_number, row in enumerate(rows):
+                spill.writerow(row)
+                current_id = create_unique_id(row[name_idx], row[forename_idx])
+                row_keys = rules.row_keys(row, rule_columns) if rules is not None else None
+                if not current_id and not row_keys: # Rules on other columns can still apply
+                    _warn(log, diagnostics, 'new_empty_id', row_number+2,
+                          f"Warning: Skipping record (row {row_number+2} approx, ID empty after normalization): { {name_key: row[name_idx], forename_key: row[forename_idx]} }\n",
+                          row)
+                    status.append(EMPTY_ID)
+                    continue
+                status.append(NO_MATCH)
+                if rules is not None:
+                    for key in row_keys:
+                        new_buckets.add(key, f"{row_number}\t{key.partition(chr(0x1f))[0]}\t{key}")
+                else:
+                    new_buckets.add(current_id, f"{row_number}\t0\t{current_id}")
+                if id_buckets is not None and current_id:
+                    id_buckets.add(current_id, f"{row_number}\t{current_id}")
+    except NewRecordsError as e:
+        return None, None, None, str(e)
+    except FileNotFoundError:
+        return None, None, None, f"Error: New Records file not found at '{new_records_filepath}'."
+    except Exception as e:
+        return None, None, None, f"An unexpected error occurred while processing New Records file '{new_records_filename}': {e}"
+    finally:
+        new_buckets.close()
+        if id_buckets is not None:
+            id_buckets.close()
+    record_count = len(status)
+    _log_records_read(log, new_records_filename, record_count)
+    _stage_finish(run_report, 'new_partition', record_count + _rejected_new_rows(diagnostics), len(new_buckets))
+
+    # --- Join one partition at a time ---
+    log("\nComparing records...\n")
+    _stage_start(run_report, 'join')
+    for p in range(partitions):
+        _report(progress, 'compare', p, partitions)
+        crm_keys = set(_read_lines(crm_buckets.paths[p]))
+        for line in _read_lines(new_buckets.paths[p]):
+            row_text, rule_text, key = line.split('\t', 2)
+            if key in crm_keys:
+                row_number, rule_number = int(row_text), int(rule_text)
+                if rule_number < status[row_number]: # The first rule that matches wins
+                    status[row_number] = rule_number
+        del crm_keys
+
+    # Contacts repeated among the unmatched records: all copies of a name fall in the same
+    # partition. Groups are numbered in the order their second copy appears, as in stream mode.
+    group_numbers = {}
+    group_count = 0
+    if id_buckets is not None:
+        groups = []
+        for p in range(partitions):
+            rows_by_id = {}
+            for line in _read_lines(id_buckets.paths[p]):
+                row_text, current_id = line.split('\t', 1)
+                row_number = int(row_text)
+                if status[row_number] == NO_MATCH:
+                    rows_by_id.setdefault(current_id, array('q')).append(row_number)
+            groups.extend(group_rows[1:] for group_rows in rows_by_id.values() if len(group_rows) > 1)
+        groups.sort(key=lambda repeated_rows: repeated_rows[0])
+        group_count = len(groups)
+        for group_number, repeated_rows in enumerate(groups, 1):
+            for row_number in repeated_rows:
+                status[row_number] = REPEATED
+                group_numbers[row_number] = group_number
+    _report(progress, 'compare', partitions, partitions)
+    _stage_finish(run_report, 'join', record_count, record_count, partitions=partitions)
+
+    # --- Write the outputs in file order ---
+    _stage_start(run_report, 'save')
+    counts = {'uniques': 0, 'duplicates': 0, 'repeated': 0}
+    output_headers = {
+        UNIQUES_FILENAME: header,
+        DUPLICATES_FILENAME: header + [MATCH_RULE_COLUMN] if rules is not None else header,
+    }
+    if in_file is not None:
+        output_headers[IN_FILE_DUPLICATES_FILENAME] = header + IN_FILE_OUTPUT_COLUMNS
+    outputs = {}
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+        for filename, output_header in output_headers.items():
+            # Written under a temporary name so an interrupted run leaves no partial output
+            outputs[filename] = open_output_writer(os.path.join(output_dir, output_filename(filename, output_format) + '.part'), output_header, output_format)
+        write_unique = outputs[UNIQUES_FILENAME][1].writerow
+        write_duplicate = outputs[DUPLICATES_FILENAME][1].writerow
+
+        with open(spill_path, encoding='utf-8', newline='') as spill_file:
+            for row_number, row in enumerate(csv.reader(spill_file)):
+                if row_number % PROGRESS_EVERY_ROWS == 0:
+                    _report(progress, 'save', row_number, record_count, row_number)
+                row_status = status[row_number]
+                if row_status == NO_MATCH:
+                    write_unique(row)
+                    counts['uniques'] += 1
+                elif row_status == REPEATED:
+                    outputs[IN_FILE_DUPLICATES_FILENAME][1].writerow(row + [group_numbers[row_number], 'no'])
+                    counts['repeated'] += 1
+                elif row_status != EMPTY_ID:
+                    if rules is not None:
+                        label = rules.labels[row_status]
+                        rules.counts[label] += 1
+                        write_duplicate(row + [label])
+                    else:
+                        write_duplicate(row)
+                    counts['duplicates'] += 1
+
+        for filename, (file, _) in list(outputs.items()):
+            file.close()
+            os.replace(file.name, os.path.join(output_dir, output_filename(filename, output_format)))
+            del outputs[filename]
+    except Exception as e:
+        return None, None, None, f"An unexpected error occurred while writing the output files: {e}"
+    finally:
+        for file, _ in outputs.values(): # Only left on failure or cancellation
+            file.close()
+            os.remove(file.name)
+    _stage_finish(run_report, 'save', record_count, counts['uniques'] + counts['duplicates'] + counts['repeated'],
+                  uniques=counts['uniques'], duplicates=counts['duplicates'])
+    _record_run_info(run_report, diagnostics, normalize_cache_before)
+
+    log("\n--- Processing Complete ---\n")
+    log(f"Unique new contacts to import: {counts['uniques']}\n")
+    log(f"Duplicate contacts found (for review): {counts['duplicates']}\n")
+    if rules is not None:
+        for label, count in rules.counts.items():
+            log(f"  Matched by rule '{label}': {count}\n")
+    if in_file is not None:
+        log(f"Repeated contacts in the new records file: {group_count} (keeping first, {counts['repeated']} extra copies left out)\n")
+    log(diagnostics.summary())
+    return counts['uniques'], counts['duplicates'], header, None
@@ -0,0 +1,410 @@
+import csv
+import io
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from dedup_engine import (
+    CONFIG, CollectedWarnings, ProcessingCancelled, _header_column_map, _log_records_read, _null_log, _report, _warn, build_crm_id_index, create_unique_ids,
+    iter_crm_ids, iter_new_records_csv_rows, iter_sheet_records, open_sheet_records, read_new_records_file, resolve_compare_columns, resolve_csv_name_columns
+)
+from dedup_excel import count_excel_sheets, excel_workbook_sheets, open_excel_workbook
+from dedup_parquet import PARQUET_EXT
+
+
+# --- Multi-core chunked processing of CSV files ---
+# A CSV file is cut into byte ranges that start and end on record boundaries: a line end
+# only ends a record when an even number of quotes comes before it, so boundaries that fall
+# inside a quoted field (with line breaks in it) are moved to the end of that record. The
+# records of each range are then counted with csv.reader, so warnings keep the row numbers
+# of the sequential reader. A range that doesn't parse on its own (quotes csv.reader would
+# only accept leniently, or a record running past its end) makes the whole file go through
+# the sequential reader instead. Each worker process parses, normalizes and hashes its
+# range; the parent merges the results in file order.
+# Excel workbooks are split by sheet instead: each worker reads, checks and normalizes whole
+# sheets, and the parent merges them in sheet order exactly as the sequential reader would.
+
+MIN_CHUNK_BYTES = 4 * 1024 * 1024 # Smaller files are not worth the process start-up
+CHUNKS_PER_JOB = 4 # Several chunks per worker evens out uneven rows
+
+SEQUENTIAL_FALLBACK_NOTE = "  Note: The CSV file's quoting doesn't allow reading it in chunks; reading it in a single process.\n"
+
+_worker_workbook = None # Workbook opened once per worker process by _open_worker_workbook
+
+
+class _SequentialFallback(Exception):
+    # Raised inside the process pool when the file must go through the sequential reader
+    pass
+
+
+def resolve_jobs(jobs):
+    # 0 or None means one job per CPU core
+    return jobs if jobs and jobs > 0 else (os.cpu_count() or 1)
+
+def read_csv_header(filepath, delimiter):
+    # Returns (header, data_start_offset) where data_start_offset is the byte offset of the first data row
+    with open(filepath, 'rb') as file:
+        header_line = file.readline()
+        while header_line.count(b'"') % 2: # A quoted column name with a line break
+            line = file.readline()
+            if not line:
+                break
+            header_line += line
+        data_start = file.tell()
+    header = next(csv.reader([header_line.decode('utf-8-sig')], delimiter=delimiter), None)
+    return header, data_start
+
+def split_byte_ranges(filepath, data_start, n_chunks):
+    # Splits [data_start, file size) into at most n_chunks ranges aligned on line starts
+    file_size = os.path.getsize(filepath)
+    n_chunks = max(1, min(n_chunks, (file_size - data_start) // MIN_CHUNK_BYTES))
+    step = (file_size - data_start) // n_chunks
+    boundaries = [data_start]
+    with open(filepath, 'rb') as file:
+        for k in range(1, n_chunks):
+            file.seek(max(data_start + k * step, boundaries[-1]))
+            file.readline() # Move to the start of the next row
+            position = file.tell()
+            if boundaries[-1] < position < file_size:
+                boundaries.append(position)
+    boundaries.append(file_size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+def _read_range(filepath, start, end):
+    with open(filepath, 'rb') as file:
+        file.seek(start)
+        return file.read(end - start)
+
+def _count_quotes(filepath, start, end):
+    return _read_range(filepath, start, end).count(b'"')
+
+def _align_on_records(pool, filepath, byte_ranges):
+    # Moves the boundaries of line-aligned ranges that fall inside a quoted field to the end of
+    # that record. A boundary that would pass the next one is dropped.
+    counts = pool.map(_count_quotes, [filepath] * len(byte_ranges), *zip(*byte_ranges))
+    boundaries = [byte_ranges[0][0]]
+    quotes = 0
+    with open(filepath, 'rb') as file:
+        for (_, end), count, (_, next_end) in zip(byte_ranges, counts, byte_ranges[1:]):
+            quotes += count
+            position = end
+            inside_quotes = quotes % 2 == 1
+            if inside_quotes:
+                file.seek(end)
+                while inside_quotes and position < next_end:
+                    line = file.readline()
+                    if not line:
+                        break
+                    position += len(line)
+                    inside_quotes = line.count(b'"') % 2 == 0
+            if not inside_quotes and boundaries[-1] < position < next_end:
+                boundaries.append(position)
+    boundaries.append(byte_ranges[-1][1])
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+def _count_records(filepath, start, end, delimiter):
+    # Records in the range, or None when it doesn't parse on its own
+    data = _read_range(filepath, start, end)
+    if b'"' not in data and data.count(b'\r') == data.count(b'\r\n'): # One record per line
+        return data.count(b'\n') + (1 if data and not data.endswith(b'\n') else 0)
+    try:
+        return sum(1 for _ in _range_reader(data, delimiter, strict=True))
+    except csv.Error:
+        return None
+
+def _first_row_numbers(pool, filepath, byte_ranges, delimiter):
+    # Row number (as reported in warnings, header = row 1) of the first row of each range, or
+    # None when a range can't be read on its own and the file must be read sequentially
+    n = len(byte_ranges)
+    counts = pool.map(_count_records, [filepath] * n, *zip(*byte_ranges), [delimiter] * n)
+    first_rows = []
+    row_number = 2
+    for count in counts:
+        if count is None:
+            return None
+        first_rows.append(row_number)
+        row_number += count
+    return first_rows
+
+def _plan_chunks(pool, filepath, byte_ranges, delimiter):
+    # (byte ranges aligned on records, first row number of each), or (None, None)
+    byte_ranges = _align_on_records(pool, filepath, byte_ranges)
+    first_rows = _first_row_numbers(pool, filepath, byte_ranges, delimiter)
+    return (byte_ranges, first_rows) if first_rows is not None else (None, None)
+
+def _range_reader(data, delimiter, strict=False):
+    return csv.reader(io.StringIO(data.decode('utf-8'), newline=''), delimiter=delimiter, strict=strict)
+
+def _open_range_reader(filepath, start, end, delimiter):
+    return _range_reader(_read_range(filepath, start, end), delimiter)
+
+def _crm_chunk_worker(filepath, start, end, delimiter, header_length, lastname_col_idx, firstname_col_idx, first_row_number, keep_rows):
+    warnings = CollectedWarnings(keep_rows)
+    reader = _open_range_reader(filepath, start, end, delimiter)
+    unique_ids = set()
+    valid_rows = 0
+    for unique_id in iter_crm_ids(reader, header_length, lastname_col_idx, firstname_col_idx, None, first_row_number, warnings):
+        unique_ids.add(unique_id)
+        valid_rows += 1
+    return unique_ids, valid_rows, warnings.entries
+
+def _new_records_chunk_worker(filepath, start, end, delimiter, final_header, name_col_idx, forename_col_idx, compare_keys, first_row_number, keep_rows, keep_nameless):
+    warnings = CollectedWarnings(keep_rows)
+    reader = _open_range_reader(filepath, start, end, delimiter)
+    # Rows travel back as plain lists, which are cheaper to pickle than dicts
+    rows = list(iter_new_records_csv_rows(reader, final_header, name_col_idx, forename_col_idx, None, first_row_number, warnings, keep_nameless))
+    positions = {h: idx for idx, h in enumerate(final_header)} # Last one wins, as in the record dicts
+    name_idx, forename_idx = positions[compare_keys[0]], positions[compare_keys[1]]
+    record_ids = create_unique_ids([row[name_idx] for row in rows], [row[forename_idx] for row in rows])
+    return rows, record_ids, warnings.entries
+
+def _open_worker_workbook(filepath):
+    # Pool initializer: opening a workbook loads all of its strings, so each worker does it once
+    global _worker_workbook
+    _worker_workbook = open_excel_workbook(filepath)
+
+def _excel_sheet_worker(sheet_index, config, keep_rows, keep_nameless):
+    # Returns (sheet name, header, log messages, rows, record IDs, warnings) for one sheet; header
+    # is None when the sheet is skipped. The IDs are those of the rows under this sheet's own header.
+    messages = []
+    warnings = CollectedWarnings(keep_rows)
+    sheets = excel_workbook_sheets(_worker_workbook, sheet_index, close=False)
+    try:
+        for sheet_name, sheet_header, sheet_rows in sheets:
+            name_forename_idx, first_row = open_sheet_records(sheet_name, sheet_header, sheet_rows, config['NEW_RECORDS_NAME_COL'], config['NEW_RECORDS_FORENAME_COL'], messages.append)
+            if name_forename_idx is None:
+                return sheet_name, None, messages, [], None, warnings.entries
+            rows = list(iter_sheet_records(sheet_name, itertools.chain([first_row], sheet_rows), *name_forename_idx, None, warnings, keep_nameless))
+            header = [str(h) for h in sheet_header]
+            return sheet_name, header, messages, rows, _sheet_record_ids(rows, header, config), warnings.entries
+    finally:
+        sheets.close()
+    raise ValueError(f"Sheet {sheet_index + 1} could not be read.")
+
+def _sheet_record_ids(rows, header, config):
+    # Comparison IDs of rows in header order, as classify_records computes them (None if it can't)
+    compare_name_key, compare_forename_key, compare_error = resolve_compare_columns(header, config)
+    if compare_error:
+        return None
+    positions = {h: idx for idx, h in enumerate(header)} # Last one wins, as in the record dicts
+    name_idx, forename_idx = positions[compare_name_key], positions[compare_forename_key]
+    return create_unique_ids([row[name_idx] for row in rows], [row[forename_idx] for row in rows])
+
+def _replay_warnings(log, diagnostics, entries):
+    for category, row_number, message, row in entries:
+        _warn(log, diagnostics, category, row_number, message, row)
+
+def _keep_rows(diagnostics):
+    return bool(getattr(diagnostics, 'rejected_rows_path', None))
+
+def build_crm_id_index_parallel(filepath, delimiter, expected_lastname_col, expected_firstname_col, log=None, jobs=None, progress=None, diagnostics=None):
+    # Same result and warnings as build_crm_id_index, using several processes on large files
+    log = log or _null_log
+    jobs = resolve_jobs(jobs)
+    filename = os.path.basename(filepath)
+    try:
+        header, data_start = read_csv_header(filepath, delimiter)
+        byte_ranges = split_byte_ranges(filepath, data_start, jobs * CHUNKS_PER_JOB)
+    except FileNotFoundError:
+        return None, f"Error: CRM File not found at '{filepath}'."
+    except Exception as e:
+        return None, f"An unexpected error occurred while reading CRM file: {e}"
+    normalized_header = [h.strip() for h in header or []]
+    if jobs == 1 or len(byte_ranges) == 1 or expected_lastname_col not in normalized_header or expected_firstname_col not in normalized_header:
+        # The sequential reader also reports a missing header or columns
+        return build_crm_id_index(filepath, delimiter, expected_lastname_col, expected_firstname_col, log, progress=progress, diagnostics=diagnostics)
+    lastname_col_idx = normalized_header.index(expected_lastname_col)
+    firstname_col_idx = normalized_header.index(expected_firstname_col)
+
+    workers = min(jobs, len(byte_ranges))
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            byte_ranges, first_rows = _plan_chunks(pool, filepath, byte_ranges, delimiter)
+            if byte_ranges is None:
+                raise _SequentialFallback
+            log(f"Attempting to read CRM file: {filename}\n")
+            log(f"  Using delimiter: '{delimiter}'\n")
+            log(f"  Using Last Name column: '{expected_lastname_col}'\n")
+            log(f"  Using First Name column: '{expected_firstname_col}'\n")
+            log(f"  Using {workers} processes on {len(byte_ranges)} chunks\n")
+            futures = [
+                pool.submit(_crm_chunk_worker, filepath, start, end, delimiter, len(header), lastname_col_idx, firstname_col_idx, first_row, _keep_rows(diagnostics))
+                for (start, end), first_row in zip(byte_ranges, first_rows)
+            ]
+            unique_ids = set()
+            valid_rows = 0
+            file_size = byte_ranges[-1][1]
+            try:
+                for future, (_, end) in zip(futures, byte_ranges): # In file order, so warnings keep their order
+                    chunk_ids, chunk_valid_rows, warnings = future.result()
+                    _replay_warnings(log, diagnostics, warnings)
+                    unique_ids |= chunk_ids
+                    valid_rows += chunk_valid_rows
+                    _report(progress, 'crm', end, file_size, valid_rows)
+            except ProcessingCancelled:
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+    except _SequentialFallback:
+        log(SEQUENTIAL_FALLBACK_NOTE)
+        return build_crm_id_index(filepath, delimiter, expected_lastname_col, expected_firstname_col, log, progress=progress, diagnostics=diagnostics)
+    except Exception as e:
+        return None, f"An unexpected error occurred while reading CRM file: {e}"
+
+    log(f"Successfully processed {valid_rows} records from CRM file ({len(unique_ids)} unique IDs generated).\n")
+    return unique_ids, None
+
+def read_new_records_csv_parallel(filepath, config=None, log=None, jobs=None, progress=None, diagnostics=None, keep_nameless=False):
+    # Parallel CSV counterpart of read_new_records_file that also computes the comparison IDs.
+    # Returns (records, header, record_ids, error); record_ids is None when the sequential path was used.
+    config = config or CONFIG
+    log = log or _null_log
+    jobs = resolve_jobs(jobs)
+    filename = os.path.basename(filepath)
+    expected_name_col, expected_forename_col = config['NEW_RECORDS_NAME_COL'], config['NEW_RECORDS_FORENAME_COL']
+    csv_delimiter = config['NEW_RECORDS_CSV_DELIMITER']
+
+    def read_sequentially():
+        records, header, error = read_new_records_file(filepath, expected_name_col, expected_forename_col, csv_delimiter, log, progress, diagnostics, keep_nameless=keep_nameless)
+        return records, header, None, error
+
+    if os.path.splitext(filename)[1].lower() != '.csv' or jobs == 1:
+        return read_sequentially()
+    try:
+        header, data_start = read_csv_header(filepath, csv_delimiter)
+        byte_ranges = split_byte_ranges(filepath, data_start, jobs * CHUNKS_PER_JOB)
+    except Exception:
+        return read_sequentially() # Let the sequential reader report the problem
+    if len(byte_ranges) == 1 or not header:
+        return read_sequentially()
+
+    final_header = [str(h) for h in header]
+    name_col_idx, forename_col_idx, case_insensitive = resolve_csv_name_columns(final_header, expected_name_col, expected_forename_col)
+    compare_name_key, compare_forename_key, compare_error = resolve_compare_columns(final_header, config)
+    if name_col_idx == -1 or forename_col_idx == -1 or compare_error:
+        return read_sequentially()
+
+    workers = min(jobs, len(byte_ranges))
+    all_records = []
+    record_ids = []
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            byte_ranges, first_rows = _plan_chunks(pool, filepath, byte_ranges, csv_delimiter)
+            if byte_ranges is None:
+                raise _SequentialFallback
+            log(f"Attempting to read New Records file: {filename}\n")
+            log(f"  Using Name column: '{expected_name_col}'\n")
+            log(f"  Using Forename column: '{expected_forename_col}'\n")
+            log(f"  Reading as CSV file with delimiter '{csv_delimiter}' using {workers} processes on {len(byte_ranges)} chunks...\n")
+            if case_insensitive:
+                log(f"    Note: Used case-insensitive matching for Name/Forename columns in '{filename}'.\n")
+            futures = [
+                pool.submit(_new_records_chunk_worker, filepath, start, end, csv_delimiter, final_header,
+                            name_col_idx, forename_col_idx, (compare_name_key, compare_forename_key), first_row, _keep_rows(diagnostics), keep_nameless)
+                for (start, end), first_row in zip(byte_ranges, first_rows)
+            ]
+            file_size = byte_ranges[-1][1]
+            try:
+                for future, (_, end) in zip(futures, byte_ranges):
+                    rows, chunk_ids, warnings = future.result()
+                    _replay_warnings(log, diagnostics, warnings)
+                    all_records.extend(dict(zip(final_header, row)) for row in rows)
+                    record_ids.extend(chunk_ids)
+                    _report(progress, 'new_records', end, file_size, len(all_records))
+            except ProcessingCancelled:
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+    except _SequentialFallback:
+        log(SEQUENTIAL_FALLBACK_NOTE)
+        return read_sequentially()
+    except Exception as e:
+        return None, None, None, f"An unexpected error occurred while reading New Records file '{filename}': {e}"
+
+    if all_records:
+        log(f"  Successfully processed {len(all_records)} records from New Records file '{filename}'.\n")
+    else:
+        log(f"  Processed file '{filename}', found header but no valid data rows.\n")
+    return all_records, final_header, record_ids, None
+
+def read_new_records_excel_parallel(filepath, config=None, log=None, jobs=None, progress=None, diagnostics=None, keep_nameless=False):
+    # Excel counterpart of read_new_records_csv_parallel, one sheet per task: same records,
+    # header (from the first sheet with data and the required columns) and warnings as
+    # read_new_records_file. Returns (records, header, record_ids, error).
+    config = config or CONFIG
+    log = log or _null_log
+    jobs = resolve_jobs(jobs)
+    filename = os.path.basename(filepath)
+    expected_name_col, expected_forename_col = config['NEW_RECORDS_NAME_COL'], config['NEW_RECORDS_FORENAME_COL']
+
+    def read_sequentially():
+        records, header, error = read_new_records_file(filepath, expected_name_col, expected_forename_col, config['NEW_RECORDS_CSV_DELIMITER'], log, progress, diagnostics,
+                                                       keep_nameless=keep_nameless)
+        return records, header, None, error
+
+    if jobs == 1:
+        return read_sequentially()
+    try:
+        sheet_count = count_excel_sheets(filepath)
+    except Exception:
+        return read_sequentially() # Let the sequential reader report the problem (or fall back to pandas)
+    if sheet_count < 2:
+        return read_sequentially()
+
+    log(f"Attempting to read New Records file: {filename}\n")
+    log(f"  Using Name column: '{expected_name_col}'\n")
+    log(f"  Using Forename column: '{expected_forename_col}'\n")
+    workers = min(jobs, sheet_count)
+    log(f"  Reading as Excel file using {workers} processes on {sheet_count} sheets...\n")
+
+    final_header = None
+    all_records = []
+    record_ids = []
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_open_worker_workbook, initargs=(filepath,)) as pool:
+            futures = [pool.submit(_excel_sheet_worker, sheet_index, config, _keep_rows(diagnostics), keep_nameless) for sheet_index in range(sheet_count)]
+            try:
+                for sheets_done, future in enumerate(futures, 1): # In sheet order, so the header and warnings are the sequential ones
+                    sheet_name, sheet_header, messages, rows, sheet_ids, warnings = future.result()
+                    for message in messages:
+                        log(message)
+                    if sheet_header is not None:
+                        if final_header is None:
+                            final_header = sheet_header
+                            log(f"    Using header from sheet '{sheet_name}' for output: {', '.join(final_header)}\n")
+                        _replay_warnings(log, diagnostics, warnings)
+                        column_map = _header_column_map(sheet_header, final_header)
+                        if column_map is not None: # Other columns: mapped by name, IDs computed here
+                            rows = [[row[idx] if idx is not None else '' for idx in column_map] for row in rows]
+                            sheet_ids = _sheet_record_ids(rows, final_header, config)
+                        all_records.extend(dict(zip(final_header, row)) for row in rows)
+                        if sheet_ids is None: # classify_records will compute them (and report the problem)
+                            record_ids = None
+                        elif record_ids is not None:
+                            record_ids.extend(sheet_ids)
+                    _report(progress, 'new_records', sheets_done, sheet_count, len(all_records))
+            except ProcessingCancelled:
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+    except Exception as e:
+        return None, None, None, f"An unexpected error occurred while reading New Records file '{filename}': {e}"
+
+    if final_header is None:
+        return None, None, None, f"Error: No sheet in '{filename}' contained the required columns ('{expected_name_col}', '{expected_forename_col}')."
+    _log_records_read(log, filename, len(all_records))
+    return all_records, final_header, record_ids, None
+
+def read_new_records_parallel(filepath, config=None, log=None, jobs=None, progress=None, diagnostics=None, excel_cache=None, keep_nameless=False):
+    # CSV files are split into byte ranges, Excel workbooks into sheets. Parquet files, and
+    # workbooks with an ExcelParquetCache (whose Parquet copy reads faster than sheets decoded
+    # in parallel), are read in this process.
+    file_ext = os.path.splitext(filepath)[1].lower()
+    if file_ext == PARQUET_EXT or (file_ext in ('.xlsx', '.xls') and excel_cache is not None):
+        config = config or CONFIG
+        log = log or _null_log
+        if file_ext != PARQUET_EXT and not excel_cache.contains(filepath):
+            log("  Note: The workbook is read in a single process while its Parquet copy is made.\n")
+        records, header, error = read_new_records_file(filepath, config['NEW_RECORDS_NAME_COL'], config['NEW_RECORDS_FORENAME_COL'], config['NEW_RECORDS_CSV_DELIMITER'],
+                                                       log, progress, diagnostics, excel_cache, keep_nameless)
+        return records, header, None, error
+    if file_ext in ('.xlsx', '.xls'):
+        return read_new_records_excel_parallel(filepath, config, log, jobs, progress, diagnostics, keep_nameless)
+    return read_new_records_csv_parallel(filepath, config, log, jobs, progress, diagnostics, keep_nameless)
@@ -0,0 +1,237 @@
+import hashlib
+import importlib.util
+import json
+import math
+import os
+import shutil
+import tempfile
+
+from dedup_cache import CACHE_FORMAT_VERSION, DEFAULT_CACHE_DIR, DEFAULT_CACHE_MAX_BYTES, file_fingerprint
+
+
+# --- Parquet (Arrow) files ---
+# Parquet is read and written with pyarrow, imported only when a Parquet file is used (it is an
+# optional dependency). Reading can be restricted to some columns (projection): the CRM index
+# only reads the name or match rule columns, whatever the width of the export. Values are
+# turned into strings like the CSV and Excel readers do ('' for nulls, 2.0 -> '2').
+# An ExcelParquetCache keeps a Parquet copy of each Excel workbook read, so later runs on the
+# same file skip decoding the workbook.
+
+PARQUET_EXT = '.parquet'
+PARQUET_BATCH_ROWS = 64 * 1024 # Rows converted (read) or buffered (written) at a time
+EXCEL_CACHE_FOLDER = 'excel' # Inside the cache folder, next to the CRM indexes
+EXCEL_CACHE_MANIFEST = 'sheets.json'
+PYARROW_MISSING = "Error: Parquet files need the pyarrow package (pip install pyarrow)."
+
+
+def is_parquet_file(filepath):
+    return os.path.splitext(filepath)[1].lower() == PARQUET_EXT
+
+def pyarrow_error():
+    # PYARROW_MISSING when pyarrow isn't installed, else None
+    try:
+        if importlib.util.find_spec('pyarrow.parquet') is None:
+            return PYARROW_MISSING
+    except ImportError: # No pyarrow package at all
+        return PYARROW_MISSING
+    return None
+
+def read_parquet_header(filepath):
+    # Column names, from the file's footer only
+    import pyarrow.parquet as pq
+    return [str(name) for name in pq.read_schema(filepath).names]
+
+def parquet_row_count(filepath):
+    import pyarrow.parquet as pq
+    return pq.ParquetFile(filepath).metadata.num_rows
+
+def _value_to_str(value):
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        return value
+    if isinstance(value, float):
+        if not math.isfinite(value):
+            return '' if math.isnan(value) else str(value)
+        if value == int(value): # As for Excel numbers: 2.0 -> '2'
+            return str(int(value))
+    return str(value)
+
+def _column_strings(column):
+    import pyarrow as pa
+    if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+        return column.fill_null('').to_pylist()
+    return [_value_to_str(value) for value in column.to_pylist()]
+
+def iter_parquet_rows(filepath, columns=None):
+    # Yields each row as a list of strings, with only the given columns (names, in that order) if set
+    import pyarrow.parquet as pq
+    parquet_file = pq.ParquetFile(filepath)
+    try:
+        for batch in parquet_file.iter_batches(batch_size=PARQUET_BATCH_ROWS, columns=columns):
+            yield from map(list, zip(*[_column_strings(column) for column in batch.columns]))
+    finally:
+        parquet_file.close()
+
+class ParquetRowWriter:
+    # Writes rows (lists in header order) to a Parquet file of string columns, like csv.writer.
+    # Values that are not strings are converted with str(), None becomes ''. The file is complete
+    # once close() is called.
+
+    def __init__(self, filepath, header):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.name = filepath
+        self._schema = pa.schema([pa.field(str(h), pa.string()) for h in header])
+        self._writer = pq.ParquetWriter(filepath, self._schema)
+        self._pending = []
+
+    def writerow(self, row):
+        self._pending.append(row)
+        if len(self._pending) >= PARQUET_BATCH_ROWS:
+            self._flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def _flush(self):
+        import pyarrow as pa
+        self._writer.write_table(pa.Table.from_arrays(
+            [pa.array([value if isinstance(value, str) else _value_to_str(value) for value in values], pa.string()) for values in zip(*self._pending)],
+            schema=self._schema
+        ))
+        self._pending = []
+
+    def close(self):
+        if self._writer is None:
+            return
+        try:
+            if self._pending:
+                self._flush()
+        finally:
+            self._writer.close()
+            self._writer = None
+
+def write_parquet_rows(filepath, header, rows):
+    writer = ParquetRowWriter(filepath, header)
+    try:
+        writer.writerows(rows)
+    finally:
+        writer.close()
+
+# --- Parquet copies of Excel workbooks ---
+
+class ExcelParquetCache:
+    # One folder per workbook version (file fingerprint, as for the CRM index cache) holding a
+    # Parquet file per sheet and a manifest of the sheets in workbook order. open_sheets gives
+    # the same (sheet_name, header, rows) as dedup_excel.open_excel_sheets. Every sheet is
+    # copied in full, so the copy serves any column settings. Least recently used copies are
+    # removed once the folder exceeds max_bytes.
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES, hash_content=False):
+        self.cache_dir = os.path.join(cache_dir, EXCEL_CACHE_FOLDER)
+        self.max_bytes = max_bytes
+        self.hash_content = hash_content
+
+    def cache_key(self, filepath):
+        key_data = {'version': CACHE_FORMAT_VERSION, 'excel': file_fingerprint(filepath, self.hash_content)}
+        return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _manifest(self, key):
+        # List of {'name', 'header', 'file'} per sheet, or None on a miss
+        folder = os.path.join(self.cache_dir, key)
+        try:
+            with open(os.path.join(folder, EXCEL_CACHE_MANIFEST), 'r', encoding='utf-8') as file:
+                sheets = json.load(file)['sheets']
+        except (OSError, ValueError, KeyError):
+            return None
+        try:
+            os.utime(folder) # Mark as recently used for eviction
+        except OSError:
+            pass
+        return sheets
+
+    def contains(self, filepath):
+        try:
+            return self._manifest(self.cache_key(filepath)) is not None
+        except OSError:
+            return False
+
+    def open_sheets(self, filepath):
+        # Iterator of (sheet_name, header, rows) read from the copy of the workbook, or None on a miss
+        try:
+            key = self.cache_key(filepath)
+        except OSError:
+            return None
+        sheets = self._manifest(key)
+        if sheets is None:
+            return None
+        folder = os.path.join(self.cache_dir, key)
+        return ((sheet['name'], sheet['header'], iter_parquet_rows(os.path.join(folder, sheet['file'])) if sheet['file'] else None)
+                for sheet in sheets)
+
+    def recording_sheets(self, filepath, sheets, log=None):
+        # Passes the sheets of the workbook at filepath through, copying them as they are read.
+        # Rows a reader skips are still copied, before moving to the next sheet. The copy is only
+        # kept once every sheet went through.
+        key = self.cache_key(filepath)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temp_folder = tempfile.mkdtemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            manifest = []
+            for sheet_number, (sheet_name, header, rows) in enumerate(sheets):
+                if header is None:
+                    manifest.append({'name': sheet_name, 'header': None, 'file': None})
+                    yield sheet_name, header, rows
+                    continue
+                sheet_file = f"sheet_{sheet_number:03d}{PARQUET_EXT}"
+                writer = ParquetRowWriter(os.path.join(temp_folder, sheet_file), header)
+                try:
+                    recorded = self._recorded_rows(rows, writer)
+                    yield sheet_name, header, recorded
+                    for _ in recorded: # Rest of a sheet the reader skipped
+                        pass
+                finally:
+                    writer.close()
+                manifest.append({'name': sheet_name, 'header': list(header), 'file': sheet_file})
+            with open(os.path.join(temp_folder, EXCEL_CACHE_MANIFEST), 'w', encoding='utf-8') as file:
+                json.dump({'version': CACHE_FORMAT_VERSION, 'sheets': manifest}, file)
+            folder = os.path.join(self.cache_dir, key)
+            shutil.rmtree(folder, ignore_errors=True)
+            os.replace(temp_folder, folder)
+            if log is not None:
+                log("  Saved a Parquet copy of the workbook for the next runs.\n")
+            self.evict()
+        finally:
+            shutil.rmtree(temp_folder, ignore_errors=True) # Only left when the reading stopped early
+
+    @staticmethod
+    def _recorded_rows(rows, writer):
+        for row in rows:
+            writer.writerow(row)
+            yield row
+
+    def evict(self):
+        # Removes the least recently used copies until the folder fits in max_bytes
+        try:
+            names = [n for n in os.listdir(self.cache_dir) if not n.endswith('.tmp')]
+        except OSError:
+            return
+        entries = []
+        for name in names:
+            folder = os.path.join(self.cache_dir, name)
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(folder))
+                entries.append((os.stat(folder).st_mtime, size, folder))
+            except OSError:
+                continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, folder in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(folder, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
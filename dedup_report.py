@@ -0,0 +1,129 @@
+import json
+import os
+import sys
+import time
+
+
+# --- Run instrumentation ---
+# A RunReport passed to run_deduplication/stream_deduplication records, for each stage, the
+# wall time, rows in and out, rows/s and the process's peak memory so far. It can be written
+# as JSON next to the outputs and printed as a table. With trace_memory, tracemalloc also
+# records the peak Python allocations of each stage (slower; for investigations only).
+
+RUN_REPORT_FILENAME = "run_report.json"
+STAGE_LABELS = {
+    'crm_index': "CRM index",
+    'new_records': "Read new records",
+    'fuzzy_index': "Fuzzy index",
+    'compare': "Compare",
+    'stream': "Read, compare & write",
+    'crm_partition': "Partition CRM keys",
+    'new_partition': "Partition new records",
+    'join': "Join partitions",
+    'save': "Save outputs",
+}
+
+
+def peak_rss_mb():
+    # Peak resident memory of the current process in MB, or None when it can't be measured
+    try:
+        import resource
+    except ImportError: # Windows
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024 # bytes on macOS, KB elsewhere
+
+class RunReport:
+    # stages holds one dict per finished stage, in order; info holds run-level facts
+    # (input files, settings, cache use) added by the engine and the callers.
+
+    def __init__(self, trace_memory=False):
+        self.stages = []
+        self.info = {}
+        self.trace_memory = trace_memory
+        self._started = {}
+        self._run_started = time.perf_counter()
+        if trace_memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+
+    def start(self, name):
+        self._started[name] = time.perf_counter()
+        if self.trace_memory:
+            import tracemalloc
+            tracemalloc.reset_peak()
+
+    def finish(self, name, rows_in=None, rows_out=None, **details):
+        seconds = time.perf_counter() - self._started.pop(name)
+        rows = rows_in if rows_in is not None else rows_out
+        stage = {
+            'stage': name,
+            'seconds': round(seconds, 4),
+            'rows_in': rows_in,
+            'rows_out': rows_out,
+            'rows_per_sec': round(rows / seconds, 1) if rows and seconds > 0 else None,
+            'peak_rss_mb': _round(peak_rss_mb()),
+        }
+        if self.trace_memory:
+            import tracemalloc
+            stage['traced_peak_mb'] = _round(tracemalloc.get_traced_memory()[1] / (1024 * 1024))
+        stage.update(details)
+        self.stages.append(stage)
+        return stage
+
+    def to_dict(self):
+        return {
+            'total_seconds': round(time.perf_counter() - self._run_started, 4),
+            'peak_rss_mb': _round(peak_rss_mb()),
+            'info': self.info,
+            'stages': self.stages,
+        }
+
+    def write(self, filepath):
+        # Returns an error message or None, like write_output_file
+        try:
+            with open(filepath, 'w', encoding='utf-8') as file:
+                json.dump(self.to_dict(), file, indent=2, ensure_ascii=False)
+            return None
+        except Exception as e:
+            return f"Error saving '{os.path.basename(filepath)}': {e}"
+
+    def table_rows(self):
+        # (stage, seconds, rows in, rows out, rows/s, peak MB) as display strings
+        return [
+            (
+                STAGE_LABELS.get(stage['stage'], stage['stage']),
+                f"{stage['seconds']:.2f}",
+                _format_count(stage['rows_in']),
+                _format_count(stage['rows_out']),
+                _format_count(stage['rows_per_sec']),
+                _format_count(stage['peak_rss_mb']),
+            )
+            for stage in self.stages
+        ]
+
+    def summary(self):
+        lines = [f"{'Stage':<22} {'Seconds':>8} {'Rows in':>11} {'Rows out':>11} {'Rows/s':>11} {'Peak MB':>8}\n"]
+        for row in self.table_rows():
+            lines.append(f"{row[0]:<22} {row[1]:>8} {row[2]:>11} {row[3]:>11} {row[4]:>11} {row[5]:>8}\n")
+        return ''.join(lines)
+
+def _round(value):
+    return round(value, 1) if value is not None else None
+
+def _format_count(value):
+    return f"{value:,.0f}" if value is not None else "-"
+
+def run_profiled(profile_path, func, *args, **kwargs):
+    # Runs func under cProfile and writes the stats to profile_path (open with pstats or snakeviz)
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        profiler.dump_stats(profile_path)
@@ -0,0 +1,196 @@
+import re
+
+from dedup_engine import create_unique_id, normalize_name_part
+
+
+# --- Configurable match rules over several columns ---
+# MATCH_RULES is an OR of rules, each rule an AND of terms, e.g.
+#     email | name + text:Société=Company | phone:Téléphone=Phone
+# ("OR" and "AND" can be written instead of "|" and "+", and a rule may be wrapped in
+# parentheses). A term is:
+#     name                     the configured last/first name columns (as without rules)
+#     kind:CRM column=New col  a column normalized by kind (email, phone or text); "=New col"
+#                              can be left out when both files use the same column name
+#     email / phone            shorthand for email:email / phone:phone
+#     Column                   shorthand for text:Column
+# Every rule gets its own keys in one index, so the CRM file is still read once. Keys are
+# "<rule number>\x1f<values joined by \x1e>", and a rule only applies when none of its values
+# is empty.
+
+TERM_KINDS = ('email', 'phone', 'text')
+DEFAULT_PHONE_COUNTRY_CODE = '33' # National numbers are written 0XXXXXXXXX for this country
+MIN_PHONE_DIGITS = 6
+
+_RULE_SPLIT_RE = re.compile(r'\s*(?:\||\sOR\s)\s*')
+_TERM_SPLIT_RE = re.compile(r'\s*(?:\+|\sAND\s)\s*')
+_TRUNK_PREFIX_RE = re.compile(r'\(0\)')
+_NON_DIGITS_RE = re.compile(r'\D')
+
+
+def normalize_email(value):
+    return ''.join(str(value).split()).lower()
+
+def normalize_phone(value):
+    # "+33 (0)6 12 34 56 78", "0033 6.12.34.56.78" and "06 12 34 56 78" all give "0612345678";
+    # other international numbers keep their country code ("+4930123456")
+    value = _TRUNK_PREFIX_RE.sub('', str(value).strip())
+    digits = _NON_DIGITS_RE.sub('', value)
+    if value.startswith('+'):
+        international = digits
+    elif digits.startswith('00'):
+        international = digits[2:]
+    else:
+        return digits if len(digits) >= MIN_PHONE_DIGITS else ''
+    if len(international) < MIN_PHONE_DIGITS:
+        return ''
+    if international.startswith(DEFAULT_PHONE_COUNTRY_CODE):
+        return '0' + international[len(DEFAULT_PHONE_COUNTRY_CODE):]
+    return '+' + international
+
+_NORMALIZERS = {'email': normalize_email, 'phone': normalize_phone, 'text': normalize_name_part}
+
+class MatchTerm:
+    def __init__(self, kind, crm_column=None, new_column=None):
+        self.kind = kind # 'name' or one of TERM_KINDS
+        self.crm_column = crm_column
+        self.new_column = new_column
+
+    def label(self):
+        if self.kind == 'name':
+            return 'name'
+        if self.crm_column == self.new_column:
+            return f"{self.kind}:{self.crm_column}"
+        return f"{self.kind}:{self.crm_column}={self.new_column}"
+
+def _parse_term(text):
+    if text.lower() == 'name':
+        return MatchTerm('name'), None
+    kind, separator, columns = text.partition(':')
+    if not separator:
+        kind, columns = ('text', text) if text.lower() not in TERM_KINDS else (text.lower(), text)
+    kind = kind.strip().lower()
+    if kind not in TERM_KINDS:
+        return None, f"Error: Unknown match rule term '{text}' (use name, or email/phone/text:Column)."
+    crm_column, _, new_column = columns.partition('=')
+    crm_column, new_column = crm_column.strip(), new_column.strip() or crm_column.strip()
+    if not crm_column:
+        return None, f"Error: Match rule term '{text}' has no column."
+    return MatchTerm(kind, crm_column, new_column), None
+
+def parse_match_rules(value):
+    # CONFIG value -> (MatchRules or None when empty, error message)
+    value = str(value or '').strip()
+    if not value:
+        return None, None
+    rules = []
+    for rule_text in _RULE_SPLIT_RE.split(value):
+        rule_text = rule_text.strip()
+        if rule_text.startswith('(') and rule_text.endswith(')'):
+            rule_text = rule_text[1:-1].strip()
+        if not rule_text or '(' in rule_text or ')' in rule_text:
+            return None, f"Error: Invalid match rules '{value}' (write them as rule | rule, each rule as term + term)."
+        terms = []
+        for term_text in _TERM_SPLIT_RE.split(rule_text):
+            term, error = _parse_term(term_text.strip())
+            if error:
+                return None, error
+            terms.append(term)
+        rules.append(terms)
+    return MatchRules(rules), None
+
+def _find_column(header, column):
+    # Case-insensitive column lookup, like the name columns of the new records file
+    wanted = column.strip().lower()
+    for idx, h in enumerate(header):
+        if str(h).strip().lower() == wanted:
+            return idx
+    return -1
+
+class MatchRules:
+    # Parsed MATCH_RULES. counts holds how many new records each rule matched (first matching
+    # rule wins, in the order the rules are written).
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.labels = [' + '.join(term.label() for term in terms) for terms in rules]
+        self.reset_counts()
+
+    def reset_counts(self):
+        self.counts = {label: 0 for label in self.labels}
+
+    def spec(self):
+        # Canonical text of the rules, part of the CRM index cache key
+        return ' | '.join(self.labels)
+
+    def _resolve(self, header, lastname_col, firstname_col, column_attr, file_label, by_name):
+        # Returns ([(kind, columns)] per rule, error); 'name' uses both name columns. Columns are
+        # indexes into row lists, or header names (by_name) to read record dicts.
+        resolved = []
+        for terms in self.rules:
+            rule_columns = []
+            for term in terms:
+                columns = (lastname_col, firstname_col) if term.kind == 'name' else (getattr(term, column_attr),)
+                indexes = []
+                for column in columns:
+                    idx = _find_column(header, column)
+                    if idx == -1:
+                        return None, (f"Error: Match rule column '{column}' not found in {file_label}.\n"
+                                      f"Found headers: {', '.join(map(str, header))}")
+                    indexes.append(str(header[idx]) if by_name else idx)
+                rule_columns.append((term.kind, indexes))
+            resolved.append(rule_columns)
+        return resolved, None
+
+    def resolve_crm_columns(self, header, lastname_col, firstname_col):
+        return self._resolve(header, lastname_col, firstname_col, 'crm_column', "CRM file", False)
+
+    def resolve_new_columns(self, header, name_col, forename_col, by_name=True):
+        return self._resolve(header, name_col, forename_col, 'new_column', "New Records file", by_name)
+
+    @staticmethod
+    def _rule_key(rule_number, rule_columns, values):
+        parts = []
+        for kind, indexes in rule_columns:
+            if kind == 'name':
+                part = create_unique_id(values[indexes[0]], values[indexes[1]])
+            else:
+                part = _NORMALIZERS[kind](values[indexes[0]])
+            if not part:
+                return None
+            parts.append(part)
+        return f"{rule_number}\x1f" + '\x1e'.join(parts)
+
+    def row_keys(self, values, resolved):
+        # Keys of a row (list, or record dict with columns resolved by name) for every rule that applies to it
+        keys = []
+        for rule_number, rule_columns in enumerate(resolved):
+            key = self._rule_key(rule_number, rule_columns, values)
+            if key is not None:
+                keys.append(key)
+        return keys
+
+    def match(self, values, resolved, index):
+        # Label of the first rule matching the row in the CRM index, or None
+        for rule_number, rule_columns in enumerate(resolved):
+            key = self._rule_key(rule_number, rule_columns, values)
+            if key is not None and key in index:
+                label = self.labels[rule_number]
+                self.counts[label] += 1
+                return label
+        return None
+
+    def matched_key(self, values, resolved, label):
+        # Normalized values compared by the rule named label for this row, e.g. "a@b.fr + dupont jean"
+        if label not in self.labels:
+            return ''
+        rule_number = self.labels.index(label)
+        key = self._rule_key(rule_number, resolved[rule_number], values)
+        return key.split('\x1f', 1)[1].replace('\x1e', ' + ') if key is not None else ''
+
+    def name_ids(self, index):
+        # CRM name IDs of a rule that is just 'name' (used by fuzzy matching), or None
+        for rule_number, terms in enumerate(self.rules):
+            if len(terms) == 1 and terms[0].kind == 'name':
+                prefix = f"{rule_number}\x1f"
+                return {key[len(prefix):] for key in index if key.startswith(prefix)}
+        return None
@@ -0,0 +1,267 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+from dedup_engine import CONFIG, Diagnostics, _null_log, create_unique_id, load_crm_index, resolve_compare_columns
+
+
+# --- Local lookup service keeping the CRM index in memory ---
+# A small HTTP/1.1 server (asyncio, standard library only) answering "is this contact
+# already in the CRM?" with the same normalization as the file runs:
+#     GET  /lookup?Nom=Dupont&Prénom=Jean
+#     POST /lookup   {"Nom": "Dupont", "Prénom": "Jean"}  or  {"records": [{...}, {...}]}
+#     GET  /health
+# Records use the column names of the new records files (NEW_RECORDS_NAME_COL and
+# NEW_RECORDS_FORENAME_COL, matched case-insensitively; with match rules, their columns too).
+# The CRM export is checked every few seconds; once a changed file has stopped changing, a
+# new index is built on a worker thread and swapped in with a single assignment, so requests
+# keep being answered from the old index until then. Each request uses one index throughout.
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_RELOAD_INTERVAL = 5.0
+MAX_BODY_BYTES = 10 * 1024 * 1024
+MAX_BATCH_RECORDS = 10000
+
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large'}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def _file_state(filepath):
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+class DedupService:
+    # index is replaced as a whole on reload, never modified in place
+
+    def __init__(self, crm_filepath, config=None, log=None, cache=None, rules=None, reload_interval=DEFAULT_RELOAD_INTERVAL):
+        self.crm_filepath = crm_filepath
+        self.config = config or CONFIG
+        self.log = log or _null_log
+        self.cache = cache
+        self.rules = rules
+        self.reload_interval = reload_interval
+        self.index = None
+        self.loaded_at = None
+        self.loaded_state = None
+        self.reloads = 0
+        self.requests = 0
+
+    def build_index(self):
+        # Returns (index, file state, error); runs on a worker thread when reloading
+        state = _file_state(self.crm_filepath)
+        index, error = load_crm_index(self.crm_filepath, self.config, self.log, self.cache, diagnostics=Diagnostics(self.log), rules=self.rules)
+        return index, state, error
+
+    def load(self):
+        # Initial load; returns an error message or None
+        index, state, error = self.build_index()
+        if error:
+            return error
+        self._swap(index, state)
+        return None
+
+    def _swap(self, index, state):
+        self.index = index
+        self.loaded_state = state
+        self.loaded_at = time.time()
+
+    async def watch_crm_file(self):
+        # Rebuilds the index after the CRM export has changed and then stayed the same for one interval
+        loop = asyncio.get_running_loop()
+        previous = self.loaded_state
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            state = _file_state(self.crm_filepath)
+            if state is None or state == self.loaded_state or state != previous:
+                previous = state
+                continue
+            self.log("CRM export changed, rebuilding the index...\n")
+            index, built_state, error = await loop.run_in_executor(None, self.build_index)
+            if error:
+                self.log(f"Reload failed, still serving the previous index: {error}\n")
+                previous = None
+                continue
+            self._swap(index, built_state)
+            self.reloads += 1
+            self.log(f"Index reloaded ({len(index)} IDs).\n")
+
+    def lookup(self, records):
+        # One result dict per record, all answered from the same index
+        index = self.index
+        results = []
+        for record in records:
+            if not isinstance(record, dict):
+                results.append({'error': "A record must be a JSON object of column names and values."})
+                continue
+            record = {str(k): '' if v is None else str(v) for k, v in record.items()}
+            name_key, forename_key, error = resolve_compare_columns(list(record), self.config)
+            if error:
+                results.append({'error': f"Columns '{self.config['NEW_RECORDS_NAME_COL']}' and '{self.config['NEW_RECORDS_FORENAME_COL']}' are required."})
+                continue
+            unique_id = create_unique_id(record[name_key], record[forename_key])
+            result = {'id': unique_id, 'duplicate': False}
+            if self.rules is not None:
+                present = {column.strip().lower() for column in record}
+                for terms in self.rules.rules: # A rule column left out is empty, so its rules don't apply
+                    for term in terms:
+                        if term.kind != 'name' and term.new_column.strip().lower() not in present:
+                            record[term.new_column] = ''
+                            present.add(term.new_column.strip().lower())
+                rule_columns, rules_error = self.rules.resolve_new_columns(list(record), name_key, forename_key)
+                if rules_error:
+                    result['error'] = rules_error.splitlines()[0]
+                elif not unique_id and not self.rules.row_keys(record, rule_columns): # Rules on other columns can still apply
+                    result['error'] = "Empty name after normalization."
+                else:
+                    matched_rule = self.rules.match(record, rule_columns, index)
+                    result.update({'duplicate': matched_rule is not None, 'rule': matched_rule})
+            elif not unique_id:
+                result['error'] = "Empty name after normalization."
+            else:
+                result['duplicate'] = unique_id in index
+            results.append(result)
+        return results
+
+    def health(self):
+        return {
+            'status': 'ok',
+            'crm_file': os.path.abspath(self.crm_filepath),
+            'ids': len(self.index),
+            'loaded_at': self.loaded_at,
+            'reloads': self.reloads,
+            'requests': self.requests,
+        }
+
+    def handle_request(self, method, target, body):
+        # Returns (status, JSON-serializable response)
+        url = urlsplit(target)
+        if url.path == '/health':
+            return 200, self.health()
+        if url.path != '/lookup':
+            raise HttpError(404, f"Unknown path '{url.path}' (use /lookup or /health).")
+        if method == 'GET':
+            return 200, self.lookup([dict(parse_qsl(url.query))])[0]
+        if method != 'POST':
+            raise HttpError(405, "Use GET or POST.")
+        try:
+            payload = json.loads(body.decode('utf-8'))
+        except (UnicodeDecodeError, ValueError):
+            raise HttpError(400, "The body must be JSON.")
+        if not isinstance(payload, dict) or ('records' in payload and not isinstance(payload['records'], list)):
+            raise HttpError(400, "The body must be a JSON object: one record, or {\"records\": [...]}.")
+        if 'records' in payload:
+            if len(payload['records']) > MAX_BATCH_RECORDS:
+                raise HttpError(413, f"At most {MAX_BATCH_RECORDS} records per request.")
+            return 200, {'results': self.lookup(payload['records'])}
+        return 200, self.lookup([payload])[0]
+
+    async def _handle_connection(self, reader, writer):
+        # Keep-alive connection: one request after another until the client closes it
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                try:
+                    method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                    length = int(headers.get('content-length') or 0)
+                    if length > MAX_BODY_BYTES:
+                        keep_alive = False
+                        raise HttpError(413, f"Request bodies are limited to {MAX_BODY_BYTES} bytes.")
+                    body = await reader.readexactly(length) if length else b''
+                    self.requests += 1
+                    status, response = self.handle_request(method.upper(), target, body)
+                except HttpError as e:
+                    status, response = e.status, {'error': str(e)}
+                except ValueError:
+                    status, response, keep_alive = 400, {'error': "Malformed request."}, False
+                data = json.dumps(response, ensure_ascii=False).encode('utf-8')
+                writer.write(
+                    f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+                    f"Content-Type: application/json; charset=utf-8\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, ready=None):
+        # Serves until cancelled; ready(host, port) is called once listening (port 0 picks a free one)
+        server = await asyncio.start_server(self._handle_connection, host, port)
+        watcher = asyncio.create_task(self.watch_crm_file()) if self.reload_interval else None
+        host, port = server.sockets[0].getsockname()[:2]
+        self.log(f"Serving on http://{host}:{port}/lookup\n")
+        if ready is not None:
+            ready(host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+
+def main(argv=None):
+    from dedup_cache import CrmIndexCache, DEFAULT_CACHE_DIR
+    from dedup_cli import CONFIG_OPTIONS
+    from dedup_rules import parse_match_rules
+
+    parser = argparse.ArgumentParser(description="Serve CRM duplicate lookups over HTTP on this machine.")
+    parser.add_argument('crm_file', help="CRM export (CSV or Parquet), reloaded when it changes")
+    parser.add_argument('--host', default=DEFAULT_HOST, help=f"Address to listen on (default: {DEFAULT_HOST}, this machine only)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f"Port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument('--reload-interval', type=float, default=DEFAULT_RELOAD_INTERVAL, help=f"Seconds between checks of the CRM export (0 = never reload, default: {DEFAULT_RELOAD_INTERVAL:g})")
+    parser.add_argument('-q', '--quiet', action='store_true', help="Only print errors")
+    parser.add_argument('--no-cache', action='store_true', help="Always rebuild the CRM index instead of using the on-disk cache")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help=f"Folder of the CRM index cache (default: {DEFAULT_CACHE_DIR})")
+    parser.add_argument('--incremental', action='store_true', help="The CRM export only grows by appended rows: keep a checkpoint with the cached index and reloads only read the rows added since (rebuilt when the file was otherwise changed)")
+    for option, key, help_text in CONFIG_OPTIONS:
+        if key != 'FUZZY_THRESHOLD' and key != 'IN_FILE_DUPLICATES_KEEP': # Only apply to files
+            parser.add_argument(option, dest=key, default=CONFIG[key], help=f"{help_text} (default: '{CONFIG[key]}')")
+    args = parser.parse_args(argv)
+    if args.incremental and args.no_cache:
+        parser.error("--incremental keeps its checkpoint in the cache and can't be combined with --no-cache")
+    config = dict(CONFIG, **{key: getattr(args, key) for _, key, _ in CONFIG_OPTIONS if hasattr(args, key)})
+    log = (lambda message: None) if args.quiet else sys.stderr.write
+
+    rules, rules_error = parse_match_rules(config['MATCH_RULES'])
+    if rules_error:
+        sys.stderr.write(rules_error + "\n")
+        return 1
+    service = DedupService(args.crm_file, config, log, None if args.no_cache else CrmIndexCache(args.cache_dir, incremental=args.incremental), rules, args.reload_interval)
+    error = service.load()
+    if error:
+        sys.stderr.write(error + "\n")
+        return 1
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,262 @@
+import tkinter as tk
+from tkinter import ttk
+
+from dedup_engine import MATCH_RULE_COLUMN, create_unique_id, resolve_compare_columns
+
+
+# --- Results viewer for the GUI ---
+# A ResultsView shows one result list (e.g. processed_duplicates) without copying it: sorting
+# and filtering only build a list of row numbers, and values are turned into text when a row
+# is displayed. A ResultsTable is a Treeview that holds just the rows on screen and refills
+# them as it is scrolled, so a million records scroll as fast as a hundred.
+
+MATCHED_ID_COLUMN = 'Matched CRM ID'
+PAGE_ROWS = 25
+COLUMN_WIDTH = 120
+
+
+def _display(value):
+    return '' if value is None else str(value)
+
+def matched_id_column(header, config, rules=None):
+    # Function giving, for a duplicate record, the normalized ID (or match rule key) it shares
+    # with a CRM contact; None when the header doesn't allow computing it
+    name_key, forename_key, compare_error = resolve_compare_columns(header, config)
+    if compare_error:
+        return None
+    if rules is None:
+        return lambda record: create_unique_id(record.get(name_key, ''), record.get(forename_key, ''))
+    resolved, rules_error = rules.resolve_new_columns(header, name_key, forename_key)
+    if rules_error:
+        return None
+    return lambda record: rules.matched_key(record, resolved, record.get(MATCH_RULE_COLUMN))
+
+class ResultsView:
+    # order holds the row numbers of records in display order (a range until sorted or filtered)
+
+    def __init__(self, records, header, extra_columns=None):
+        self.records = records
+        self.extra_columns = dict(extra_columns or {}) # Column name -> function(record), computed on display
+        self.columns = list(header) + list(self.extra_columns)
+        self.sort_column = None
+        self.sort_descending = False
+        self.filter_text = ''
+        self._sorted = range(len(records))
+        self.order = self._sorted
+
+    def __len__(self):
+        return len(self.order)
+
+    def value(self, record, column):
+        compute = self.extra_columns.get(column)
+        return _display(compute(record) if compute is not None else record.get(column))
+
+    def rows(self, first, count):
+        # Display values of count rows from position first
+        records, columns = self.records, self.columns
+        return [[self.value(records[i], column) for column in columns] for i in self.order[first:first + count]]
+
+    def sort(self, column, descending=False):
+        # Case-insensitive and stable, so equal values keep their file order; column None restores it
+        self.sort_column, self.sort_descending = column, descending
+        if column is None:
+            self._sorted = range(len(self.records))
+        else:
+            keys = [self.value(record, column).casefold() for record in self.records]
+            self._sorted = sorted(range(len(self.records)), key=keys.__getitem__, reverse=descending)
+        self._apply_filter()
+
+    def set_filter(self, text):
+        # Keeps the rows where text appears in any column (case-insensitive)
+        self.filter_text = text.strip().casefold()
+        self._apply_filter()
+
+    def _apply_filter(self):
+        if not self.filter_text:
+            self.order = self._sorted
+            return
+        # One search in the joined values of a row (the separator can't be part of the text)
+        text, records, columns, value = self.filter_text, self.records, self.columns, self.value
+        self.order = [i for i in self._sorted if text in '\x00'.join([value(records[i], column) for column in columns]).casefold()]
+
+class ResultsTable(tk.Frame):
+    # Virtualised table of a ResultsView: the Treeview holds at most page_rows items and the
+    # vertical scrollbar is driven by hand from the position in the view
+
+    def __init__(self, parent, page_rows=PAGE_ROWS, on_change=None):
+        super().__init__(parent)
+        self.view = None
+        self.first = 0
+        self.page_rows = page_rows
+        self.on_change = on_change # on_change(first, last, total) after each refresh, e.g. for a row count label
+        self.tree = ttk.Treeview(self, show='headings', height=page_rows, selectmode='browse')
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self._on_scrollbar)
+        x_scrollbar = ttk.Scrollbar(self, orient=tk.HORIZONTAL, command=self.tree.xview)
+        self.tree.configure(xscrollcommand=x_scrollbar.set)
+        self.tree.grid(row=0, column=0, sticky=tk.NSEW)
+        self.scrollbar.grid(row=0, column=1, sticky=tk.NS)
+        x_scrollbar.grid(row=1, column=0, sticky=tk.EW)
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+
+        self.tree.bind('<MouseWheel>', lambda event: self.scroll_by(-3 if event.delta > 0 else 3))
+        self.tree.bind('<Button-4>', lambda event: self.scroll_by(-3)) # Mouse wheel on X11
+        self.tree.bind('<Button-5>', lambda event: self.scroll_by(3))
+        self.tree.bind('<Prior>', lambda event: self._scroll_key(-self.page_rows))
+        self.tree.bind('<Next>', lambda event: self._scroll_key(self.page_rows))
+        self.tree.bind('<Up>', lambda event: self._move_selection(-1))
+        self.tree.bind('<Down>', lambda event: self._move_selection(1))
+        self.tree.bind('<Home>', lambda event: self._scroll_key(-len(self.view or ())))
+        self.tree.bind('<End>', lambda event: self._scroll_key(len(self.view or ())))
+        self.tree.bind('<Configure>', self._on_resize)
+
+    def _on_resize(self, event):
+        # Fits the page to the height the Treeview was given
+        items = self.tree.get_children()
+        box = self.tree.bbox(items[0]) if items else None
+        if not box:
+            return
+        rows = max(1, (event.height - box[1]) // box[3])
+        if rows != self.page_rows:
+            self.page_rows = rows
+            self.scroll_to(self.first, force=True)
+
+    def set_view(self, view):
+        self.view = view
+        self.first = 0
+        self.tree.configure(columns=[f"c{i}" for i in range(len(view.columns))])
+        for i, column in enumerate(view.columns):
+            self.tree.heading(f"c{i}", command=lambda column=column: self.sort_by(column))
+            self.tree.column(f"c{i}", width=COLUMN_WIDTH, minwidth=40, stretch=False)
+        self._update_headings()
+        self.refresh()
+
+    def _update_headings(self):
+        for i, column in enumerate(self.view.columns):
+            arrow = (" ▼" if self.view.sort_descending else " ▲") if column == self.view.sort_column else ""
+            self.tree.heading(f"c{i}", text=column + arrow)
+
+    def sort_by(self, column):
+        # First click sorts ascending, the second descending, the third restores the file order
+        view = self.view
+        if column != view.sort_column:
+            descending, column_to_use = False, column
+        elif not view.sort_descending:
+            descending, column_to_use = True, column
+        else:
+            descending, column_to_use = False, None
+        self._busy(lambda: view.sort(column_to_use, descending))
+        self._update_headings()
+        self.scroll_to(0, force=True)
+
+    def set_filter(self, text):
+        self._busy(lambda: self.view.set_filter(text))
+        self.scroll_to(0, force=True)
+
+    def _busy(self, action):
+        # Sorting or filtering a million rows takes a moment: show it
+        self.winfo_toplevel().config(cursor='watch')
+        self.update_idletasks()
+        try:
+            action()
+        finally:
+            self.winfo_toplevel().config(cursor='')
+
+    def scroll_to(self, first, force=False):
+        total = len(self.view) if self.view is not None else 0
+        first = max(0, min(first, total - self.page_rows))
+        if first != self.first or force:
+            self.first = first
+            self.refresh()
+
+    def scroll_by(self, rows):
+        self.scroll_to(self.first + rows)
+        return 'break'
+
+    def _scroll_key(self, rows):
+        self.scroll_by(rows)
+        self.tree.focus_set()
+        return 'break'
+
+    def _move_selection(self, step):
+        # Moves the selection one row, scrolling when it leaves the page
+        items = self.tree.get_children()
+        if not items:
+            return 'break'
+        selection = self.tree.selection()
+        position = items.index(selection[0]) + step if selection else 0
+        if position < 0:
+            self.scroll_by(-1)
+            position = 0
+        elif position >= len(items):
+            self.scroll_by(1)
+            position = len(items) - 1
+        items = self.tree.get_children()
+        self.tree.selection_set(items[position])
+        return 'break'
+
+    def _on_scrollbar(self, action, number, unit=None):
+        total = len(self.view) if self.view is not None else 0
+        if action == 'moveto':
+            self.scroll_to(int(float(number) * total))
+        elif action == 'scroll':
+            self.scroll_by(int(number) * (self.page_rows if unit == 'pages' else 1))
+
+    def refresh(self):
+        # Replaces the items on screen with the rows of the current page
+        self.tree.delete(*self.tree.get_children())
+        total = len(self.view) if self.view is not None else 0
+        if total:
+            for values in self.view.rows(self.first, self.page_rows):
+                self.tree.insert('', tk.END, values=values)
+            self.scrollbar.set(self.first / total, min(1.0, (self.first + self.page_rows) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+        if self.on_change is not None:
+            self.on_change(self.first, min(self.first + self.page_rows, total), total)
+
+def open_results_viewer(parent, datasets, title="Results"):
+    # Window listing each (label, ResultsView) of datasets, one at a time, with sorting and filtering
+    window = tk.Toplevel(parent)
+    window.title(title)
+    window.geometry("900x640")
+
+    controls = tk.Frame(window)
+    controls.pack(fill=tk.X, padx=10, pady=(10, 5))
+    tk.Label(controls, text="Show:").pack(side=tk.LEFT)
+    labels = [label for label, _ in datasets]
+    dataset_sv = tk.StringVar(value=labels[0])
+    dataset_box = ttk.Combobox(controls, textvariable=dataset_sv, values=labels, state='readonly', width=28)
+    dataset_box.pack(side=tk.LEFT, padx=5)
+    tk.Label(controls, text="Filter:").pack(side=tk.LEFT, padx=(15, 0))
+    filter_sv = tk.StringVar()
+    filter_entry = tk.Entry(controls, textvariable=filter_sv, width=30)
+    filter_entry.pack(side=tk.LEFT, padx=5)
+    position_sv = tk.StringVar()
+
+    def show_position(first, last, total):
+        position_sv.set(f"Rows {first + 1:,}-{last:,} of {total:,}" if total else "No rows")
+
+    table = ResultsTable(window, on_change=show_position)
+    table.pack(fill=tk.BOTH, expand=True, padx=10)
+    tk.Label(window, textvariable=position_sv, anchor=tk.W).pack(fill=tk.X, padx=10, pady=(0, 10))
+
+    def show_dataset(event=None):
+        view = dict(datasets)[dataset_sv.get()]
+        filter_sv.set(view.filter_text)
+        table.set_view(view)
+
+    def apply_filter(event=None):
+        table.set_filter(filter_sv.get())
+
+    def clear_filter():
+        filter_sv.set('')
+        apply_filter()
+
+    tk.Button(controls, text="Filter", command=apply_filter, width=8).pack(side=tk.LEFT, padx=2)
+    tk.Button(controls, text="Clear", command=clear_filter, width=8).pack(side=tk.LEFT, padx=2)
+    filter_entry.bind('<Return>', apply_filter)
+    dataset_box.bind('<<ComboboxSelected>>', show_dataset)
+    show_dataset()
+    table.tree.focus_set()
+    return window
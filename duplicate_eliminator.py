@@ -1,22 +1,23 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, scrolledtext, Toplevel, Frame, Label, Entry, Button, StringVar
 from tkinter import font as tkFont 
-import csv
+from tkinter import ttk
+import multiprocessing
 import os
-import pandas as pd
-import re
-from unidecode import unidecode 
-
-
-# --- Configuration Variables ---
-CONFIG = {
-    'CRM_DELIMITER': ';',
-    'CRM_LAST_NAME_COL': 'Nom',
-    'CRM_FIRST_NAME_COL': 'Prénom',
-    'NEW_RECORDS_NAME_COL': 'Nom',
-    'NEW_RECORDS_FORENAME_COL': 'Prénom',
-    'NEW_RECORDS_CSV_DELIMITER': ','
-}
+import queue
+import threading
+import time
+
+from dedup_batch import BatchScreener, list_new_records_files
+from dedup_cache import CrmIndexCache
+from dedup_engine import (
+    CONFIG, UNIQUES_FILENAME, DUPLICATES_FILENAME, IN_FILE_DUPLICATES_FILENAME, MATCH_RULE_COLUMN, InFileDuplicates, ProcessingCancelled, RunProgress,
+    parse_keep_policy, run_deduplication, write_output_file
+)
+from dedup_fuzzy import FUZZY_MATCHES_FILENAME, FuzzyMatcher, parse_fuzzy_threshold
+from dedup_report import RUN_REPORT_FILENAME, RunReport
+from dedup_rules import parse_match_rules
+from dedup_viewer import MATCHED_ID_COLUMN, ResultsView, matched_id_column, open_results_viewer
 
 
 # --- Other variables ---
@@ -26,6 +27,41 @@ APP_TITLE = "CRM Duplicate Eliminator"
 processed_uniques = []
 processed_duplicates = []
 new_records_header_global = [] # Store the header of the new records file
+duplicates_header = [] # Same, plus the matched rule column when match rules are used
+processed_possible_duplicates = [] # Fuzzy matches, saved with possible_duplicates_header
+possible_duplicates_header = []
+processed_in_file_duplicates = [] # Contacts repeated in the new records file, saved with in_file_duplicates_header
+in_file_duplicates_header = []
+last_run_report = None # RunReport of the last finished run, saved next to the output files
+results_config = None # Settings of the run whose results are shown by the results viewer
+results_rules = None
+crm_index_cache = CrmIndexCache()
+
+POLL_INTERVAL_MS = 100 # How often the worker's queue is checked
+STAGE_LABELS = {'crm': "Reading CRM file", 'new_records': "Reading new records", 'compare': "Comparing records",
+                'batch': "Screening files", 'watch': "Watching folder (files screened)"}
+
+# State of the run in progress (processing happens on a worker thread)
+current_run_progress = None
+run_queue = None
+stage_started = {}
+
+# Widgets are created by build_main_window(), so importing this module never opens a window
+root = None
+crm_file_entry = None
+new_records_file_entry = None
+status_text = None
+process_button = None
+batch_button = None
+cancel_button = None
+run_summary_tree = None
+progress_bar = None
+progress_sv = None
+save_uniques_button = None
+save_duplicates_button = None
+save_possible_duplicates_button = None
+save_in_file_duplicates_button = None
+view_results_button = None
 
 crm_delimiter_sv = None
 crm_last_name_sv = None
@@ -35,339 +71,148 @@ new_records_forename_sv = None
 new_records_csv_delimiter_sv = None
 
 
-# --- Core Logic ---
+# --- Processing (delegated to dedup_engine on a worker thread) ---
 
-def normalize_name_part(name_part):
-    # Normalize a name to allow robust comparison
-    if pd.isna(name_part) or not str(name_part).strip():
-        return ""
-    
-    s = str(name_part).strip()
-    
-    # Transliterate ("René" -> "Rene", "Müller" -> "Muller")
-    s = unidecode(s)
-    
-    # Convert to lowercase for consistent comparison
-    s = s.lower()
-    
-    # Remove all periods, commas, apostrophes, etc
-    s = re.sub(r'[^a-z0-9\s-]', '', s)
-    
-    # 4. Normalize minus uses ("Smith - Jones" -> "smith-jones")
-    s = re.sub(r'\s*-\s*', '-', s)
-    
-    # 5. Normalize spaces
-    s = re.sub(r'\s+', ' ', s)
-    
-    return s.strip() # Final strip
-
-def create_unique_id(last_name, first_name):
-    # Creates a standardized unique ID from name and forename
-    ln_normalized = normalize_name_part(last_name)
-    fn_normalized = normalize_name_part(first_name)
-
-    if ln_normalized and fn_normalized:
-        return f"{ln_normalized} {fn_normalized}"
-    elif ln_normalized: # Only last name is valid/present
-        return ln_normalized
-    elif fn_normalized: # Only first name is valid/present
-        return fn_normalized
-    else:
-        return ""
-
-def read_crm_csv_file(filepath, delimiter, expected_lastname_col, expected_firstname_col, status_widget):
-    records = []
-    unique_ids = set() # Allows to separate entries 
-    header = []
-    status_widget.insert(tk.END, f"Attempting to read CRM file: {os.path.basename(filepath)}\n")
-    status_widget.insert(tk.END, f"  Using delimiter: '{delimiter}'\n")
-    status_widget.insert(tk.END, f"  Using Last Name column: '{expected_lastname_col}'\n")
-    status_widget.insert(tk.END, f"  Using First Name column: '{expected_firstname_col}'\n")
-
-    try:
-        with open(filepath, mode='r', encoding='utf-8-sig') as file:
-            reader = csv.reader(file, delimiter=delimiter)
-            header = next(reader, None)
-            if not header:
-                return None, None, None, f"Error: CRM file '{os.path.basename(filepath)}' is empty or has no header."
-
-            normalized_header = [h.strip() for h in header]
-            try:
-                lastname_col_idx = normalized_header.index(expected_lastname_col)
-                firstname_col_idx = normalized_header.index(expected_firstname_col)
-            except ValueError:
-                err_msg = (f"Error: Required columns ('{expected_lastname_col}', '{expected_firstname_col}') not found in CRM file '{os.path.basename(filepath)}'.\n"
-                           f"Found headers: {', '.join(header)}")
-                return None, None, None, err_msg
-
-            for i, row in enumerate(reader):
-                if len(row) != len(header):
-                    status_widget.insert(tk.END, f"Warning: Row {i+2} in CRM file has incorrect columns ({len(row)} vs {len(header)} expected). Skipping.\n")
-                    continue
-                try:
-                    record_dict = dict(zip(header, row))
-                    last_name = row[lastname_col_idx]
-                    first_name = row[firstname_col_idx]
-                    
-                    unique_id = create_unique_id(last_name, first_name)
-                    if unique_id: # Only add if a valid ID could be generated
-                        records.append(record_dict)
-                        unique_ids.add(unique_id)
-                    else:
-                        status_widget.insert(tk.END, f"Warning: Row {i+2} in CRM file has empty/invalid name/forename after normalization. Skipping.\n")
-                        
-                except Exception as e:
-                    status_widget.insert(tk.END, f"Warning: Error processing row {i+2} in CRM file: {e}. Skipping.\n")
-        
-        status_widget.insert(tk.END, f"Successfully processed {len(records)} records from CRM file ({len(unique_ids)} unique IDs generated).\n")
-        return records, unique_ids, header, None
-    except FileNotFoundError:
-        return None, None, None, f"Error: CRM File not found at '{filepath}'."
-    except Exception as e:
-        return None, None, None, f"An unexpected error occurred while reading CRM file: {e}"
-
-def read_new_records_file(filepath, expected_name_col, expected_forename_col, csv_delimiter, status_widget):
-    all_records = []
-    final_header = None
-    filename = os.path.basename(filepath)
-    file_ext = os.path.splitext(filename)[1].lower()
-
-    status_widget.insert(tk.END, f"Attempting to read New Records file: {filename}\n")
-    status_widget.insert(tk.END, f"  Using Name column: '{expected_name_col}'\n")
-    status_widget.insert(tk.END, f"  Using Forename column: '{expected_forename_col}'\n")
-
-    try:
-        if file_ext in ['.xlsx', '.xls']:
-            status_widget.insert(tk.END, f"  Reading as Excel file (will process all sheets)...\n")
-            try:
-                excel_data = pd.read_excel(filepath, sheet_name=None, engine=None, dtype=str) # Read all as string at firts
-            except Exception as e_pandas_read:
-                status_widget.insert(tk.END, f"Pandas read_excel (all sheets) failed: {e_pandas_read}.\n")
-                engine_to_try = 'openpyxl' if file_ext == '.xlsx' else 'xlrd' if file_ext == '.xls' else None
-                if engine_to_try:
-                    try:
-                        status_widget.insert(tk.END, f"  Retrying with engine: {engine_to_try}...\n")
-                        excel_data = pd.read_excel(filepath, sheet_name=None, engine=engine_to_try, dtype=str)
-                    except Exception as e_engine_retry:
-                        return None, None, f"Error reading Excel '{filename}' with {engine_to_try}: {e_engine_retry}."
-                else:
-                    return None, None, f"Error reading Excel file '{filename}': {e_pandas_read}."
-            
-            if not excel_data:
-                return None, None, f"Error: Excel file '{filename}' is empty or no sheets could be read."
-
-            for sheet_name, df in excel_data.items():
-                status_widget.insert(tk.END, f"  Processing sheet: '{sheet_name}'...\n")
-                if df.empty:
-                    status_widget.insert(tk.END, f"    Sheet '{sheet_name}' is empty. Skipping.\n")
-                    continue
-                
-                df = df.fillna('') # Deals with annoying NaNs (--> empty strings)
-                current_sheet_header_orig = list(df.columns) 
-                current_sheet_header_norm = [str(h).strip() for h in current_sheet_header_orig]
-                
-                actual_sheet_name_col = expected_name_col
-                actual_sheet_forename_col = expected_forename_col
-
-                if expected_name_col not in current_sheet_header_norm or expected_forename_col not in current_sheet_header_norm:
-                    norm_expected_name = expected_name_col.lower()
-                    norm_expected_forename = expected_forename_col.lower()
-                    found_name = False
-                    found_forename = False
-                    
-                    temp_actual_name_col = None
-                    temp_actual_forename_col = None
-
-                    for idx, h_norm in enumerate(current_sheet_header_norm):
-                        if not found_name and h_norm.lower() == norm_expected_name:
-                            temp_actual_name_col = current_sheet_header_orig[idx]
-                            found_name = True
-                        if not found_forename and h_norm.lower() == norm_expected_forename:
-                            temp_actual_forename_col = current_sheet_header_orig[idx]
-                            found_forename = True
-                        if found_name and found_forename:
-                            break
-                    
-                    if found_name and found_forename:
-                        actual_sheet_name_col = temp_actual_name_col
-                        actual_sheet_forename_col = temp_actual_forename_col
-                        status_widget.insert(tk.END, f"    Note: Found '{expected_name_col}' (as '{actual_sheet_name_col}') and '{expected_forename_col}' (as '{actual_sheet_forename_col}') case-insensitively in sheet '{sheet_name}'.\n")
-                    else:
-                        status_widget.insert(tk.END, f"    Warning: Sheet '{sheet_name}' missing required columns. Skipping.\n")
-                        status_widget.insert(tk.END, f"    Expected: '{expected_name_col}', '{expected_forename_col}'. Found: {', '.join(current_sheet_header_orig)}\n")
-                        continue
-                
-                if final_header is None: # Use header from the first sheet that has the required columns
-                    final_header = [str(h) for h in current_sheet_header_orig]
-                    status_widget.insert(tk.END, f"    Using header from sheet '{sheet_name}' for output: {', '.join(final_header)}\n")
-
-                for i, row_series in df.iterrows():
-                    record_dict = {str(k): str(v) for k, v in row_series.to_dict().items()} # Ensure all values are strings
-                    name = record_dict.get(str(actual_sheet_name_col), "")
-                    forename = record_dict.get(str(actual_sheet_forename_col), "")
-                    
-                    # Check for empty name/forename before creating ID (create_unique_id handles internal emptiness)
-                    if not (str(name).strip() or str(forename).strip()):
-                        status_widget.insert(tk.END, f"    Warning: Row {i+2} in sheet '{sheet_name}' has empty name/forename fields. Skipping.\n")
-                        continue
-                    all_records.append(record_dict)
-            
-            if not all_records and final_header is None: 
-                 return None, None, f"Error: No sheet in '{filename}' contained the required columns ('{expected_name_col}', '{expected_forename_col}')."
-
-        elif file_ext == '.csv':
-            status_widget.insert(tk.END, f"  Reading as CSV file with delimiter '{csv_delimiter}'...\n")
-            with open(filepath, mode='r', encoding='utf-8-sig') as file:
-                reader = csv.reader(file, delimiter=csv_delimiter)
-                header_csv_original = next(reader, None)
-                if not header_csv_original:
-                    return None, None, f"Error: New Records CSV file '{filename}' is empty or has no header."
-                
-                final_header = [str(h) for h in header_csv_original]
-                normalized_csv_header = [h.strip() for h in final_header]
-                
-                name_col_idx, forename_col_idx = -1, -1
-                try: # Exact match first
-                    name_col_idx = normalized_csv_header.index(expected_name_col)
-                    forename_col_idx = normalized_csv_header.index(expected_forename_col)
-                except ValueError: # Case-insensitive fallback
-                    norm_expected_name = expected_name_col.lower()
-                    norm_expected_forename = expected_forename_col.lower()
-                    for idx, h_norm in enumerate(normalized_csv_header):
-                        if name_col_idx == -1 and h_norm.lower() == norm_expected_name:
-                            name_col_idx = idx
-                        if forename_col_idx == -1 and h_norm.lower() == norm_expected_forename:
-                            forename_col_idx = idx
-                        if name_col_idx != -1 and forename_col_idx != -1:
-                            status_widget.insert(tk.END, f"    Note: Used case-insensitive matching for Name/Forename columns in '{filename}'.\n")
-                            break
-                    if name_col_idx == -1 or forename_col_idx == -1:
-                        err_msg = (f"Error: Required columns not found in New Records CSV '{filename}'.\n"
-                                   f"Expected: '{expected_name_col}', '{expected_forename_col}'. Found: {', '.join(final_header)}")
-                        return None, None, err_msg
-
-                for i, row_list in enumerate(reader):
-                    if len(row_list) != len(final_header):
-                        status_widget.insert(tk.END, f"    Warning: Row {i+2} in CSV has incorrect columns ({len(row_list)} vs {len(final_header)} expected). Skipping.\n")
-                        continue
-                    record_dict = dict(zip(final_header, row_list))
-                    name = row_list[name_col_idx]
-                    forename = row_list[forename_col_idx]
-                    if not (str(name).strip() or str(forename).strip()):
-                        status_widget.insert(tk.END, f"    Warning: Row {i+2} in CSV has empty name/forename fields. Skipping.\n")
-                        continue
-                    all_records.append(record_dict)
-        else:
-            return None, None, f"Error: Unsupported file type for New Records: '{file_ext}'."
-        
-        if not all_records and final_header:
-             status_widget.insert(tk.END, f"  Processed file '{filename}', found header but no valid data rows.\n")
-        elif all_records:
-            status_widget.insert(tk.END, f"  Successfully processed {len(all_records)} records from New Records file '{filename}'.\n")
-        
-        if not final_header and not all_records: # This case means no sheets had headers/data or CSV was empty
-            return None, None, f"Error: Could not determine a header or find any records in '{filename}' that meet criteria."
-        
-        return all_records, final_header, None
-        
-    except FileNotFoundError:
-        return None, None, f"Error: New Records file not found at '{filepath}'."
-    except Exception as e:
-        return None, None, f"An unexpected error occurred while reading New Records file '{filename}': {e}"
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
 
 def process_files():
-    global processed_uniques, processed_duplicates, new_records_header_global
+    # Starts a run on a worker thread; results come back through run_queue (see poll_run_queue)
+    global processed_uniques, processed_duplicates, new_records_header_global, current_run_progress, run_queue
+    global processed_possible_duplicates, possible_duplicates_header, processed_in_file_duplicates, in_file_duplicates_header, results_config
     processed_uniques = []
     processed_duplicates = []
     new_records_header_global = []
+    processed_possible_duplicates, possible_duplicates_header = [], []
+    processed_in_file_duplicates, in_file_duplicates_header = [], []
+    enable_save_buttons(False)
+    show_run_summary(None)
 
     crm_filepath = crm_file_entry.get()
     new_records_filepath = new_records_file_entry.get()
 
     status_text.config(state=tk.NORMAL)
     status_text.delete('1.0', tk.END)
+    status_text.config(state=tk.DISABLED)
 
-    if not crm_filepath or not new_records_filepath:
-        status_text.insert(tk.END, "Error: Both CRM export file and New Records file must be selected.\n")
-        status_text.config(state=tk.DISABLED)
-        enable_save_buttons(False)
-        return
+    # Tk widgets must only be touched by the main thread: the worker only writes to the queue
+    run_queue = queue.Queue()
+    worker_queue = run_queue
+    current_run_progress = run_progress = RunProgress(lambda stage, done, total, rows: worker_queue.put(('progress', stage, done, total, rows)))
+    run_config = dict(CONFIG) # Options changed during the run apply to the next one
+    results_config = run_config
+    stage_started.clear()
+    fuzzy_threshold, threshold_error = parse_fuzzy_threshold(run_config['FUZZY_THRESHOLD'])
+    fuzzy = FuzzyMatcher(fuzzy_threshold) if fuzzy_threshold else None
+    keep_policy, policy_error = parse_keep_policy(run_config['IN_FILE_DUPLICATES_KEEP'])
+    in_file = InFileDuplicates(keep_policy) if keep_policy else None
+    rules, rules_error = parse_match_rules(run_config['MATCH_RULES'])
+    config_error = threshold_error or policy_error or rules_error
+    run_report = RunReport()
+    run_report.info.update({'crm_file': crm_filepath, 'new_records_file': new_records_filepath, 'mode': 'batch', 'config': run_config})
+
+    def worker():
+        if config_error:
+            worker_queue.put(('done', (None, None, None, config_error), None, None, None, None))
+            return
+        try:
+            result = run_deduplication(crm_filepath, new_records_filepath, run_config,
+                                       lambda message: worker_queue.put(('log', message)),
+                                       crm_index_cache, progress=run_progress, fuzzy=fuzzy, in_file=in_file, rules=rules, run_report=run_report)
+        except Exception as e:
+            result = (None, None, None, f"An unexpected error occurred during processing: {e}")
+        worker_queue.put(('done', result, fuzzy, in_file, rules, run_report))
+
+    process_button.config(state=tk.DISABLED)
+    batch_button.config(state=tk.DISABLED)
+    cancel_button.config(state=tk.NORMAL)
+    progress_bar.config(value=0)
+    progress_sv.set("Starting...")
+    threading.Thread(target=worker, daemon=True).start()
+    root.after(POLL_INTERVAL_MS, poll_run_queue)
+
+def cancel_processing():
+    if current_run_progress is not None:
+        current_run_progress.cancel()
+        cancel_button.config(state=tk.DISABLED)
+        progress_sv.set("Cancelling...")
+
+def update_progress(stage, done, total, rows):
+    now = time.monotonic()
+    started = stage_started.setdefault(stage, now)
+    elapsed = now - started
+    text = STAGE_LABELS.get(stage, stage)
+    if total:
+        fraction = min(done / total, 1.0)
+        progress_bar.config(mode='determinate', value=fraction * 100)
+        text += f" - {fraction:.0%}"
+        if 0 < fraction < 1 and elapsed > 0:
+            text += f" - ETA {format_duration(elapsed * (1 - fraction) / fraction)}"
+    if rows and elapsed > 0:
+        text += f" - {rows / elapsed:,.0f} rows/s"
+    progress_sv.set(text)
+
+def poll_run_queue():
+    messages = []
+    result = None
+    fuzzy = in_file = rules = run_report = None
+    batch_result = None
+    while True:
+        try:
+            item = run_queue.get_nowait()
+        except queue.Empty:
+            break
+        if item[0] == 'log':
+            messages.append(item[1])
+        elif item[0] == 'progress':
+            update_progress(*item[1:])
+        elif item[0] == 'done':
+            result, fuzzy, in_file, rules, run_report = item[1:]
+        elif item[0] == 'batch_done':
+            batch_result = item[1:]
+
+    if messages: # One insert per poll instead of one per message
+        status_text.config(state=tk.NORMAL)
+        status_text.insert(tk.END, ''.join(messages))
+        status_text.config(state=tk.DISABLED); status_text.see(tk.END)
 
-    # --- Use current CONFIG values ---
-    current_crm_delimiter = CONFIG['CRM_DELIMITER']
-    current_crm_last_name = CONFIG['CRM_LAST_NAME_COL']
-    current_crm_first_name = CONFIG['CRM_FIRST_NAME_COL']
-    current_new_records_name = CONFIG['NEW_RECORDS_NAME_COL']
-    current_new_records_forename = CONFIG['NEW_RECORDS_FORENAME_COL']
-    current_new_records_csv_delimiter = CONFIG['NEW_RECORDS_CSV_DELIMITER']
-
-    # --- Read CRM File ---
-    status_text.insert(tk.END, f"Processing CRM file: {os.path.basename(crm_filepath)}...\n")
-    _, crm_unique_ids, _, crm_error = read_crm_csv_file(
-        crm_filepath, current_crm_delimiter, current_crm_last_name, current_crm_first_name, status_text
-    )
-    if crm_error:
-        status_text.insert(tk.END, crm_error + "\n")
-        status_text.config(state=tk.DISABLED); enable_save_buttons(False); return
-    if crm_unique_ids is None: 
-        status_text.insert(tk.END, "Critical error reading CRM file (crm_unique_ids is None).\n")
-        status_text.config(state=tk.DISABLED); enable_save_buttons(False); return
-    status_text.insert(tk.END, f"Found {len(crm_unique_ids)} unique IDs in CRM file.\n" if crm_unique_ids else f"Warning: CRM file yielded no unique IDs to compare against.\n")
-
-    # --- Read New Records File ---
-    status_text.insert(tk.END, f"\nProcessing New Records file: {os.path.basename(new_records_filepath)}...\n")
-    new_records_list, header_from_new_file, new_records_error = read_new_records_file(
-        new_records_filepath, current_new_records_name, current_new_records_forename, current_new_records_csv_delimiter, status_text
-    )
-    if new_records_error:
-        status_text.insert(tk.END, new_records_error + "\n")
-        status_text.config(state=tk.DISABLED); enable_save_buttons(False); return
-    
-    new_records_header_global = header_from_new_file 
-    if not new_records_header_global:
-        status_text.insert(tk.END, f"Critical Error: No valid header could be determined from New Records file. Cannot compare or save.\n")
-        status_text.config(state=tk.DISABLED); enable_save_buttons(False); return
-    
-    status_text.insert(tk.END, f"Using header for New Records: {', '.join(map(str,new_records_header_global))}\n")
-    
-    if not new_records_list: # Check if list is empty after successful header read
-        status_text.insert(tk.END, "Warning: New Records file has a valid header but contains no data rows to process.\n")
+    if batch_result is not None:
+        finish_batch(*batch_result)
+    elif result is None:
+        root.after(POLL_INTERVAL_MS, poll_run_queue)
     else:
-        status_text.insert(tk.END, f"Total records to process from New Records file: {len(new_records_list)}\n")
-
+        finish_processing(*result, fuzzy, in_file, rules, run_report)
+
+def finish_processing(uniques, duplicates, header, error, fuzzy=None, in_file=None, rules=None, run_report=None):
+    global processed_uniques, processed_duplicates, new_records_header_global, duplicates_header, current_run_progress
+    global processed_possible_duplicates, possible_duplicates_header, processed_in_file_duplicates, in_file_duplicates_header
+    global last_run_report, results_rules
+    current_run_progress = None
+    last_run_report = run_report if not error else None
+    show_run_summary(last_run_report)
+    process_button.config(state=tk.NORMAL)
+    batch_button.config(state=tk.NORMAL)
+    cancel_button.config(state=tk.DISABLED)
 
-    # --- Comparison Logic ---
-    status_text.insert(tk.END, "\nComparing records...\n")
-    
-    normalized_global_header_map = {str(h).strip().lower(): str(h) for h in new_records_header_global}
-    actual_name_col_in_header = normalized_global_header_map.get(current_new_records_name.lower())
-    actual_forename_col_in_header = normalized_global_header_map.get(current_new_records_forename.lower())
-
-    if not actual_name_col_in_header or not actual_forename_col_in_header:
-        status_text.insert(tk.END, f"Critical Error: Configured Name/Forename columns ('{current_new_records_name}', '{current_new_records_forename}') not found in determined New Records header after normalization. Cannot compare.\n")
-        status_text.insert(tk.END, f"Determined header: {', '.join(new_records_header_global)}\n")
-        status_text.insert(tk.END, f"Normalized map: {normalized_global_header_map}\n")
-        status_text.config(state=tk.DISABLED); enable_save_buttons(False); return
-
-    for idx, record_dict in enumerate(new_records_list):
-        name_val = record_dict.get(actual_name_col_in_header, "")
-        forename_val = record_dict.get(actual_forename_col_in_header, "")
-        
-        current_id = create_unique_id(name_val, forename_val)
-        if not current_id: 
-            status_text.insert(tk.END, f"Warning: Skipping record (row {idx+2} approx, ID empty after normalization): { {actual_name_col_in_header: name_val, actual_forename_col_in_header: forename_val} }\n")
-            continue
-
-        if crm_unique_ids is not None and current_id in crm_unique_ids:
-            processed_duplicates.append(record_dict)
-        else:
-            processed_uniques.append(record_dict)
-
-    status_text.insert(tk.END, f"\n--- Processing Complete ---\n")
-    status_text.insert(tk.END, f"Unique new contacts to import: {len(processed_uniques)}\n")
-    status_text.insert(tk.END, f"Duplicate contacts found (for review): {len(processed_duplicates)}\n")
-    
-    if new_records_header_global and (processed_uniques or processed_duplicates):
+    status_text.config(state=tk.NORMAL)
+    if error:
+        progress_sv.set("Cancelled." if error == "Processing cancelled." else "Failed.")
+        status_text.insert(tk.END, error + "\n")
+        status_text.config(state=tk.DISABLED); status_text.see(tk.END); enable_save_buttons(False); return
+
+    progress_bar.config(value=100)
+    progress_sv.set("Done.")
+    processed_uniques, processed_duplicates, new_records_header_global = uniques, duplicates, header
+    duplicates_header = list(header) + [MATCH_RULE_COLUMN] if rules is not None and header else header
+    results_rules = rules
+    if fuzzy is not None and header:
+        processed_possible_duplicates, possible_duplicates_header = fuzzy.output_records(header)
+    if in_file is not None and header:
+        processed_in_file_duplicates, in_file_duplicates_header = in_file.output_records(header)
+
+    if new_records_header_global and (processed_uniques or processed_duplicates or processed_possible_duplicates):
         enable_save_buttons(True)
     else:
         enable_save_buttons(False)
@@ -378,11 +223,124 @@ def process_files():
 
     status_text.config(state=tk.DISABLED); status_text.see(tk.END)
 
+def process_batch(crm_filepath, paths, output_dir, cumulative, watch):
+    # Screens several new records files against one CRM index on a worker thread (see dedup_batch)
+    global current_run_progress, run_queue
+    status_text.config(state=tk.NORMAL)
+    status_text.delete('1.0', tk.END)
+    status_text.config(state=tk.DISABLED)
+    show_run_summary(None)
+
+    run_queue = queue.Queue()
+    worker_queue = run_queue
+    current_run_progress = run_progress = RunProgress(lambda stage, done, total, rows: worker_queue.put(('progress', stage, done, total, rows)))
+    run_config = dict(CONFIG)
+    stage_started.clear()
+    fuzzy_threshold, threshold_error = parse_fuzzy_threshold(run_config['FUZZY_THRESHOLD'])
+    keep_policy, policy_error = parse_keep_policy(run_config['IN_FILE_DUPLICATES_KEEP'])
+    rules, rules_error = parse_match_rules(run_config['MATCH_RULES'])
+    config_error = threshold_error or policy_error or rules_error
+
+    def worker():
+        if config_error:
+            worker_queue.put(('batch_done', '', config_error))
+            return
+        screener = BatchScreener(crm_filepath, output_dir, run_config, lambda message: worker_queue.put(('log', message)), crm_index_cache, 0,
+                                 FuzzyMatcher(fuzzy_threshold) if fuzzy_threshold else None, keep_policy, rules, cumulative)
+        error = None
+        try:
+            error = screener.load_index(run_progress)
+            if not error:
+                if watch:
+                    screener.watch(paths[0], run_progress)
+                else:
+                    screener.process_files(list_new_records_files(paths), run_progress)
+        except ProcessingCancelled:
+            error = None if watch else "Processing cancelled." # Cancel is how watching stops
+        except Exception as e:
+            error = f"An unexpected error occurred during batch processing: {e}"
+        save_error = screener.write_summary() if screener.summary else None
+        worker_queue.put(('batch_done', screener.summary_text() if screener.summary else '', error or save_error))
+
+    process_button.config(state=tk.DISABLED)
+    batch_button.config(state=tk.DISABLED)
+    cancel_button.config(state=tk.NORMAL)
+    progress_bar.config(value=0)
+    progress_sv.set("Starting...")
+    threading.Thread(target=worker, daemon=True).start()
+    root.after(POLL_INTERVAL_MS, poll_run_queue)
+
+def finish_batch(summary_text, error):
+    global current_run_progress
+    current_run_progress = None
+    process_button.config(state=tk.NORMAL)
+    batch_button.config(state=tk.NORMAL)
+    cancel_button.config(state=tk.DISABLED)
+    progress_bar.config(value=0 if error else 100)
+    progress_sv.set("Cancelled." if error == "Processing cancelled." else "Failed." if error else "Done.")
+    status_text.config(state=tk.NORMAL)
+    if summary_text:
+        status_text.insert(tk.END, "\n--- Batch Summary ---\n" + summary_text)
+    if error:
+        status_text.insert(tk.END, error + "\n")
+    status_text.config(state=tk.DISABLED); status_text.see(tk.END)
+
 # --- UI Functions ---
+def open_batch_window():
+    if current_run_progress is not None:
+        return # A run is already in progress
+    crm_filepath = crm_file_entry.get()
+    if not crm_filepath:
+        messagebox.showerror("Error", "Select the CRM export first."); return
+
+    batch_win = Toplevel(root)
+    batch_win.title("Batch Processing")
+    batch_win.geometry("560x210")
+    batch_win.transient(root)
+    batch_win.grab_set()
+
+    main_frame = Frame(batch_win, padx=10, pady=10)
+    main_frame.pack(fill=tk.BOTH, expand=True)
+    input_sv = StringVar()
+    output_sv = StringVar()
+    cumulative_bv = tk.BooleanVar(value=False)
+    watch_bv = tk.BooleanVar(value=False)
+
+    def browse_folder(variable, title):
+        folder = filedialog.askdirectory(title=title, parent=batch_win)
+        if folder:
+            variable.set(folder)
+            if variable is input_sv and not output_sv.get():
+                output_sv.set(os.path.join(folder, "deduplicated"))
+
+    Label(main_frame, text="New Records Folder:").grid(row=0, column=0, sticky=tk.W, pady=2)
+    Entry(main_frame, textvariable=input_sv, width=40).grid(row=0, column=1, sticky=tk.EW, padx=5, pady=2)
+    Button(main_frame, text="Browse", command=lambda: browse_folder(input_sv, "Select New Records Folder")).grid(row=0, column=2, pady=2)
+    Label(main_frame, text="Output Folder:").grid(row=1, column=0, sticky=tk.W, pady=2)
+    Entry(main_frame, textvariable=output_sv, width=40).grid(row=1, column=1, sticky=tk.EW, padx=5, pady=2)
+    Button(main_frame, text="Browse", command=lambda: browse_folder(output_sv, "Select Output Folder")).grid(row=1, column=2, pady=2)
+    tk.Checkbutton(main_frame, text="Contacts accepted from earlier files count as duplicates", variable=cumulative_bv).grid(row=2, column=0, columnspan=3, sticky=tk.W)
+    tk.Checkbutton(main_frame, text="Keep watching the folder for new files (stop with Cancel)", variable=watch_bv).grid(row=3, column=0, columnspan=3, sticky=tk.W)
+    main_frame.columnconfigure(1, weight=1)
+
+    def start_batch():
+        folder, output_dir = input_sv.get(), output_sv.get()
+        if not os.path.isdir(folder) or not output_dir:
+            messagebox.showerror("Error", "Select an existing new records folder and an output folder.", parent=batch_win); return
+        if not watch_bv.get() and not list_new_records_files([folder]):
+            messagebox.showerror("Error", "No Excel or CSV files in this folder.", parent=batch_win); return
+        batch_win.destroy()
+        process_batch(crm_filepath, [folder], output_dir, cumulative_bv.get(), watch_bv.get())
+
+    button_frame = Frame(main_frame)
+    button_frame.grid(row=4, column=0, columnspan=3, pady=10, sticky=tk.E)
+    Button(button_frame, text="Start", command=start_batch, width=10, bg="#ABEBC6").pack(side=tk.LEFT, padx=5)
+    Button(button_frame, text="Cancel", command=batch_win.destroy, width=10).pack(side=tk.LEFT)
+
 def open_options_window():
     options_win = Toplevel(root)
     options_win.title("Configuration Options")
-    options_win.geometry("450x300")
+    options_win.geometry("500x390")
     options_win.transient(root) 
     options_win.grab_set() 
 
@@ -397,7 +355,10 @@ def open_options_window():
         ("CRM First Name Column:", 'CRM_FIRST_NAME_COL'),
         ("New Records Name Column:", 'NEW_RECORDS_NAME_COL'),
         ("New Records Forename Column:", 'NEW_RECORDS_FORENAME_COL'),
-        ("New Records CSV Delimiter:", 'NEW_RECORDS_CSV_DELIMITER')
+        ("New Records CSV Delimiter:", 'NEW_RECORDS_CSV_DELIMITER'),
+        ("Match Rules (empty = names only):", 'MATCH_RULES'),
+        ("Keep In-File Duplicate (first/last/most_filled/none):", 'IN_FILE_DUPLICATES_KEEP'),
+        ("Fuzzy Match Threshold (empty = off):", 'FUZZY_THRESHOLD')
     ]
 
     for i, (label_text, key) in enumerate(fields):
@@ -437,6 +398,8 @@ def update_main_window_info_labels():
 
 
 def browse_file(entry_widget, title="Select File", filetypes=(("All files", "*.*"),)):
+    if current_run_progress is not None:
+        return # Inputs can't change while a run is in progress
     filepath = filedialog.askopenfilename(title=title, filetypes=filetypes)
     if filepath:
         entry_widget.config(state=tk.NORMAL)
@@ -448,13 +411,34 @@ def browse_file(entry_widget, title="Select File", filetypes=(("All files", "*.*
         status_text.insert(tk.END, "Files selected.\n")
         status_text.config(state=tk.DISABLED)
         enable_save_buttons(False)
-        global processed_uniques, processed_duplicates, new_records_header_global
+        global processed_uniques, processed_duplicates, new_records_header_global, processed_possible_duplicates, processed_in_file_duplicates
         processed_uniques, processed_duplicates, new_records_header_global = [], [], []
+        processed_possible_duplicates, processed_in_file_duplicates = [], []
+
+def show_run_summary(run_report):
+    # Fills the run summary table with the stages of run_report (None clears it)
+    run_summary_tree.delete(*run_summary_tree.get_children())
+    if run_report is not None:
+        for row in run_report.table_rows():
+            run_summary_tree.insert('', tk.END, values=row)
+
+def save_run_report(directory):
+    # Writes the last run's report next to a saved output file; failures are only logged
+    if last_run_report is None:
+        return
+    save_error = last_run_report.write(os.path.join(directory, RUN_REPORT_FILENAME))
+    if save_error:
+        status_text.config(state=tk.NORMAL)
+        status_text.insert(tk.END, save_error + "\n")
+        status_text.config(state=tk.DISABLED); status_text.see(tk.END)
 
 def enable_save_buttons(enable=True):
     state = tk.NORMAL if enable else tk.DISABLED
+    view_results_button.config(state=state)
     save_uniques_button.config(state=state)
     save_duplicates_button.config(state=state)
+    save_possible_duplicates_button.config(state=state)
+    save_in_file_duplicates_button.config(state=state)
 
 def save_output_file(data_to_save, header_row, default_filename, title="Save CSV File"):
     if not header_row:
@@ -467,102 +451,139 @@ def save_output_file(data_to_save, header_row, default_filename, title="Save CSV
 
     filepath = filedialog.asksaveasfilename(
         defaultextension=".csv", initialfile=default_filename,
-        filetypes=(("CSV files", "*.csv"), ("All files", "*.*")), title=title
+        filetypes=(("CSV files", "*.csv"), ("Parquet files", "*.parquet"), ("All files", "*.*")), title=title
     )
     if not filepath: return
 
-    try:
-        with open(filepath, mode='w', newline='', encoding='utf-8') as file:
-            # Ensure all header elements are strings
-            str_header_row = [str(h) for h in header_row]
-            writer = csv.DictWriter(file, fieldnames=str_header_row, delimiter=',', extrasaction='ignore')
-            writer.writeheader()
-            for row_dict in data_to_save:
-                # Ensure all keys and values in the row are strings for DictWriter
-                stringified_row = {str(k): str(v) if pd.notna(v) else "" for k, v in row_dict.items()}
-                # Filter row to only include keys present in the header to avoid DictWriter errors
-                filtered_row = {h_key: stringified_row.get(h_key, "") for h_key in str_header_row}
-                writer.writerow(filtered_row)
-        messagebox.showinfo("Success", f"File saved: {os.path.basename(filepath)}")
+    save_error = write_output_file(filepath, data_to_save, header_row)
+    if save_error:
+        messagebox.showerror("Error Saving File", save_error)
         status_text.config(state=tk.NORMAL)
-        status_text.insert(tk.END, f"Saved: {os.path.basename(filepath)}\n")
-        status_text.config(state=tk.DISABLED); status_text.see(tk.END)
-    except Exception as e:
-        messagebox.showerror("Error Saving File", f"Error saving '{os.path.basename(filepath)}': {e}")
-        status_text.config(state=tk.NORMAL)
-        status_text.insert(tk.END, f"Error saving {os.path.basename(filepath)}: {e}\n")
+        status_text.insert(tk.END, save_error + "\n")
         status_text.config(state=tk.DISABLED); status_text.see(tk.END)
+        return
+    save_run_report(os.path.dirname(filepath))
+    messagebox.showinfo("Success", f"File saved: {os.path.basename(filepath)}")
+    status_text.config(state=tk.NORMAL)
+    status_text.insert(tk.END, f"Saved: {os.path.basename(filepath)}\n")
+    status_text.config(state=tk.DISABLED); status_text.see(tk.END)
 
-# --- TKINTER base Setup ---
-root = tk.Tk()
-root.title(APP_TITLE)
-root.geometry("700x800") 
-
-crm_delimiter_sv = StringVar(value=CONFIG['CRM_DELIMITER'])
-crm_last_name_sv = StringVar(value=CONFIG['CRM_LAST_NAME_COL'])
-crm_first_name_sv = StringVar(value=CONFIG['CRM_FIRST_NAME_COL'])
-new_records_name_sv = StringVar(value=CONFIG['NEW_RECORDS_NAME_COL'])
-new_records_forename_sv = StringVar(value=CONFIG['NEW_RECORDS_FORENAME_COL'])
-new_records_csv_delimiter_sv = StringVar(value=CONFIG['NEW_RECORDS_CSV_DELIMITER'])
-
-file_frame = tk.LabelFrame(root, text="Select Input Files", padx=10, pady=10)
-file_frame.pack(fill=tk.X, padx=10, pady=5)
-file_frame.columnconfigure(1, weight=1) 
-tk.Label(file_frame, text="CRM Export (CSV):").grid(row=0, column=0, sticky=tk.W, padx=5, pady=3)
-crm_file_entry = tk.Entry(file_frame, width=55, state=tk.DISABLED) 
-crm_file_entry.grid(row=0, column=1, sticky=tk.EW, padx=5, pady=3) 
-tk.Button(file_frame, text="Select database",  width=15, command=lambda: browse_file(crm_file_entry, "Select CRM CSV", (("CSV files", "*.csv"), ("All files", "*.*")))).grid(row=0, column=2, padx=5, pady=3)
-tk.Label(file_frame, text="New Records (Excel/CSV):").grid(row=1, column=0, sticky=tk.W, padx=5, pady=3)
-new_records_file_entry = tk.Entry(file_frame, width=55, state=tk.DISABLED) 
-new_records_file_entry.grid(row=1, column=1, sticky=tk.EW, padx=5, pady=3) 
-tk.Button(file_frame, text="Select new records", width=15, command=lambda: browse_file(new_records_file_entry, "Select New Records File", (("Excel files", "*.xlsx *.xls"), ("CSV files", "*.csv"), ("All files", "*.*")))).grid(row=1, column=2, padx=5, pady=3)
-
-info_frame = tk.LabelFrame(root, text="Current Input Files Configuration", padx=10, pady=10)
-info_frame.pack(fill=tk.X, padx=10, pady=5)
-
-monospace_font = tkFont.Font(family="Courier New", size=11)
-
-
-new_records_info_subframe = Frame(info_frame)
-new_records_info_subframe.pack(fill=tk.X, anchor=tk.W)
-Label(info_frame, text="CRM File     --->      LAST NAME: '", font=monospace_font).pack(side=tk.LEFT, anchor=tk.W)
-Label(info_frame, textvariable=crm_last_name_sv, font=monospace_font).pack(side=tk.LEFT, anchor=tk.W)
-Label(info_frame, text="'     FIRST NAME: '",font=monospace_font).pack(side=tk.LEFT, anchor=tk.W)
-Label(info_frame, textvariable=crm_first_name_sv, font=monospace_font).pack(side=tk.LEFT, anchor=tk.W)
-Label(info_frame, text="'     DELIMITER: '",font=monospace_font).pack(side=tk.LEFT, anchor=tk.W)
-Label(info_frame, textvariable=crm_delimiter_sv,font=monospace_font).pack(side=tk.LEFT, anchor=tk.W)
-
-Label(info_frame, text="'").pack(side=tk.LEFT, anchor=tk.W)
-
-Label(new_records_info_subframe, text="New Records  --->      LAST NAME: '",font=monospace_font).pack(side=tk.LEFT, anchor=tk.W)
-Label(new_records_info_subframe, textvariable=new_records_name_sv,font=monospace_font).pack(side=tk.LEFT, anchor=tk.W)
-Label(new_records_info_subframe, text="'     FIRST NAME: '",font=monospace_font).pack(side=tk.LEFT, anchor=tk.W)
-Label(new_records_info_subframe, textvariable=new_records_forename_sv,font=monospace_font).pack(side=tk.LEFT, anchor=tk.W)
-Label(new_records_info_subframe, text="'     DELIMITER: '",font=monospace_font).pack(side=tk.LEFT, anchor=tk.W)
-Label(new_records_info_subframe, textvariable=new_records_csv_delimiter_sv,font=monospace_font).pack(side=tk.LEFT, anchor=tk.W)
-Label(new_records_info_subframe, text="'",font=monospace_font).pack(side=tk.LEFT, anchor=tk.W)
-
-
-action_buttons_frame = Frame(root)
-action_buttons_frame.pack(pady=10)
-process_button = tk.Button(action_buttons_frame, text="Process Files", command=process_files, font=('Arial', 12, 'bold'), bg="#AED6F1", width=20, pady=5)
-process_button.pack(side=tk.LEFT, padx=5)
-options_button = tk.Button(action_buttons_frame, text="Options", command=open_options_window, width=15, pady=5)
-options_button.pack(side=tk.LEFT, padx=5)
-
-status_frame = tk.LabelFrame(root, text="Status & Messages", padx=10, pady=10)
-status_frame.pack(pady=5, padx=10, fill=tk.BOTH, expand=True)
-status_text = scrolledtext.ScrolledText(status_frame, height=12, width=80, state=tk.DISABLED, wrap=tk.WORD, relief=tk.SOLID, borderwidth=1)
-status_text.pack(pady=5, padx=5, fill=tk.BOTH, expand=True)
-
-save_frame = tk.LabelFrame(root, text="Save Output Files", padx=10, pady=10)
-save_frame.pack(fill=tk.X, padx=10, pady=(5,10))
-save_uniques_button = tk.Button(save_frame, text="Save Unique Contacts (CSV)", command=lambda: save_output_file(processed_uniques, new_records_header_global, "contacts_to_import.csv", "Save Unique Contacts"), state=tk.DISABLED, width=30, bg="#ABEBC6")
-save_uniques_button.pack(side=tk.LEFT, padx=10, pady=5, expand=True)
-save_duplicates_button = tk.Button(save_frame, text="Save Duplicates for Review (CSV)", command=lambda: save_output_file(processed_duplicates, new_records_header_global, "duplicates_to_review.csv", "Save Duplicates for Review"), state=tk.DISABLED, width=30, bg="#FAD7A0")
-save_duplicates_button.pack(side=tk.RIGHT, padx=10, pady=5, expand=True)
+def view_results():
+    # Opens the results viewer on the lists of the last run (shown in place, never copied)
+    matched_id = matched_id_column(new_records_header_global, results_config, results_rules)
+    datasets = [
+        ("Unique contacts", ResultsView(processed_uniques, new_records_header_global)),
+        ("Duplicates for review", ResultsView(processed_duplicates, duplicates_header, {MATCHED_ID_COLUMN: matched_id} if matched_id else None)),
+    ]
+    if processed_possible_duplicates:
+        datasets.append(("Possible duplicates", ResultsView(processed_possible_duplicates, possible_duplicates_header)))
+    if processed_in_file_duplicates:
+        datasets.append(("Repeated contacts", ResultsView(processed_in_file_duplicates, in_file_duplicates_header)))
+    open_results_viewer(root, datasets, f"{APP_TITLE} - Results")
 
-if __name__ == "__main__":
+# --- TKINTER base Setup ---
+def build_main_window():
+    global root, crm_file_entry, new_records_file_entry, status_text, save_uniques_button, save_duplicates_button, save_possible_duplicates_button
+    global save_in_file_duplicates_button, view_results_button
+    global process_button, batch_button, cancel_button, progress_bar, progress_sv, run_summary_tree
+    global crm_delimiter_sv, crm_last_name_sv, crm_first_name_sv, new_records_name_sv, new_records_forename_sv, new_records_csv_delimiter_sv
+    root = tk.Tk()
+    root.title(APP_TITLE)
+    root.geometry("700x960") 
+
+    crm_delimiter_sv = StringVar(value=CONFIG['CRM_DELIMITER'])
+    crm_last_name_sv = StringVar(value=CONFIG['CRM_LAST_NAME_COL'])
+    crm_first_name_sv = StringVar(value=CONFIG['CRM_FIRST_NAME_COL'])
+    new_records_name_sv = StringVar(value=CONFIG['NEW_RECORDS_NAME_COL'])
+    new_records_forename_sv = StringVar(value=CONFIG['NEW_RECORDS_FORENAME_COL'])
+    new_records_csv_delimiter_sv = StringVar(value=CONFIG['NEW_RECORDS_CSV_DELIMITER'])
+
+    file_frame = tk.LabelFrame(root, text="Select Input Files", padx=10, pady=10)
+    file_frame.pack(fill=tk.X, padx=10, pady=5)
+    file_frame.columnconfigure(1, weight=1) 
+    tk.Label(file_frame, text="CRM Export (CSV):").grid(row=0, column=0, sticky=tk.W, padx=5, pady=3)
+    crm_file_entry = tk.Entry(file_frame, width=55, state=tk.DISABLED) 
+    crm_file_entry.grid(row=0, column=1, sticky=tk.EW, padx=5, pady=3) 
+    tk.Button(file_frame, text="Select database",  width=15, command=lambda: browse_file(crm_file_entry, "Select CRM CSV", (("CSV files", "*.csv"), ("Parquet files", "*.parquet"), ("All files", "*.*")))).grid(row=0, column=2, padx=5, pady=3)
+    tk.Label(file_frame, text="New Records (Excel/CSV):").grid(row=1, column=0, sticky=tk.W, padx=5, pady=3)
+    new_records_file_entry = tk.Entry(file_frame, width=55, state=tk.DISABLED) 
+    new_records_file_entry.grid(row=1, column=1, sticky=tk.EW, padx=5, pady=3) 
+    tk.Button(file_frame, text="Select new records", width=15, command=lambda: browse_file(new_records_file_entry, "Select New Records File", (("Excel files", "*.xlsx *.xls"), ("CSV files", "*.csv"), ("Parquet files", "*.parquet"), ("All files", "*.*")))).grid(row=1, column=2, padx=5, pady=3)
+
+    info_frame = tk.LabelFrame(root, text="Current Input Files Configuration", padx=10, pady=10)
+    info_frame.pack(fill=tk.X, padx=10, pady=5)
+
+    monospace_font = tkFont.Font(family="Courier New", size=11)
+
+
+    new_records_info_subframe = Frame(info_frame)
+    new_records_info_subframe.pack(fill=tk.X, anchor=tk.W)
+    Label(info_frame, text="CRM File     --->      LAST NAME: '", font=monospace_font).pack(side=tk.LEFT, anchor=tk.W)
+    Label(info_frame, textvariable=crm_last_name_sv, font=monospace_font).pack(side=tk.LEFT, anchor=tk.W)
+    Label(info_frame, text="'     FIRST NAME: '",font=monospace_font).pack(side=tk.LEFT, anchor=tk.W)
+    Label(info_frame, textvariable=crm_first_name_sv, font=monospace_font).pack(side=tk.LEFT, anchor=tk.W)
+    Label(info_frame, text="'     DELIMITER: '",font=monospace_font).pack(side=tk.LEFT, anchor=tk.W)
+    Label(info_frame, textvariable=crm_delimiter_sv,font=monospace_font).pack(side=tk.LEFT, anchor=tk.W)
+
+    Label(info_frame, text="'").pack(side=tk.LEFT, anchor=tk.W)
+
+    Label(new_records_info_subframe, text="New Records  --->      LAST NAME: '",font=monospace_font).pack(side=tk.LEFT, anchor=tk.W)
+    Label(new_records_info_subframe, textvariable=new_records_name_sv,font=monospace_font).pack(side=tk.LEFT, anchor=tk.W)
+    Label(new_records_info_subframe, text="'     FIRST NAME: '",font=monospace_font).pack(side=tk.LEFT, anchor=tk.W)
+    Label(new_records_info_subframe, textvariable=new_records_forename_sv,font=monospace_font).pack(side=tk.LEFT, anchor=tk.W)
+    Label(new_records_info_subframe, text="'     DELIMITER: '",font=monospace_font).pack(side=tk.LEFT, anchor=tk.W)
+    Label(new_records_info_subframe, textvariable=new_records_csv_delimiter_sv,font=monospace_font).pack(side=tk.LEFT, anchor=tk.W)
+    Label(new_records_info_subframe, text="'",font=monospace_font).pack(side=tk.LEFT, anchor=tk.W)
+
+
+    action_buttons_frame = Frame(root)
+    action_buttons_frame.pack(pady=10)
+    process_button = tk.Button(action_buttons_frame, text="Process Files", command=process_files, font=('Arial', 12, 'bold'), bg="#AED6F1", width=20, pady=5)
+    process_button.pack(side=tk.LEFT, padx=5)
+    options_button = tk.Button(action_buttons_frame, text="Options", command=open_options_window, width=15, pady=5)
+    options_button.pack(side=tk.LEFT, padx=5)
+    batch_button = tk.Button(action_buttons_frame, text="Batch...", command=open_batch_window, width=15, pady=5)
+    batch_button.pack(side=tk.LEFT, padx=5)
+    cancel_button = tk.Button(action_buttons_frame, text="Cancel", command=cancel_processing, state=tk.DISABLED, width=15, pady=5)
+    cancel_button.pack(side=tk.LEFT, padx=5)
+
+    progress_frame = Frame(root)
+    progress_frame.pack(fill=tk.X, padx=10)
+    progress_bar = ttk.Progressbar(progress_frame, orient=tk.HORIZONTAL, mode='determinate', maximum=100)
+    progress_bar.pack(fill=tk.X)
+    progress_sv = StringVar(value="")
+    Label(progress_frame, textvariable=progress_sv, anchor=tk.W).pack(fill=tk.X)
+
+    summary_frame = tk.LabelFrame(root, text="Run Summary", padx=10, pady=5)
+    summary_frame.pack(fill=tk.X, padx=10, pady=(5,0))
+    summary_columns = [("Stage", 150), ("Seconds", 70), ("Rows in", 90), ("Rows out", 90), ("Rows/s", 90), ("Peak MB", 70)]
+    run_summary_tree = ttk.Treeview(summary_frame, columns=[name for name, _ in summary_columns], show='headings', height=5)
+    for name, width in summary_columns:
+        run_summary_tree.heading(name, text=name)
+        run_summary_tree.column(name, width=width, anchor=tk.W if name == "Stage" else tk.E)
+    run_summary_tree.pack(fill=tk.X)
+
+    status_frame = tk.LabelFrame(root, text="Status & Messages", padx=10, pady=10)
+    status_frame.pack(pady=5, padx=10, fill=tk.BOTH, expand=True)
+    status_text = scrolledtext.ScrolledText(status_frame, height=12, width=80, state=tk.DISABLED, wrap=tk.WORD, relief=tk.SOLID, borderwidth=1)
+    status_text.pack(pady=5, padx=5, fill=tk.BOTH, expand=True)
+
+    save_frame = tk.LabelFrame(root, text="Save Output Files", padx=10, pady=10)
+    save_frame.pack(fill=tk.X, padx=10, pady=(5,10))
+    save_uniques_button = tk.Button(save_frame, text="Save Unique Contacts (CSV)", command=lambda: save_output_file(processed_uniques, new_records_header_global, UNIQUES_FILENAME, "Save Unique Contacts"), state=tk.DISABLED, width=30, bg="#ABEBC6")
+    save_uniques_button.grid(row=0, column=0, padx=10, pady=5)
+    save_duplicates_button = tk.Button(save_frame, text="Save Duplicates for Review (CSV)", command=lambda: save_output_file(processed_duplicates, duplicates_header, DUPLICATES_FILENAME, "Save Duplicates for Review"), state=tk.DISABLED, width=30, bg="#FAD7A0")
+    save_duplicates_button.grid(row=0, column=1, padx=10, pady=5)
+    save_possible_duplicates_button = tk.Button(save_frame, text="Save Possible Duplicates (CSV)", command=lambda: save_output_file(processed_possible_duplicates, possible_duplicates_header, FUZZY_MATCHES_FILENAME, "Save Possible Duplicates"), state=tk.DISABLED, width=30, bg="#F9E79F")
+    save_possible_duplicates_button.grid(row=1, column=0, padx=10, pady=5)
+    save_in_file_duplicates_button = tk.Button(save_frame, text="Save Repeated Contacts (CSV)", command=lambda: save_output_file(processed_in_file_duplicates, in_file_duplicates_header, IN_FILE_DUPLICATES_FILENAME, "Save Repeated Contacts"), state=tk.DISABLED, width=30, bg="#D7BDE2")
+    save_in_file_duplicates_button.grid(row=1, column=1, padx=10, pady=5)
+    view_results_button = tk.Button(save_frame, text="View Results...", command=view_results, state=tk.DISABLED, width=30)
+    view_results_button.grid(row=2, column=0, columnspan=2, padx=10, pady=5)
+    save_frame.columnconfigure((0, 1), weight=1)
+
+def main():
+    build_main_window()
     status_text.config(state=tk.NORMAL)
     status_text.insert(tk.END, f"Welcome to {APP_TITLE}!\n\n")
     status_text.insert(tk.END, "1. Select CRM export & New Records files.\n")
@@ -573,3 +594,7 @@ if __name__ == "__main__":
 
     status_text.config(state=tk.DISABLED)
     root.mainloop()
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support() # Needed by batch processing in frozen builds
+    main()